@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# -About-------------------------------------------------------------------------------
+
+# Version 3
+# Search indexes shared by adiInspector (CLI) and adiWebInspector (Streamlit)
+# Built once per session from the json data file, so lookups never walk the tree
+
+# -Libraries---------------------------------------------------------------------------
+
+import bisect
+import heapq
+import itertools
+import re
+
+# -Variables---------------------------------------------------------------------------
+
+# Max amount of suggestions handed back to the prompt or web input
+MAX_SUGGESTIONS = 10
+
+# Search prefixes that switch the field being completed (same ones the search uses)
+FIELD_PREFIXES = {'@': "Mail", '#': "Division"}
+
+# Fields that get a search index, with the separator their search terms are split by
+SEARCH_FIELDS = {
+    "Name": None,
+    "Mail": '.',
+    "Division": None,
+    "Department": None,
+    "Country": None,
+    "Position": None,
+}
+
+# Fields with tab completion (names, @mail users and #divisions)
+COMPLETION_FIELDS = ["Name", "Mail", "Division"]
+
+# Names accepted in "field:value" clauses
+FIELD_ALIASES = {
+    "name": "Name",
+    "mail": "Mail", "email": "Mail",
+    "division": "Division", "div": "Division",
+    "department": "Department", "dept": "Department",
+    "country": "Country", "ctry": "Country",
+    "position": "Position", "pos": "Position", "seniority": "Position",
+}
+
+# Clauses of a compound query are joined with " in ", e.g. "maria in #finance in [AR]"
+CLAUSE_SEPARATOR = re.compile(r"\s+in\s+", re.IGNORECASE)
+COUNTRY_CLAUSE = re.compile(r"^\[(.*)\]$")
+FIELD_CLAUSE = re.compile(r"^(\w+):(.*)$")
+
+# -Functions---------------------------------------------------------------------------
+
+
+# Sorted array of lowercase keys, each one pointing to the text that gets suggested
+# A prefix lookup is a binary search plus a short scan, so it doesn't care about size
+class PrefixIndex:
+    def __init__(self, pairs):
+        pairs = sorted(set(pairs))
+        self.keys = [key for key, _ in pairs]
+        self.values = [value for _, value in pairs]
+
+    def complete(self, prefix, limit=MAX_SUGGESTIONS):
+        prefix = prefix.lower()
+        suggestions = []
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix):
+            value = self.values[position]
+            if value not in suggestions:
+                suggestions.append(value)
+                if len(suggestions) == limit:
+                    break
+            position += 1
+        return suggestions
+
+
+# Every word start is a key, so "lop" suggests "Maria Lopez" just like "mar" does
+def word_start_keys(text, separator=None):
+    words = text.lower().split(separator)
+    return [(separator or ' ').join(words[i:]) for i in range(len(words))]
+
+
+# Lets bisect run over every suffix of every token without storing the suffix strings
+class SuffixView:
+    def __init__(self, tokens, suffix_tokens, suffix_offsets):
+        self.tokens = tokens
+        self.suffix_tokens = suffix_tokens
+        self.suffix_offsets = suffix_offsets
+
+    def __len__(self):
+        return len(self.suffix_tokens)
+
+    def __getitem__(self, position):
+        return self.tokens[self.suffix_tokens[position]][self.suffix_offsets[position]:]
+
+
+# Inverted index for one field: token -> ids of the people holding it
+# Searches match substrings, so a sorted array of token suffixes finds every token
+# containing a term with a binary search instead of scanning the whole vocabulary
+class FieldIndex:
+    def __init__(self, column, separator=None):
+        postings = {}
+        for node_id, value in enumerate(column):
+            for token in set(value.lower().split(separator)):
+                if token:
+                    postings.setdefault(token, []).append(node_id)
+        self.tokens = sorted(postings)
+        self.postings = [postings[token] for token in self.tokens]
+        suffixes = sorted((token[offset:], token_id) for token_id, token in enumerate(self.tokens) for offset in range(len(token)))
+        self.suffix_tokens = [token_id for _, token_id in suffixes]
+        self.suffix_offsets = [len(self.tokens[token_id]) - len(suffix) for suffix, token_id in suffixes]
+        self.suffixes = SuffixView(self.tokens, self.suffix_tokens, self.suffix_offsets)
+
+    # Ids of the tokens that have the term somewhere inside them
+    def matching_tokens(self, term):
+        token_ids = set()
+        position = bisect.bisect_left(self.suffixes, term)
+        while position < len(self.suffixes) and self.suffixes[position].startswith(term):
+            token_ids.add(self.suffix_tokens[position])
+            position += 1
+        return token_ids
+
+
+def completion_index(field, column):
+    pairs = []
+    if field == "Mail":
+        for mail in column:
+            # Only the user part of the mail, the search drops every '@' it gets
+            user = mail.split('@')[0]
+            pairs.extend((key, user) for key in word_start_keys(user, '.'))
+    else:
+        # Divisions repeat a lot, names barely do
+        for value in (set(column) if field == "Division" else column):
+            pairs.extend((key, value) for key in word_start_keys(value))
+    return PrefixIndex(pairs)
+
+
+# Builds one index part, top level so a process pool can run it; task is (kind, field, column)
+def build_index_part(task):
+    kind, field, column = task
+    if kind == "search":
+        return FieldIndex(column, SEARCH_FIELDS[field])
+    return completion_index(field, column)
+
+
+# Splits a query into (field, terms) predicates
+# Clause syntax: "@mail", "#division", "[country]", "field:value", anything else is a name
+def parse_query(search_input):
+    predicates = []
+    for clause in CLAUSE_SEPARATOR.split(search_input.strip()):
+        field, value = parse_clause(clause)
+        predicates.append((field, [term for term in value.lower().split(SEARCH_FIELDS[field]) if term]))
+    return predicates
+
+
+def parse_clause(clause):
+    clause = clause.strip()
+    country_clause = COUNTRY_CLAUSE.match(clause)
+    field_clause = FIELD_CLAUSE.match(clause)
+    if '@' in clause:
+        return "Mail", clause.replace('@', '')
+    if '#' in clause:
+        return "Division", clause.replace('#', '')
+    if country_clause:
+        return "Country", country_clause.group(1)
+    if field_clause and field_clause.group(1).lower() in FIELD_ALIASES:
+        return FIELD_ALIASES[field_clause.group(1).lower()], field_clause.group(2)
+    return "Name", clause
+
+
+# Flat, column-oriented copy of the org: people are numbered in tree order (pre-order),
+# each field is a column and the hierarchy is kept as parent ids plus child id ranges
+# map_function lets a build spread the indexes over a process pool (see build_index_part)
+class OrgIndex:
+    def __init__(self, tree, map_function=map):
+        self.fields = [key for key in tree[0] if key != "Subordinates"] if tree else list(SEARCH_FIELDS)
+        self.columns = {field: [] for field in self.fields}
+        self.parents = []
+        children = []
+        pending = [(node, -1) for node in reversed(tree)]
+        while pending:
+            node, parent_id = pending.pop()
+            node_id = len(self.parents)
+            # Missing and null values are both kept as "", same as the published store
+            for field in self.fields:
+                value = node.get(field)
+                self.columns[field].append("" if value is None else value)
+            self.parents.append(parent_id)
+            children.append([])
+            if parent_id >= 0:
+                children[parent_id].append(node_id)
+            pending.extend((sub, node_id) for sub in reversed(node.get("Subordinates", [])))
+        # Children of every node laid out back to back, child_offsets[i]:child_offsets[i + 1] are node i's
+        self.child_offsets = [0]
+        self.child_ids = []
+        for node_children in children:
+            self.child_ids.extend(node_children)
+            self.child_offsets.append(len(self.child_ids))
+        self.roots = [node_id for node_id, parent_id in enumerate(self.parents) if parent_id < 0]
+        self.build_indexes(map_function)
+
+    def __len__(self):
+        return len(self.parents)
+
+    # Every search and completion index only needs its own column, so they're built as
+    # independent parts and handed to map_function (plain map, or a pool's map on build)
+    def build_indexes(self, map_function=map):
+        search_fields = [field for field in SEARCH_FIELDS if field in self.columns]
+        tasks = [("search", field, self.columns[field]) for field in search_fields]
+        tasks += [("completion", field, self.columns[field]) for field in COMPLETION_FIELDS]
+        parts = list(map_function(build_index_part, tasks))
+        self.field_indexes = dict(zip(search_fields, parts[:len(search_fields)]))
+        self.completion = dict(zip(COMPLETION_FIELDS, parts[len(search_fields):]))
+
+    # A person's own info, same shape as a tree node without its subordinates
+    def node(self, node_id):
+        return {field: self.columns[field][node_id] for field in self.fields}
+
+    def children(self, node_id):
+        return self.child_ids[self.child_offsets[node_id]:self.child_offsets[node_id + 1]]
+
+    def chain(self, node_id):
+        chain = []
+        while node_id >= 0:
+            chain.append(node_id)
+            node_id = self.parents[node_id]
+        return chain[::-1]
+
+    # Same (path, peers, subordinates) tuple the tree search used to build
+    def match(self, node_id):
+        parent_id = self.parents[node_id]
+        peers = [self.node(peer_id) for peer_id in self.children(parent_id) if peer_id != node_id] if parent_id >= 0 else []
+        path = [self.node(lead_id) for lead_id in self.chain(node_id)]
+        return path, peers, [self.node(sub_id) for sub_id in self.children(node_id)]
+
+    # Streams matching ids in tree order, nothing is collected up front
+    # The predicate with the fewest postings drives: its posting lists are merged lazily and
+    # every other predicate is checked straight on the candidate's own column value
+    # (terms never hold the field's separator, so "term in value" is the same as a token hit)
+    def iter_ids(self, search_input):
+        predicates = []
+        for field, terms in parse_query(search_input):
+            if field not in self.field_indexes:
+                return
+            predicates.extend((field, term) for term in terms)
+        if not predicates:
+            yield from range(len(self))
+            return
+        postings = []
+        for field, term in predicates:
+            token_ids = self.field_indexes[field].matching_tokens(term)
+            postings.append([self.field_indexes[field].postings[token_id] for token_id in token_ids])
+        sizes = [sum(len(posting) for posting in predicate_postings) for predicate_postings in postings]
+        driver = sizes.index(min(sizes))
+        checks = [(self.columns[field], term) for position, (field, term) in enumerate(predicates) if position != driver]
+        last_id = -1
+        for node_id in heapq.merge(*postings[driver]):
+            # A person can hold several tokens with the term in them
+            if node_id == last_id:
+                continue
+            last_id = node_id
+            if all(term in column[node_id].lower() for column, term in checks):
+                yield node_id
+
+    # Lazy stream of (path, peers, subordinates) tuples, optionally capped at limit matches
+    def search(self, search_input, limit=None):
+        return (self.match(node_id) for node_id in itertools.islice(self.iter_ids(search_input), limit))
+
+
+# Picks the field from the last clause of the query ('@' mail, '#' division, otherwise name)
+def suggest(completion_index, search_input, limit=MAX_SUGGESTIONS):
+    head, separator, clause = search_input.rpartition(' in ')
+    head += separator
+    for prefix, field in FIELD_PREFIXES.items():
+        if clause.startswith(prefix):
+            return [head + prefix + value for value in completion_index[field].complete(clause[1:], limit)]
+    return [head + value for value in completion_index["Name"].complete(clause, limit)]
+
+
+# Readline completer, works on the whole line so names with spaces complete in one go
+class SearchCompleter:
+    def __init__(self, completion_index):
+        self.completion_index = completion_index
+        self.last_text = None
+        self.suggestions = []
+
+    def complete(self, text, state):
+        # Readline asks for state 0, 1, 2... with the same text, so suggestions are kept around
+        if text != self.last_text:
+            self.last_text = text
+            self.suggestions = suggest(self.completion_index, text.strip())
+        if state < len(self.suggestions):
+            return self.suggestions[state]
+        return None
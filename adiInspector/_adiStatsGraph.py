@@ -114,6 +114,76 @@ def new_hires_last_months_by_category(tree, months, category):
     return sorted_new_hires_count
 
 
+# Org metrics (Depth, DirectReports, TotalReports) are stored per node at build time,
+# so these only read them and never walk a subtree twice
+def depth_histogram(tree, category):
+    depth_count = defaultdict(lambda: defaultdict(int))
+
+    def people_per_depth(node, accumulator, category):
+        if "Depth" in node:
+            accumulator[node.get(category.title(), f"{category} missing")][node["Depth"]] += 1
+
+    traverse_tree(tree, people_per_depth, depth_count, category)
+
+    sorted_depth_count = OrderedDict(
+        (cat, OrderedDict((f"level {depth}", count) for depth, count in sorted(counts.items())))
+        for cat, counts in sorted(depth_count.items(), key=lambda item: sum(item[1].values()), reverse=True))
+    return sorted_depth_count
+
+
+def span_of_control_histogram(tree, category):
+    span_bracket_count = {}
+    span_brackets = {
+        "1-2": (1, 2),
+        "3-5": (3, 5),
+        "6-8": (6, 8),
+        "9-12": (9, 12),
+        "13-20": (13, 20),
+        "21+": (21, 100000)
+    }
+
+    def managers_per_span_bracket(node, accumulator, category):
+        direct_reports = node.get("DirectReports", 0)
+        for bracket, (min_span, max_span) in span_brackets.items():
+            if min_span <= direct_reports <= max_span:
+                cat = node.get(category.title(), f"{category} missing")
+                if cat not in accumulator:
+                    accumulator[cat] = OrderedDict((name, 0) for name in span_brackets)
+                accumulator[cat][bracket] += 1
+                break
+
+    traverse_tree(tree, managers_per_span_bracket, span_bracket_count, category)
+
+    sorted_span_bracket_count = OrderedDict(sorted(span_bracket_count.items(), key=lambda item: sum(item[1].values()), reverse=True))
+    return sorted_span_bracket_count
+
+
+def managers_by_category(tree, category):
+    managers_count = defaultdict(int)
+
+    def count_managers(node, accumulator, category):
+        if node.get("DirectReports", 0) > 0:
+            accumulator[node.get(category.title(), f"{category} missing")] += 1
+
+    traverse_tree(tree, count_managers, managers_count, category)
+
+    sorted_managers_count = OrderedDict(sorted(managers_count.items(), key=lambda item: item[1], reverse=True))
+    return sorted_managers_count
+
+
+def largest_org_by_category(tree, category):
+    largest_org = defaultdict(int)
+
+    def biggest_total_reports(node, accumulator, category):
+        cat = node.get(category.title(), f"{category} missing")
+        accumulator[cat] = max(accumulator[cat], node.get("TotalReports", 0))
+
+    traverse_tree(tree, biggest_total_reports, largest_org, category)
+
+    sorted_largest_org = OrderedDict(sorted(largest_org.items(), key=lambda item: item[1], reverse=True))
+    return sorted_largest_org
+
+
 def filter_tree_by_category(tree, filtr, value):
     if not filtr:
         return tree if isinstance(tree, list) else [tree]
@@ -177,6 +247,9 @@ def module_selector():
         print("Error: The file could not be decoded. Please check the JSON format.")
         return
 
+    if tree and "TotalReports" not in tree[0]:
+        print("Warning: The data file has no org metrics, rebuild it (-b) to get org depth, span and size stats.")
+
     # Menu options
     options = {
         '1': 'Count Employees',
@@ -187,6 +260,14 @@ def module_selector():
         '6': 'Average Retention Chart',
         '7': 'New Hires',
         '8': 'New Hires Chart',
+        '9': 'Org Depth',
+        '10': 'Org Depth Chart',
+        '11': 'Span of Control',
+        '12': 'Span of Control Chart',
+        '13': 'Managers',
+        '14': 'Managers Chart',
+        '15': 'Largest Org Size',
+        '16': 'Largest Org Size Chart',
         '0': 'Exit'
     }
 
@@ -271,6 +352,50 @@ def module_selector():
             else:
                 print_stats_with_bars(country_stats, f"New Hires (last {months} months)", category, filtr, value)
 
+        elif choice in ('9', '10', '11', '12'):
+            stat_title = "Org Depth" if choice in ('9', '10') else "Span of Control"
+            print(f"{C_TITLE}\n==={stat_title}==={ENDC}")
+            category = input(f"\n{C_TEXT_1}Categorize by (cannot be blank){ENDC}: ").strip()
+            while not category:
+                print("Category cannot be blank. Please enter a valid term.")
+                category = input(f"\n{C_TEXT_1}Categorize by (cannot be blank){ENDC}: ").strip()
+            filtr = input(f"\n{C_TEXT_1}[Optional] Filter by (leave blank for all){ENDC}: ").strip()
+            value = ""
+            if filtr:
+                value = input(f"\n{C_TEXT_1}Enter value for '{filtr}'{ENDC}: ").strip()
+            subtree = filter_tree_by_category(tree[0], filtr, value)
+            if choice in ('9', '10'):
+                org_stats = depth_histogram(subtree, category)
+            else:
+                org_stats = span_of_control_histogram(subtree, category)
+            # One histogram per category value
+            for cat, histogram in org_stats.items():
+                if choice in ('9', '11'):
+                    print_stats(histogram, f"{stat_title} ({cat})", category, filtr, value)
+                else:
+                    print_stats_with_bars(histogram, f"{stat_title} ({cat})", category, filtr, value)
+
+        elif choice in ('13', '14', '15', '16'):
+            stat_title = "Managers" if choice in ('13', '14') else "Largest Org Size"
+            print(f"{C_TITLE}\n==={stat_title}==={ENDC}")
+            category = input(f"\n{C_TEXT_1}Categorize by (cannot be blank){ENDC}: ").strip()
+            while not category:
+                print("Category cannot be blank. Please enter a valid term.")
+                category = input(f"\n{C_TEXT_1}Categorize by (cannot be blank){ENDC}: ").strip()
+            filtr = input(f"\n{C_TEXT_1}[Optional] Filter by (leave blank for all){ENDC}: ").strip()
+            value = ""
+            if filtr:
+                value = input(f"\n{C_TEXT_1}Enter value for '{filtr}'{ENDC}: ").strip()
+            subtree = filter_tree_by_category(tree[0], filtr, value)
+            if choice in ('13', '14'):
+                org_stats = managers_by_category(subtree, category)
+            else:
+                org_stats = largest_org_by_category(subtree, category)
+            if choice in ('13', '15'):
+                print_stats(org_stats, stat_title, category, filtr, value)
+            else:
+                print_stats_with_bars(org_stats, stat_title, category, filtr, value)
+
         else:
             print("Invalid choice. Please try again.")
 
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# -About-------------------------------------------------------------------------------
+
+# Version 1
+# Read-only, memory-mapped copy of the org data and search indexes (see _adiIndex)
+# Published once per build, every process that attaches shares the same pages
+# File layout: magic, format, toc length, json toc, then 8-byte aligned sections
+
+# -Libraries---------------------------------------------------------------------------
+
+import json
+import mmap
+import os
+import struct
+try:
+    import fcntl
+except ImportError:
+    # Windows, the CLI publishes from a single process anyway
+    fcntl = None
+from array import array
+from _adiIndex import OrgIndex, FieldIndex, PrefixIndex, SuffixView
+
+# -Variables---------------------------------------------------------------------------
+
+ORG_STORE_FILE = 'adi_data_file.store'
+STORE_MAGIC    = b'ADISTORE'
+STORE_FORMAT   = 1
+STORE_HEADER   = struct.Struct('<8sII')
+ALIGNMENT      = 8
+
+# -Functions---------------------------------------------------------------------------
+
+
+# Strings packed into one utf-8 blob, offsets[i]:offsets[i + 1] is string i
+# Only the string being read gets decoded, the rest stays in the mapped file
+class StringColumn:
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("string column index out of range")
+        return str(self.blob[self.offsets[position]:self.offsets[position + 1]], 'utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+# List of lists packed the same way, used for the postings of every token
+class PackedLists:
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.values[self.offsets[position]:self.offsets[position + 1]]
+
+
+# Collects sections while publishing, each one is raw bytes plus its typecode
+class StoreWriter:
+    def __init__(self):
+        self.sections = {}
+
+    def add_array(self, name, typecode, values):
+        self.sections[name] = (typecode, array(typecode, values).tobytes())
+
+    def add_strings(self, name, values):
+        offsets = [0]
+        blob = bytearray()
+        for value in values:
+            blob += value.encode('utf-8')
+            offsets.append(len(blob))
+        self.add_array(name + ".offsets", 'q', offsets)
+        self.sections[name + ".blob"] = ('B', bytes(blob))
+
+    def add_lists(self, name, lists):
+        offsets = [0]
+        values = []
+        for item in lists:
+            values.extend(item)
+            offsets.append(len(values))
+        self.add_array(name + ".offsets", 'q', offsets)
+        self.add_array(name + ".values", 'i', values)
+
+    def write(self, file_name, toc):
+        toc["sections"] = {}
+        position = 0
+        for name, (typecode, data) in self.sections.items():
+            toc["sections"][name] = [position, len(data), typecode]
+            position += len(data) + (-len(data) % ALIGNMENT)
+        toc_bytes = json.dumps(toc).encode('utf-8')
+        header = STORE_HEADER.pack(STORE_MAGIC, STORE_FORMAT, len(toc_bytes)) + toc_bytes
+        header += b'\0' * (-len(header) % ALIGNMENT)
+        # Written next to the live file and renamed over it, readers either see the old
+        # version or the new one, never half of each
+        temp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(temp_name, 'wb') as f:
+            f.write(header)
+            for typecode, data in self.sections.values():
+                f.write(data)
+                f.write(b'\0' * (-len(data) % ALIGNMENT))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, file_name)
+
+
+# Writes an OrgIndex (columns, hierarchy, field indexes and completion) to the store file
+def publish_store(org_index, file_name=ORG_STORE_FILE):
+    writer = StoreWriter()
+    column_types = {}
+    for field in org_index.fields:
+        column = org_index.columns[field]
+        if all(isinstance(value, int) for value in column):
+            column_types[field] = 'q'
+            writer.add_array(f"column.{field}", 'q', column)
+        else:
+            column_types[field] = 's'
+            # Missing values go in empty, a literal "None" would show up in (and match) searches
+            writer.add_strings(f"column.{field}", ["" if value is None else str(value) for value in column])
+    writer.add_array("parents", 'i', org_index.parents)
+    writer.add_array("child_offsets", 'i', org_index.child_offsets)
+    writer.add_array("child_ids", 'i', org_index.child_ids)
+    writer.add_array("roots", 'i', org_index.roots)
+    for field, field_index in org_index.field_indexes.items():
+        writer.add_strings(f"index.{field}.tokens", field_index.tokens)
+        writer.add_lists(f"index.{field}.postings", field_index.postings)
+        writer.add_array(f"index.{field}.suffix_tokens", 'i', field_index.suffix_tokens)
+        writer.add_array(f"index.{field}.suffix_offsets", 'i', field_index.suffix_offsets)
+    for field, prefix_index in org_index.completion.items():
+        writer.add_strings(f"completion.{field}.keys", prefix_index.keys)
+        writer.add_strings(f"completion.{field}.values", prefix_index.values)
+    toc = {
+        "fields": org_index.fields,
+        "column_types": column_types,
+        "field_indexes": list(org_index.field_indexes),
+        "completion": list(org_index.completion),
+    }
+    writer.write(file_name, toc)
+
+
+# Maps the store file and wires an OrgIndex straight on top of it, nothing is parsed or copied
+def attach_store(file_name=ORG_STORE_FILE):
+    with open(file_name, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, store_format, toc_length = STORE_HEADER.unpack_from(view)
+    if magic != STORE_MAGIC or store_format != STORE_FORMAT:
+        raise ValueError(f"{file_name} is not an ADI store (format {STORE_FORMAT})")
+    toc_end = STORE_HEADER.size + toc_length
+    toc = json.loads(str(view[STORE_HEADER.size:toc_end], 'utf-8'))
+    data_start = toc_end + (-toc_end % ALIGNMENT)
+
+    def section(name):
+        offset, length, typecode = toc["sections"][name]
+        return view[data_start + offset:data_start + offset + length].cast(typecode)
+
+    def strings(name):
+        return StringColumn(section(name + ".offsets"), section(name + ".blob"))
+
+    org_index = OrgIndex.__new__(OrgIndex)
+    org_index.fields = toc["fields"]
+    org_index.columns = {}
+    for field in org_index.fields:
+        if toc["column_types"][field] == 'q':
+            org_index.columns[field] = section(f"column.{field}")
+        else:
+            org_index.columns[field] = strings(f"column.{field}")
+    org_index.parents = section("parents")
+    org_index.child_offsets = section("child_offsets")
+    org_index.child_ids = section("child_ids")
+    org_index.roots = section("roots")
+    org_index.field_indexes = {}
+    for field in toc["field_indexes"]:
+        field_index = FieldIndex.__new__(FieldIndex)
+        field_index.tokens = strings(f"index.{field}.tokens")
+        field_index.postings = PackedLists(section(f"index.{field}.postings.offsets"), section(f"index.{field}.postings.values"))
+        field_index.suffix_tokens = section(f"index.{field}.suffix_tokens")
+        field_index.suffix_offsets = section(f"index.{field}.suffix_offsets")
+        field_index.suffixes = SuffixView(field_index.tokens, field_index.suffix_tokens, field_index.suffix_offsets)
+        org_index.field_indexes[field] = field_index
+    org_index.completion = {}
+    for field in toc["completion"]:
+        prefix_index = PrefixIndex.__new__(PrefixIndex)
+        prefix_index.keys = strings(f"completion.{field}.keys")
+        prefix_index.values = strings(f"completion.{field}.values")
+        org_index.completion[field] = prefix_index
+    org_index.store_version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return org_index
+
+
+# Store is missing or older than the json data file it should mirror
+def store_is_stale(store_file=ORG_STORE_FILE, data_file=None):
+    if not os.path.exists(store_file):
+        return True
+    return bool(data_file) and os.path.exists(data_file) and os.path.getmtime(data_file) > os.path.getmtime(store_file)
+
+
+# Rebuilds and publishes the store only if it's stale, holding a lock file while checking and
+# publishing so concurrent workers don't all parse the json: the first one builds, the rest
+# wait on the lock and then find the store fresh
+# build_index returns the OrgIndex to publish, or None if the data can't be loaded
+def publish_if_stale(data_file, build_index, store_file=ORG_STORE_FILE):
+    with open(store_file + ".lock", 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not store_is_stale(store_file, data_file):
+            return False
+        org_index = build_index()
+        if org_index is None:
+            return False
+        publish_store(org_index, store_file)
+        return True
+
+
+# Keeps one process attached to the latest published store
+# current() is cheap (a stat), and picks up a new build on the next call after it lands
+class StoreHandle:
+    def __init__(self, file_name=ORG_STORE_FILE):
+        self.file_name = file_name
+        self.org_index = None
+
+    def current(self):
+        try:
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            return None
+        if self.org_index is None or self.org_index.store_version != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            # The old mapping is released once nothing references it anymore
+            self.org_index = attach_store(self.file_name)
+        return self.org_index
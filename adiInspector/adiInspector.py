@@ -5,19 +5,33 @@
 # Version 18
 # Gustavo Pico Bosch, April 2024 (Rev. October 2024)
 # Option -h, --help          displays a brief help menu
-# Option -b, --build         takes in ADI.tsv and builds data file
+# Option -b, --build         takes in ADI.tsv (or the given exports/globs) and builds data file
+# Option -j, --jobs          worker processes used to parse exports and build indexes on build
 # Option -s, --search        (set by default) searches the data file
 # Option -st, --stats        generate statistics from the data file
 # Option -f, --full-strings  disables string cropping, may break output formatting
+# Option -l, --limit         caps the amount of matches listed for a search
 
 # -Libraries---------------------------------------------------------------------------
 
 import argparse
+import glob
+import io
+import itertools
 import json
 import os
-import copy
 import yaml
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from _adiIndex import OrgIndex, SearchCompleter
+from _adiStore import ORG_STORE_FILE, publish_store, attach_store, store_is_stale
+
+# Readline is missing on some platforms (Windows), tab completion is skipped there
+try:
+    import readline
+except ImportError:
+    readline = None
 
 # -Variables---------------------------------------------------------------------------
 
@@ -30,6 +44,12 @@ ADI_CONFIG_FILE  = '_adiConfig.yml'
 # Column sizes
 CANVAS_PARAMS = [47, 28, 47, 47]
 
+# Smallest piece of a source file handed to a build worker
+BUILD_MIN_CHUNK_BYTES = 1024 * 1024
+
+# Matches listed per page when a search is ambiguous
+MATCH_PAGE_SIZE = 20
+
 # ADI Table Column Numbers Correspondence
 COL_CTRY = 2
 COL_NAME = 3
@@ -111,16 +131,31 @@ def load_data_file(file_name):
         return None
 
 
-def search_and_display(tree, search_input, full_strings):
-    if '@' in search_input:
-        all_matches = find_in_tree(tree, search_input.replace('@', ''), search_by="email")
-    elif '#' in search_input:
-        all_matches = find_in_tree(tree, search_input.replace('#', ''), search_by="division")
-    else:
-        all_matches = find_in_tree(tree, search_input, search_by="name")
+# Attaches the memory-mapped store when it's up to date, otherwise builds the index from
+# the json data file and publishes it so the next run (or web worker) can just attach
+def load_org_index():
+    if not store_is_stale(ORG_STORE_FILE, JSON_DATA_FILE):
+        try:
+            return attach_store(ORG_STORE_FILE)
+        except (OSError, ValueError) as e:
+            print(f"Couldn't attach {ORG_STORE_FILE}, falling back to {JSON_DATA_FILE}: {e}")
+    tree = load_data_file(JSON_DATA_FILE)
+    if tree is None:
+        return None
+    org_index = OrgIndex(tree)
+    try:
+        publish_store(org_index, ORG_STORE_FILE)
+    except OSError as e:
+        print(f"Couldn't publish {ORG_STORE_FILE}: {e}")
+    return org_index
 
-    search_by = "email" if '@' in search_input else "division" if search_input.startswith("#") else "name"
-    chosen_match = choose_match(all_matches, search_by)
+
+# Queries can combine clauses with "in": name, @mail, #division, [country] or field:value
+# e.g. "maria in #finance in [AR]" or "juan in dept:payments in pos:lead"
+# Matches come in as a lazy stream, optionally capped by limit
+def search_and_display(org_index, search_input, full_strings, limit=None):
+    all_matches = org_index.search(search_input, limit)
+    chosen_match = choose_match(all_matches)
 
     if chosen_match:
         result, peers, subs = chosen_match
@@ -129,21 +164,37 @@ def search_and_display(tree, search_input, full_strings):
         print("No matches found\n")
 
 
-def search_org(full_strings):
-    tree = load_data_file(JSON_DATA_FILE)
-    if tree is None:
+def search_org(full_strings, limit=None):
+    org_index = load_org_index()
+    if org_index is None:
         return
     
     search_input = input(f"\n{C_FRAME}Enter a{C_TEXT_2} name, email[@], {C_FRAME}or {C_TEXT_2}[#]division {C_FRAME}to search: {ENDC}{C_TEXT_1}").strip()
     print(f"{ENDC}")
     
-    search_and_display(tree, search_input, full_strings)
+    search_and_display(org_index, search_input, full_strings, limit)
 
 
-def explore_org(full_strings):
-    tree = load_data_file(JSON_DATA_FILE)
-    if tree is None:
+# Hooks tab completion for names, emails[@] and divisions[#] into the input prompt
+def enable_completion(org_index):
+    if readline is None:
+        return
+    completer = SearchCompleter(org_index.completion)
+    readline.set_completer(completer.complete)
+    # Whole line is completed, names have spaces in them
+    readline.set_completer_delims('')
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+
+
+def explore_org(full_strings, limit=None):
+    # Index is loaded once per session, every prompt after that reuses it
+    org_index = load_org_index()
+    if org_index is None:
         return
+    enable_completion(org_index)
 
     while True:
         print('\n')
@@ -151,67 +202,46 @@ def explore_org(full_strings):
         print(f"{ENDC}")
         if search_input.lower() == 'exit':
             break
-        tree_copy = copy.deepcopy(tree)
-        search_and_display(tree_copy, search_input, full_strings)
+        search_and_display(org_index, search_input, full_strings, limit)
 
 
-# This is the one that actually paces the tree in search for stuff
-def find_in_tree(current_tree, search_value, boss=None, path=[], search_by="name"):
-    # Since searches can be ambiguous and matches can be more than one, they're saved in a list
-    matches = []
-    if search_by == "email":
-        search_terms = search_value.lower().split('.')  # Split terms for partial matching
-    else:
-        search_terms = search_value.lower().split()  # Split terms for partial matching
-    for node in current_tree:
-        # Stores node info without subs (so just that person's info)
-        clean_node = {k: v for k, v in node.items() if k != "Subordinates"}
-
-        # Perform matching depending on the search criteria (name, email, division)
-        if search_by == "name" and compare_strings(search_terms, node["Name"].lower()):
-            matches.append((path + [clean_node], boss.get("Subordinates", []) if boss else [], node.get("Subordinates", [])))
-        elif search_by == "email" and compare_strings(search_terms, node["Mail"].lower()):
-            matches.append((path + [clean_node], boss.get("Subordinates", []) if boss else [], node.get("Subordinates", [])))
-        elif search_by == "division" and compare_strings(search_terms, node["Division"].lower()):
-            matches.append((path + [clean_node], boss.get("Subordinates", []) if boss else [], node.get("Subordinates", [])))
-
-        # If this node has subs, search recursively
-        if "Subordinates" in node:
-            result = find_in_tree(node["Subordinates"], search_value, boss=node, path=path + [clean_node], search_by=search_by)
-            if result:
-                matches.extend(result)
-    return matches
-
-
-# Breaks down search terms into words and compares to current node being looked at
-def compare_strings(search_terms, target_string):
-    return all(substring in target_string for substring in search_terms)
-
-
-# Takes matches and responds accordingly
-def choose_match(matches, search_by="name"):
+# Takes a stream of matches and responds accordingly, only one page is ever pulled from it
+def choose_match(matches, page_size=MATCH_PAGE_SIZE):
+    matches = iter(matches)
+    # One extra match is read ahead, just to know whether there's another page
+    page = list(itertools.islice(matches, page_size + 1))
     # If no matches, skip
-    if not matches:
+    if not page:
         return None
     # If just one match, return just that match, no selection
-    if len(matches) == 1:
-        return matches[0]
+    if len(page) == 1:
+        return page[0]
     # If matches exist and are more than 1, show selection
     print(f"\n{C_FRAME}These are the possible matches: {C_TEXT_1}")
     print(f"{ENDC}")
-    # Prints out numbered list of matches
-    for i, match in enumerate(matches):
-        # Extracts both name and division to display
-        name = match[0][-1]["Name"]
-        division = match[0][-1].get("Division", "No division")
-        print(f"{C_TEXT_1}\t{i+1}. {name} {C_TEXT_2}[{division.title()}]{ENDC}")
-    # Ask idiot for choice by match number
-    choice = int(input(f"\n{C_FRAME}Select an option by number: {C_TEXT_1}"))
-    # If bad choice, bail out
-    if choice < 1 or choice > len(matches):
-        return None
-    # If happy trail, return match to be displayed
-    return matches[choice - 1]
+    first_number = 1
+    while True:
+        shown = page[:page_size]
+        more_pages = len(page) > page_size
+        # Prints out numbered list of matches
+        for i, match in enumerate(shown, first_number):
+            # Extracts both name and division to display
+            name = match[0][-1]["Name"]
+            division = match[0][-1].get("Division", "No division")
+            print(f"{C_TEXT_1}\t{i}. {name} {C_TEXT_2}[{division.title()}]{ENDC}")
+        # Ask idiot for choice by match number, or for the next page
+        more_hint = f" {C_TEXT_2}([Enter] for more){C_FRAME}" if more_pages else ""
+        choice = input(f"\n{C_FRAME}Select an option by number{more_hint}: {C_TEXT_1}").strip()
+        print(f"{ENDC}")
+        if not choice and more_pages:
+            first_number += page_size
+            page = page[page_size:] + list(itertools.islice(matches, page_size))
+            continue
+        # If bad choice, bail out
+        if not choice.isdigit() or not first_number <= int(choice) < first_number + len(shown):
+            return None
+        # If happy trail, return match to be displayed
+        return shown[int(choice) - first_number]
 
 
 # Prints the output for matches
@@ -224,13 +254,16 @@ def print_frame(result, peers, subs, full_strings=False):
     titles = [{"Country":"CTRY", "Name": f"Started on: {ingress_date} ({days_in_company} days)", "Division": "#DIVISION", "Position": "SENIORITY", "Mail": "E-Mail Address @"}]
     # Catches match
     target = [result[-1]]
-    # Iterates through peers list to remove the match (otherwise match is shown as peer of itself)
-    for peer in peers:
-        if peer['Name'] == target[0]['Name']:
-            peers.remove(peer)
+    # Filters the match out of the peers list (otherwise match is shown as peer of itself)
+    # A new list is built so the loaded tree stays untouched between searches
+    peers = [peer for peer in peers if peer['Name'] != target[0]['Name']]
+    # Org size comes precomputed from the build, older data files just don't show it
+    match_header = "YOUR SEARCH MATCH"
+    if "TotalReports" in target[0]:
+        match_header += f" (org size: {target[0]['TotalReports']} | direct: {target[0]['DirectReports']} | level: {target[0]['Depth']}) "
     # Prints header, match, leads, peers and subs
     print_block("", titles, full_strings=full_strings)
-    print_block("YOUR SEARCH MATCH", target, full_strings=full_strings)
+    print_block(match_header, target, full_strings=full_strings)
     print_block("CHAIN OF LEADS", result[:-1], full_strings=full_strings)
     print_block("PEERS", peers, full_strings=full_strings)
     print_block("SUBORDINATES", subs, full_strings=full_strings)
@@ -272,27 +305,116 @@ def crop_string(value, max_width):
     return value
 
 
-# Builds json data file
-def build_org():
+# Builds json data file from one or more ADI exports (file names or globs)
+# Two steps run in a process pool, one worker per job: parsing and normalizing the sources
+# (cut into chunks) and building the search and completion indexes (one per field)
+# Merging, linking the tree, the org metrics and writing the files stay serial, they're
+# single passes over the rows and take a small part of the build
+def build_org(sources=None, jobs=None):
     # Notify idiot
     print("Building data file. This may take a few seconds...")
-    # Tries to open source file, load contents
+    # Makes excuses for every source that can't be found
+    file_names = expand_sources(sources or [ADI_TSV_FILE])
+    if not file_names:
+        return
+    jobs = jobs or os.cpu_count() or 1
+    start_time = datetime.now()
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    map_function = pool.map if pool else map
     try:
-        with open(ADI_TSV_FILE, 'r') as tab:
-            # First, toss out the header row
-            tab.readline()
-            # Then, read useful rows
-            entries = tab.readlines()
+        # Tries to open source files, load contents
+        try:
+            parsed_sources = parse_sources(file_names, jobs, map_function)
+        except OSError as e:
+            print("Couldn't read source file", e.filename)
+            return
+        # Merges every source into one list of rows, duplicates across (or within) files are reported
+        rows = merge_sources(parsed_sources)
         # Sends all rows to be processed into a tree structure, catches it
-        desp_tree = tree_builder("", entries)
-        # Saves tree to file
+        desp_tree, linked = tree_builder(rows)
+        if linked < len(rows):
+            unlinked = [employee_data["Name"] for name_key, boss_key, employee_data in rows if "Subordinates" not in employee_data]
+            print(f"{len(unlinked)} people couldn't be linked to the org (boss missing from every source, or circular): {', '.join(unlinked[:10])}{'...' if len(unlinked) > 10 else ''}")
+        # Stores org size, span and depth on every node so nothing has to walk subtrees later
+        compute_org_metrics(desp_tree)
+        # Saves tree to file, dumps() in one go uses the C encoder (dump() to a file doesn't)
         with open(JSON_DATA_FILE, 'w') as f:
-            json.dump(desp_tree, f, indent=None)
-            # Notifies idiot
-            print("Data file successfully built.")
-    except:
-        # Makes excuses
-        print("Couldn't find source file", ADI_TSV_FILE)
+            f.write(json.dumps(desp_tree, indent=None))
+        # Publishes the indexed copy that searches and web workers attach to
+        publish_store(OrgIndex(desp_tree, map_function), ORG_STORE_FILE)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    # Notifies idiot
+    elapsed = (datetime.now() - start_time).total_seconds()
+    print(f"Data file successfully built: {linked} people from {len(file_names)} source file(s) in {elapsed:.2f}s ({jobs} jobs).")
+
+
+# Expands globs (shells on Windows don't), keeping the order sources were given in
+def expand_sources(sources):
+    file_names = []
+    for source in sources:
+        matches = sorted(glob.glob(source)) if glob.has_magic(source) else [source] if os.path.exists(source) else []
+        if not matches:
+            print("Couldn't find source file", source)
+        file_names.extend(name for name in matches if name not in file_names)
+    return file_names
+
+
+# Cuts a source file into byte ranges that end on line breaks, skipping the header row
+def split_source(file_name, chunk_count):
+    size = os.path.getsize(file_name)
+    chunk_size = max(size // chunk_count, BUILD_MIN_CHUNK_BYTES)
+    chunks = []
+    with open(file_name, 'rb') as tab:
+        # First, toss out the header row
+        tab.readline()
+        start = tab.tell()
+        while start < size:
+            tab.seek(start + chunk_size)
+            tab.readline()
+            end = min(tab.tell(), size)
+            chunks.append((file_name, start, end))
+            start = end
+    return chunks
+
+
+# Reads and parses one chunk of a source file, runs inside the process pool
+def parse_source_chunk(chunk):
+    file_name, start, end = chunk
+    with open(file_name, 'rb') as tab:
+        tab.seek(start)
+        data = tab.read(end - start)
+    # Same decoding and newline handling a plain open(file_name, 'r') would give
+    entries = io.TextIOWrapper(io.BytesIO(data)).readlines()
+    return parse_adi_rows(entries)
+
+
+def parse_sources(file_names, jobs, map_function=map):
+    chunks = [chunk for file_name in file_names for chunk in split_source(file_name, jobs * 4)]
+    results = list(map_function(parse_source_chunk, chunks))
+    return [(chunk[0], rows, skipped) for chunk, (rows, skipped) in zip(chunks, results)]
+
+
+# Keeps the first row seen for every name (the boss column links by name), reports the rest
+def merge_sources(parsed_sources):
+    seen = {}
+    rows = []
+    duplicates = []
+    skipped = 0
+    for file_name, source_rows, source_skipped in parsed_sources:
+        skipped += source_skipped
+        for row in source_rows:
+            if row[0] in seen:
+                duplicates.append(f"{row[2]['Name']} ({seen[row[0]]} / {file_name})")
+            else:
+                seen[row[0]] = file_name
+                rows.append(row)
+    if skipped:
+        print(f"{skipped} malformed rows skipped")
+    if duplicates:
+        print(f"{len(duplicates)} duplicate entries ignored: {', '.join(duplicates[:10])}{'...' if len(duplicates) > 10 else ''}")
+    return rows
 
 
 def replace_spanish_characters(text):
@@ -305,38 +427,74 @@ def replace_spanish_characters(text):
         text = text.replace(special_char, normal_char)
     return text
 
-def tree_builder(boss, entries):
-    # Initializes highest level
-    hierarchy = []
-    # Starts reading ADI rows
+
+# Turns ADI rows into (name key, boss key, employee data) tuples
+# Keys are the raw lowercase ADI names, since that's what the boss column points to
+def parse_adi_rows(entries):
+    rows = []
+    skipped = 0
     for entry in entries:
         # Since it's a .tsv file, splits row by tabs
         seg_entry = entry.split("\t")
-        # Matches current node's boss with upper node's name, to form hierarchy
-        if seg_entry[COL_BOSS].lower() == boss.lower():
-            # Initializes node dictionary
-            employee_data = {}
-            # Extracts and replaces special characters for all fields
-            full_name = replace_spanish_characters(seg_entry[COL_NAME].lower())
-            first_name = full_name.split(',')[1].strip().title()
-            last_name = full_name.split(',')[0].strip().title()
-
-            employee_data["Name"] = first_name + ' ' + last_name
-            employee_data["DateOfBirth"] = replace_spanish_characters(seg_entry[COL__DOB])
-            employee_data["Country"] = replace_spanish_characters(seg_entry[COL_CTRY].upper())
-            employee_data["Ingress"] = replace_spanish_characters(seg_entry[COL_INGR])
-            employee_data["Position"] = replace_spanish_characters(seg_entry[COL_SENI].lower())
-            employee_data["Division"] = replace_spanish_characters(seg_entry[COL_SECT].lower())
-            employee_data["Department"] = replace_spanish_characters(seg_entry[COL_DEPT].lower())
-            employee_data["Mail"] = replace_spanish_characters(seg_entry[COL_MAIL].lower())
-
+        if len(seg_entry) <= max(COL_BOSS, COL_DEPT) or ',' not in seg_entry[COL_NAME]:
+            skipped += 1
+            continue
+        # Initializes node dictionary
+        employee_data = {}
+        # Extracts and replaces special characters for all fields
+        full_name = replace_spanish_characters(seg_entry[COL_NAME].lower())
+        first_name = full_name.split(',')[1].strip().title()
+        last_name = full_name.split(',')[0].strip().title()
+
+        employee_data["Name"] = first_name + ' ' + last_name
+        employee_data["DateOfBirth"] = replace_spanish_characters(seg_entry[COL__DOB])
+        employee_data["Country"] = replace_spanish_characters(seg_entry[COL_CTRY].upper())
+        employee_data["Ingress"] = replace_spanish_characters(seg_entry[COL_INGR])
+        employee_data["Position"] = replace_spanish_characters(seg_entry[COL_SENI].lower())
+        employee_data["Division"] = replace_spanish_characters(seg_entry[COL_SECT].lower())
+        employee_data["Department"] = replace_spanish_characters(seg_entry[COL_DEPT].lower())
+        employee_data["Mail"] = replace_spanish_characters(seg_entry[COL_MAIL].lower())
+
+        rows.append((seg_entry[COL_NAME].lower(), seg_entry[COL_BOSS].lower(), employee_data))
+    return rows, skipped
+
+
+# Links rows into the org tree using a boss -> subordinates map, so every row is visited once
+# Returns the tree and the amount of people that made it into it
+def tree_builder(rows):
+    subordinates = defaultdict(list)
+    for name_key, boss_key, employee_data in rows:
+        subordinates[boss_key].append((name_key, employee_data))
+
+    def attach(boss_key):
+        # Initializes this level
+        hierarchy = []
+        for name_key, employee_data in subordinates.pop(boss_key, []):
             # Creates subs list, fills it with recursive nonsense
-            employee_data["Subordinates"] = tree_builder(seg_entry[3].lower(), entries)
+            # (the boss' own list was popped already, so loops in the data can't recurse forever)
+            employee_data["Subordinates"] = attach(name_key)
             # Plugs whole node to hierarchy
             hierarchy.append(employee_data)
-    # By returning hierarchy here, each lower recursion will be saved to the "subordinates" attribute
-    # Thus is the tree structure achieved
-    return hierarchy
+        return hierarchy
+
+    # Top of the org is whoever has no boss
+    desp_tree = attach("")
+    return desp_tree, len(rows) - sum(len(subs) for subs in subordinates.values())
+
+
+# Single post-order pass that stores span-of-control and depth metrics on every node
+# Each node gets its level in the org, its direct reports and its total (direct + indirect) reports
+# Returns the amount of people in the given list of nodes, including everyone below them
+def compute_org_metrics(nodes, depth=0):
+    org_size = 0
+    for node in nodes:
+        subs = node.get("Subordinates", [])
+        node["Depth"] = depth
+        node["DirectReports"] = len(subs)
+        # Children are solved first, so each subtree is only ever walked once
+        node["TotalReports"] = compute_org_metrics(subs, depth + 1)
+        org_size += 1 + node["TotalReports"]
+    return org_size
 
 
 # Stats are pretty
@@ -394,29 +552,35 @@ def main():
     by name, email, or division. Use it to quickly find specific information and explore
     the organizational structure with ease. Simply input the search term, and the tool will 
     guide you through potential matches and details.
+
+    Search terms can be combined with "in" to narrow results down in one go:
+        name, @email, #division, [country], dept:department, pos:position
+        e.g. maria in #finance in [AR]
 """,formatter_class=argparse.RawTextHelpFormatter)
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-s", "--search", action="store_true", help="one-time search (default)", default=True)
-    group.add_argument("-b", "--build", action="store_true", help="build json data file (from " + ADI_TSV_FILE + " in same directory)")
+    group.add_argument("-b", "--build", nargs='*', metavar="TSV", help="build json data file from ADI exports, files or globs (default " + ADI_TSV_FILE + " in same directory)")
     group.add_argument("-e", "--explore", action="store_true", help="looping search until user exits")
     group.add_argument("-t", "--theme", action="store_true", help="check and set the color theme")
     parser.add_argument("-st", "--stats", action="store_true", help="generate statistics from data")
     parser.add_argument("-f", "--full_strings", action="store_true", help="show full strings without cropping (default crops overflow)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes used to parse ADI exports and build the indexes (default: one per core)")
+    parser.add_argument("-l", "--limit", type=int, default=None, help="max amount of matches to list for a search (default lists all, " + str(MATCH_PAGE_SIZE) + " per page)")
 
     args = parser.parse_args()
     initialize_theme()
 
-    if args.build:
-        build_org()
+    if args.build is not None:
+        build_org(args.build, args.jobs)
     elif args.theme:
         theme_manager()
     elif args.stats:
         generate_stats()
     elif args.explore:
-        explore_org(full_strings=args.full_strings)
+        explore_org(full_strings=args.full_strings, limit=args.limit)
     elif args.search:
-        search_org(full_strings=args.full_strings)
+        search_org(full_strings=args.full_strings, limit=args.limit)
 
 
 # Python main guard
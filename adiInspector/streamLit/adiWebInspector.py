@@ -1,8 +1,17 @@
 import streamlit as st
+import itertools
 import json
+import os
+import sys
 import pandas as pd
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from _adiIndex import OrgIndex, suggest
+from _adiStore import ORG_STORE_FILE, StoreHandle, publish_if_stale, store_is_stale
 
 JSON_DATA_FILE = 'adi_data_file.json'
+SEARCH_PREFIXES = {"Name": "", "Email": "@", "Division": "#"}
+MATCH_LIMIT = 500
+ORG_CHART_INDENT = "\u2003\u2003"
 
 st.set_page_config(layout="wide")
 
@@ -16,59 +25,65 @@ def load_data_file(file_name):
         return None
 
 
-def search_and_display(tree, query, search_type):
-    if search_type == "Email":
-        all_matches = find_in_tree(tree, query.replace('@', ''), search_by="email")
-    elif search_type == "Division":
-        all_matches = find_in_tree(tree, query.replace('#', ''), search_by="division")
-    elif search_type == "Name":
-        all_matches = find_in_tree(tree, query, search_by="name")
+# One handle per worker process, attached to the shared memory-mapped store
+@st.cache_resource
+def org_store():
+    return StoreHandle(ORG_STORE_FILE)
 
-    if not all_matches:
-        st.warning("No matches found.")
-        return []
-    return all_matches
 
+def build_org_index(file_name):
+    tree = load_data_file(file_name)
+    return None if tree is None else OrgIndex(tree)
 
-def search_org(query, search_type):
-    tree = load_data_file(JSON_DATA_FILE)
-    if tree is None:
-        return []
 
-    return search_and_display(tree, query, search_type)
+# Only the first worker to find the store missing or stale parses the json and publishes it,
+# the others wait on the store lock (see publish_if_stale) and then attach zero-copy like
+# every later request, picking up new builds on their own
+def load_org_index(file_name):
+    if store_is_stale(ORG_STORE_FILE, file_name):
+        publish_if_stale(file_name, lambda: build_org_index(file_name), ORG_STORE_FILE)
+    return org_store().current()
+
 
-def find_in_tree(current_tree, search_value, boss=None, path=[], search_by="name"):
-    matches = []
-    
-    search_terms = search_value.lower().split('.') if search_by == "email" else search_value.lower().split()
+def use_suggestion(suggestion):
+    st.session_state.query = suggestion
 
-    for node in current_tree:
-        clean_node = {k: v for k, v in node.items() if k != "Subordinates"}
 
-        if search_by == "name" and compare_strings(search_terms, node["Name"].lower()):
-            peers = [{k: v for k, v in peer.items() if k != "Subordinates"} for peer in boss["Subordinates"] if peer["Name"] != node["Name"]] if boss else []  
-            subordinates = node.get("Subordinates", [])
-            matches.append((path + [clean_node], peers, subordinates))
+def show_suggestions(query, search_type):
+    org_index = load_org_index(JSON_DATA_FILE)
+    if org_index is None:
+        return
+    prefix = SEARCH_PREFIXES[search_type]
+    suggestions = suggest(org_index.completion, prefix + query.lstrip(prefix))
+    suggestions = [suggestion[len(prefix):] for suggestion in suggestions if suggestion[len(prefix):].lower() != query.lower()]
+    if suggestions:
+        st.caption("Suggestions")
+        for suggestion in suggestions:
+            st.button(suggestion, key=f"suggestion_{suggestion}", on_click=use_suggestion, args=(suggestion,))
 
-        elif search_by == "email" and compare_strings(search_terms, node["Mail"].lower()):
-            peers = [{k: v for k, v in peer.items() if k != "Subordinates"} for peer in boss["Subordinates"] if peer["Name"] != node["Name"]] if boss else []
-            subordinates = node.get("Subordinates", [])
-            matches.append((path + [clean_node], peers, subordinates))
 
-        elif search_by == "division" and compare_strings(search_terms, node["Division"].lower()):
-            peers = [{k: v for k, v in peer.items() if k != "Subordinates"} for peer in boss["Subordinates"] if peer["Name"] != node["Name"]] if boss else []
-            subordinates = node.get("Subordinates", [])
-            matches.append((path + [clean_node], peers, subordinates))
+# Email and Division modes just prefix the query, so compound queries
+# ("maria in #finance in [AR]") work from any mode
+# Only ids are pulled from the search stream (one over the limit, to know it was hit),
+# full matches are built just for the one being displayed
+def search_and_display(org_index, query, search_type):
+    prefix = SEARCH_PREFIXES[search_type]
+    match_ids = list(itertools.islice(org_index.iter_ids(prefix + query.lstrip(prefix)), MATCH_LIMIT + 1))
+
+    if not match_ids:
+        st.warning("No matches found.")
+    elif len(match_ids) > MATCH_LIMIT:
+        st.warning(f"Showing the first {MATCH_LIMIT} matches, refine the query to narrow them down.")
+    return match_ids[:MATCH_LIMIT]
 
-        if "Subordinates" in node:
-            result = find_in_tree(node["Subordinates"], search_value, boss=node, path=path + [clean_node], search_by=search_by)
-            matches.extend(result)
 
-    return matches
+def search_org(query, search_type):
+    org_index = load_org_index(JSON_DATA_FILE)
+    if org_index is None:
+        return None, []
 
+    return org_index, search_and_display(org_index, query, search_type)
 
-def compare_strings(search_terms, target_string):
-    return all(substring in target_string for substring in search_terms)
 
 def display_results(result, col):
     with col:
@@ -101,27 +116,79 @@ def display_results(result, col):
             st.write("No subordinates found.")
 
 
+# Expanded nodes are kept per session, tied to the store version their ids belong to
+def expanded_nodes(org_index):
+    version = getattr(org_index, "store_version", None)
+    if st.session_state.get("org_chart_version") != version:
+        st.session_state.org_chart_version = version
+        st.session_state.expanded_nodes = set()
+    return st.session_state.expanded_nodes
+
+
+def toggle_node(org_index, node_id):
+    expanded_nodes(org_index).symmetric_difference_update({node_id})
+
+
+# Opens every lead above the person, so they show up in the chart
+def show_in_org_chart(org_index, node_id):
+    expanded_nodes(org_index).update(org_index.chain(node_id)[:-1])
+
+
+# Only the top of the org and the direct reports of expanded nodes are read from the store,
+# so the first paint doesn't depend on company size and expanding a node costs just its reports
+def display_org_chart(org_index):
+    expanded = expanded_nodes(org_index)
+    total_reports = org_index.columns.get("TotalReports")
+    pending = [(node_id, 0) for node_id in reversed(org_index.roots)]
+    while pending:
+        node_id, depth = pending.pop()
+        direct_reports = org_index.child_offsets[node_id + 1] - org_index.child_offsets[node_id]
+        is_open = node_id in expanded
+        marker = "▾" if is_open else "▸" if direct_reports else "•"
+        label = f"{ORG_CHART_INDENT * depth}{marker} {org_index.columns['Name'][node_id]} — {org_index.columns['Division'][node_id].title()}"
+        if direct_reports:
+            label += f" ({direct_reports} direct"
+            label += f", {total_reports[node_id]} total)" if total_reports is not None else ")"
+        st.button(label, key=f"org_node_{node_id}", on_click=toggle_node, args=(org_index, node_id), disabled=not direct_reports)
+        if is_open:
+            pending.extend((child_id, depth + 1) for child_id in reversed(org_index.children(node_id)))
+
+
 col1, col2 = st.columns([1, 2])
 
 with col1: # Logo and search boxes
     st.image('logo.png', use_column_width=True)
     search_type = st.radio("Search by", ["Name", "Email", "Division"])
-    query = st.text_input("Enter your query")
-
-with col2: # Multiple choice and results
+    query = st.text_input("Enter your query", key="query")
     if query:
-        results = search_org(query, search_type)
+        show_suggestions(query, search_type)
 
-        if len(results) == 1:
-            display_results(results[0], col2)
+with col2: # Multiple choice and results, org chart
+    search_tab, chart_tab = st.tabs(["Search", "Org Chart"])
 
-        elif len(results) > 1:
-            match_labels = [match[0][-1]['Name'] for match in results]
+    with search_tab:
+        if query:
+            org_index, results = search_org(query, search_type)
+            selected_id = None
 
-            selected_index = st.selectbox("Multiple matches found. Select one:", range(len(match_labels)), format_func=lambda x: match_labels[x])
+            if len(results) == 1:
+                selected_id = results[0]
 
-            selected_match = results[selected_index]
-            display_results(selected_match, col2)
+            elif len(results) > 1:
+                match_labels = [f"{org_index.columns['Name'][node_id]} [{org_index.columns['Division'][node_id].title()}]" for node_id in results]
 
-        else:
-            st.write("No matches found.")
+                selected_index = st.selectbox("Multiple matches found. Select one:", range(len(match_labels)), format_func=lambda x: match_labels[x])
+
+                selected_id = results[selected_index]
+
+            else:
+                st.write("No matches found.")
+
+            if selected_id is not None:
+                st.button("Show in org chart", on_click=show_in_org_chart, args=(org_index, selected_id))
+                display_results(org_index.match(selected_id), search_tab)
+
+    with chart_tab:
+        org_index = load_org_index(JSON_DATA_FILE)
+        if org_index is not None:
+            display_org_chart(org_index)
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+import os, sys, time, argparse
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from harness import RunningDispatcher
+from dispatcher import Dispatcher
+from dispatcher_client import enqueue
+
+# Benchmark del agrupado de rafagas: una inundacion de alertas de una regla WAF contra el dispatcher,
+# con y sin seccion coalesce. Los senders solo anotan lo que mandarian
+# Mide cuantos mensajes salen, cuanto tarda en salir el primero y muestra un resumen de ejemplo
+#
+# ./bench_coalesce.py --alerts 5000 --ips 20 --window 2
+
+
+def alert_notifications(number, ips, window):
+    ip = f"10.0.0.{number % ips}"
+    body = f"<b>Alerta: WAF-10k-in-10min_0</b> \nEventos: {10000 + number} \n\nIP: {ip}"
+    info = {"rule": "WAF-10k-in-10min_0", "key": ["WAF-10k-in-10min_0", ip], "window": window,
+            "values": {"alert.extra_data.num_hits": 10000 + number % 7}}
+    notifications = [
+        {"channel": "telegram", "chat_id": "telegram_bot_id", "body": body, "parse_mode": "html"},
+        {"channel": "email", "dest": "sample@example.com", "alert_name": "WAF-10k-in-10min_0", "body": body},
+    ]
+    if window:
+        for notification in notifications:
+            notification["coalesce"] = info
+    return notifications
+
+
+def run(alerts, ips, window):
+    sent = []
+    senders = {channel: lambda notification: sent.append((time.perf_counter(), notification)) for channel in ("telegram", "email")}
+    running = RunningDispatcher(Dispatcher(senders))
+    start = time.perf_counter()
+    for number in range(alerts):
+        enqueue(alert_notifications(number, ips, window), running.socket_path)
+    flooded = time.perf_counter() - start
+    # Se espera a que cierren las ventanas de la inundacion y salgan los resumenes
+    time.sleep(window * 1.5 if window else 0.5)
+    running.stop()
+    first = min(sent_at for sent_at, _ in sent) - start
+    digests = [notification for _, notification in sent if notification["body"].startswith("<b>Resumen")]
+    return flooded, first, len(sent), digests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del agrupado de rafagas del dispatcher")
+    parser.add_argument("--alerts", type=int, default=5000)
+    parser.add_argument("--ips", type=int, default=20, help="IPs distintas en la inundacion (una ventana por IP)")
+    parser.add_argument("--window", type=float, default=2, help="segundos de la ventana de agrupado")
+    args = parser.parse_args()
+
+    print(f"{args.alerts} alertas de WAF-10k-in-10min_0 desde {args.ips} IPs, telegram + mail")
+    print(f"{'modo':<12}{'inundacion':>12}{'primer envio':>14}{'mensajes':>10}{'resumenes':>11}")
+    for mode, window in (("sin agrupar", 0), (f"ventana {args.window:g}s", args.window)):
+        flooded, first, messages, digests = run(args.alerts, args.ips, window)
+        print(f"{mode:<12}{flooded:>11.2f}s{first * 1000:>12.2f}ms{messages:>10}{len(digests):>11}")
+    print("resumen de ejemplo:")
+    print(next(digest["body"] for digest in digests if digest["channel"] == "telegram"))
+
+
+if __name__ == "__main__":
+    main()
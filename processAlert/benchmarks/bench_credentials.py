@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+import os, sys, time, argparse, tempfile, threading
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+# harness agrega notificationsMod y los plugins al sys.path
+import harness
+import credentials
+
+# Benchmark de credentials.py contra un vault de prueba que tarda --vault-latency en cada pedido
+# - sin cache (como antes, un pedido al vault por notificacion) vs con cache
+# - single-flight: muchos threads piden a la vez una credencial que no esta
+# - renovacion en segundo plano: con un TTL corto, ningun get deberia esperar al vault salvo el primero
+# - el archivo de creds del mail: parsearlo en cada envio vs el cache
+#
+# ./bench_credentials.py --gets 1000 --vault-latency 0.05
+
+
+class StandInVault:
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, name):
+        with self.lock:
+            self.requests += 1
+            version = self.requests
+        time.sleep(self.latency)
+        return f"{name}-secret-{version}"
+
+
+def timed_gets(get, gets):
+    latencies = []
+    for _ in range(gets):
+        start = time.perf_counter()
+        get("soc_updates_bot")
+        latencies.append(time.perf_counter() - start)
+    return sum(latencies), max(latencies)
+
+
+# Lo que hacia send_email.get_sender_creds en cada mail
+def legacy_sender_creds(path):
+    with open(path, "r") as file:
+        sensitive = file.readlines()
+        email = password = ""
+        port = 0
+    for line in sensitive:
+        if "soc_mail_address" in line:
+            email = line.split("=")[1].strip("\n")
+        if "soc_mail_app_password" in line:
+            password = line.split("=")[1].strip("\n")
+        if "soc_mail_smtp_srv" in line:
+            srv = line.split("=")[1].strip("\n")
+        if "soc_mail_smtp_port" in line:
+            port = int(line.split("=")[1].strip("\n"))
+    return email, password, srv, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cache de credenciales")
+    parser.add_argument("--gets", type=int, default=1000)
+    parser.add_argument("--vault-latency", type=float, default=0.05)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ttl", type=float, default=1.0, help="TTL corto para ver la renovacion en segundo plano")
+    args = parser.parse_args()
+
+    print(f"{'escenario':<40}{'total':>10}{'peor get':>12}{'pedidos al vault':>18}")
+
+    vault = StandInVault(args.vault_latency)
+    gets = max(1, min(args.gets, int(5 / args.vault_latency)))
+    total, worst = timed_gets(vault.fetch, gets)
+    print(f"{f'sin cache ({gets} gets)':<40}{total:>9.2f}s{worst * 1000:>10.1f}ms{vault.requests:>18}")
+
+    vault = StandInVault(args.vault_latency)
+    cache = credentials.CredentialCache(vault)
+    total, worst = timed_gets(cache.get, args.gets)
+    print(f"{f'con cache ({args.gets} gets)':<40}{total:>9.2f}s{worst * 1000:>10.1f}ms{vault.requests:>18}")
+
+    vault = StandInVault(args.vault_latency)
+    cache = credentials.CredentialCache(vault)
+    barrier = threading.Barrier(args.threads)
+    values = []
+
+    def cold_get():
+        barrier.wait()
+        values.append(cache.get("soc_updates_bot"))
+
+    threads = [threading.Thread(target=cold_get) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"{f'{args.threads} threads a la vez, en frio':<40}{time.perf_counter() - start:>9.2f}s{'':>12}{vault.requests:>18}"
+          f"  ({len(set(values))} valor distinto)")
+
+    vault = StandInVault(args.vault_latency)
+    cache = credentials.CredentialCache(vault, ttl=args.ttl, refresh_before=args.ttl / 2)
+    latencies = []
+    values = set()
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.ttl * 4:
+        get_start = time.perf_counter()
+        values.add(cache.get("soc_updates_bot"))
+        latencies.append(time.perf_counter() - get_start)
+        time.sleep(0.001)
+    slow = sum(latency >= args.vault_latency / 2 for latency in latencies)
+    print(f"{f'TTL {args.ttl:g}s durante {args.ttl * 4:g}s':<40}{'':>10}{max(latencies[1:]) * 1000:>10.1f}ms{vault.requests:>18}"
+          f"  ({len(latencies)} gets, {slow} esperaron al vault, {len(values)} versiones)")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+        file.write("soc_mail_address=soc@example.com\nsoc_mail_app_password=secret\nsoc_mail_smtp_srv=smtp.example.com\nsoc_mail_smtp_port=587\n")
+    email_cache = credentials.CredentialCache(credentials.FileProvider(file.name))
+    names = ("soc_mail_address", "soc_mail_app_password", "soc_mail_smtp_srv", "soc_mail_smtp_port")
+    assert legacy_sender_creds(file.name)[:3] == tuple(email_cache.get(name) for name in names[:3])
+    for name, run in (("archivo de creds, parse por mail", lambda: legacy_sender_creds(file.name)),
+                      ("archivo de creds, con cache", lambda: [email_cache.get(name) for name in names])):
+        start = time.perf_counter()
+        for _ in range(args.gets):
+            run()
+        total = time.perf_counter() - start
+        print(f"{f'{name} ({args.gets})':<40}{total:>9.3f}s{total / args.gets * 1e6:>10.1f}us")
+    os.remove(file.name)
+
+
+if __name__ == "__main__":
+    main()
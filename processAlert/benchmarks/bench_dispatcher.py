@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+import os, sys, time, smtplib, argparse
+from email.mime.text import MIMEText
+import requests
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from harness import RunningDispatcher, start_fake_telegram, FakeSmtpServer
+from dispatcher import Dispatcher
+from dispatcher_client import enqueue
+
+# Benchmark del dispatcher contra servidores locales que hacen de Telegram y de SMTP
+# Compara mandar cada alerta en el momento (como notify.py sin dispatcher) con encolarlas:
+# cuanto tarda la alerta en encolar (p50/p99) y cuantas notificaciones por segundo se entregan
+#
+# ./bench_dispatcher.py --alerts 200 --telegram-latency 0.05 --smtp-latency 0.2
+
+
+# Los mismos pedidos que hacen los plugins, apuntados a los servidores locales
+def make_senders(telegram_url, smtp_port):
+    def send_telegram(notification):
+        params = {"chat_id": notification["chat_id"], "text": notification["body"], "parse_mode": notification["parse_mode"]}
+        response = requests.get(f"{telegram_url}/botTOKEN/sendMessage", params=params, timeout=30).json()
+        if not response.get("ok"):
+            raise RuntimeError(response)
+
+    def send_email(notification):
+        message = MIMEText(notification["body"], "html")
+        message["Subject"] = "Alerta SOC: " + notification["alert_name"]
+        server = smtplib.SMTP("127.0.0.1", smtp_port, timeout=30)
+        server.login("soc@example.com", "password")
+        server.sendmail("soc@example.com", notification["dest"], message.as_string())
+        server.quit()
+
+    return {"telegram": send_telegram, "email": send_email}
+
+
+def alert_notifications(number):
+    body = f"<b>Alerta: WAF-10k-in-10min_0</b> \nEventos: {number} \n\nIP: 10.0.{number % 256}.1"
+    return [
+        {"channel": "telegram", "chat_id": "telegram_bot_id", "body": body, "parse_mode": "html"},
+        {"channel": "email", "dest": "sample@example.com", "alert_name": "WAF-10k-in-10min_0", "body": body},
+    ]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+# Como notify.py sin dispatcher: cada alerta espera sus dos envios
+def run_direct(senders, alerts):
+    latencies = []
+    start = time.perf_counter()
+    for number in range(alerts):
+        alert_start = time.perf_counter()
+        for notification in alert_notifications(number):
+            senders[notification["channel"]](notification)
+        latencies.append(time.perf_counter() - alert_start)
+    return time.perf_counter() - start, sorted(latencies)
+
+
+# Dispatcher en un thread con su loop, las alertas encolan por el unix socket como notify.py
+def run_dispatched(senders, alerts, concurrency, queue_size):
+    dispatcher = Dispatcher(senders, concurrency, queue_size)
+    running = RunningDispatcher(dispatcher)
+    latencies = []
+    start = time.perf_counter()
+    for number in range(alerts):
+        alert_start = time.perf_counter()
+        enqueue(alert_notifications(number), running.socket_path)
+        latencies.append(time.perf_counter() - alert_start)
+    enqueued = time.perf_counter() - start
+    while sum(dispatcher.sent.values()) + sum(dispatcher.failed.values()) < alerts * 2:
+        time.sleep(0.01)
+    delivered = time.perf_counter() - start
+    running.stop()
+    return enqueued, delivered, sorted(latencies), sum(dispatcher.failed.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del dispatcher de notificaciones contra servidores locales")
+    parser.add_argument("--alerts", type=int, default=100, help="alertas, cada una manda un telegram y un mail")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="segundos que tarda el Bot API falso en responder")
+    parser.add_argument("--smtp-latency", type=float, default=0.2, help="segundos que tarda el SMTP falso en aceptar cada mail")
+    parser.add_argument("--telegram-workers", type=int, default=4)
+    parser.add_argument("--email-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--skip-direct", action="store_true", help="no medir el envio directo (tarda alertas x latencias)")
+    args = parser.parse_args()
+
+    telegram = start_fake_telegram(args.telegram_latency)
+    smtp = FakeSmtpServer(args.smtp_latency)
+    senders = make_senders(f"http://127.0.0.1:{telegram.server_address[1]}", smtp.port)
+    concurrency = {"telegram": args.telegram_workers, "email": args.email_workers}
+    print(f"{args.alerts} alertas (telegram + mail), latencia telegram {args.telegram_latency * 1000:.0f}ms, smtp {args.smtp_latency * 1000:.0f}ms")
+    print(f"{'modo':<12}{'encolado p50':>14}{'p99':>10}{'entrega total':>15}{'notif/s':>10}")
+
+    if not args.skip_direct:
+        elapsed, latencies = run_direct(senders, args.alerts)
+        print(f"{'directo':<12}{percentile(latencies, 0.5) * 1000:>12.1f}ms{percentile(latencies, 0.99) * 1000:>8.1f}ms"
+              f"{elapsed:>14.2f}s{args.alerts * 2 / elapsed:>10.1f}")
+
+    enqueued, delivered, latencies, failed = run_dispatched(senders, args.alerts, concurrency, args.queue_size)
+    print(f"{'dispatcher':<12}{percentile(latencies, 0.5) * 1e6:>12.0f}us{percentile(latencies, 0.99) * 1e6:>8.0f}us"
+          f"{delivered:>14.2f}s{args.alerts * 2 / delivered:>10.1f}")
+    print(f"encolar todo: {enqueued * 1000:.1f}ms, errores de entrega: {failed}, recibidos: telegram {telegram.received}, smtp {smtp.received}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+import os, sys, time, smtplib, argparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from harness import FakeSmtpServer
+import send_email
+
+# Benchmark de plugins/send_email.py contra un SMTP local con latencia en el saludo y el login
+# Compara una conexion por mail (como antes: conectar, login, mandar, quit) con la pool de
+# conexiones, mandando de a uno, con varios threads (como los workers del dispatcher) y en lote
+# Al final corta las sesiones del server y verifica que la pool se reconecta sola
+#
+# ./bench_email.py --emails 200 --smtp-latency 0.01 --handshake-latency 0.1
+
+SENDER = "soc@example.com"
+PASSWORD = "password"
+
+
+def build_messages(emails):
+    return [(SENDER, "sample@example.com", send_email.build_message(SENDER, "sample@example.com", "WAF-10k-in-10min_0", f"Eventos: {number}"))
+            for number in range(emails)]
+
+
+def send_per_connection(port, messages):
+    for sender, dest, message in messages:
+        server = smtplib.SMTP("127.0.0.1", port, timeout=30)
+        server.login(SENDER, PASSWORD)
+        server.sendmail(sender, dest, message)
+        server.quit()
+
+
+def send_pooled(pool, messages, threads):
+    with ThreadPoolExecutor(threads) as executor:
+        errors = list(executor.map(lambda message: pool.send([message])[0], messages))
+    return sum(error is not None for error in errors)
+
+
+def send_batched(pool, messages):
+    return sum(error is not None for error in pool.send(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la pool de conexiones SMTP de send_email")
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--smtp-latency", type=float, default=0.01, help="segundos que tarda el SMTP falso en aceptar cada mail")
+    parser.add_argument("--handshake-latency", type=float, default=0.1, help="segundos del saludo y del login (por cada uno)")
+    parser.add_argument("--pool-size", type=int, default=send_email.SMTP_POOL_SIZE)
+    args = parser.parse_args()
+
+    # El footer lo lee build_message, para el benchmark no hace falta el archivo real
+    send_email.get_mail_footer = lambda: "<p>footer</p>"
+    smtp = FakeSmtpServer(args.smtp_latency, args.handshake_latency)
+    messages = build_messages(args.emails)
+    print(f"{args.emails} mails, latencia por mail {args.smtp_latency * 1000:.0f}ms, saludo y login {args.handshake_latency * 1000:.0f}ms cada uno")
+    print(f"{'modo':<26}{'segundos':>10}{'mails/s':>10}{'sesiones':>10}{'errores':>9}")
+
+    def measure(name, run):
+        connections, received = smtp.connections, smtp.received
+        start = time.perf_counter()
+        errors = run() or 0
+        elapsed = time.perf_counter() - start
+        print(f"{name:<26}{elapsed:>10.2f}{(smtp.received - received) / elapsed:>10.1f}{smtp.connections - connections:>10}{errors:>9}")
+
+    measure("conexion por mail", lambda: send_per_connection(smtp.port, messages))
+    pool = send_email.SmtpPool("127.0.0.1", smtp.port, SENDER, PASSWORD, starttls=False, size=args.pool_size)
+    measure("pool, de a uno", lambda: send_pooled(pool, messages, 1))
+    measure(f"pool, {args.pool_size} threads", lambda: send_pooled(pool, messages, args.pool_size))
+    measure("pool, en lote", lambda: send_batched(pool, messages))
+
+    smtp.drop_sessions()
+    measure("pool, tras cortar sesiones", lambda: send_pooled(pool, messages[:args.pool_size * 2], args.pool_size))
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+import io, os, sys, time, argparse, tempfile, contextlib, statistics, subprocess
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+import harness
+from harness import start_fake_telegram, FakeSmtpServer
+import notify
+import credentials
+
+# Benchmark de notify.py mandando directo (sin dispatcher)
+# - arranque: lo que tarda un proceso nuevo en importar notify y los plugins que usa la regla,
+#   contra cargar todo como antes (los dos plugins, requests, smtplib y el dispatcher con asyncio)
+# - latencia: una alerta con varios destinos por canal, uno atras del otro (como antes) contra todos
+#   a la vez, con los plugins reales apuntados a un Telegram y un SMTP locales. Cada alerta arranca
+#   sin conexiones abiertas, como un proceso nuevo de notify.py
+#
+# ./bench_notify.py --alerts 20 --chats 2 --emails 3
+
+SENDER = "soc@example.com"
+PASSWORD = "password"
+
+STARTUP_CASES = (
+    ("antes (todo)", "import notify; notify.senders.plugin('telegram'); notify.senders.plugin('email'); import dispatcher"),
+    ("con dispatcher (ningun plugin)", "import notify"),
+    ("regla solo telegram", "import notify; notify.senders.plugin('telegram')"),
+    ("regla solo mail", "import notify; notify.senders.plugin('email')"),
+    ("regla telegram + mail", "import notify; notify.senders.plugin('telegram'); notify.senders.plugin('email')"),
+)
+
+
+class StandInVault:
+    def fetch(self, name):
+        return "TOKEN"
+
+
+def startup(code, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=harness.NOTIFY_DIR)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def alert_notifications(number, chats, emails):
+    body = f"<b>Alerta: WAF-10k-in-10min_0</b> \nEventos: {number}"
+    return ([{"channel": "telegram", "chat_id": f"chat_{chat}", "body": body, "parse_mode": "html"} for chat in range(chats)] +
+            [{"channel": "email", "dest": f"soc{dest}@example.com", "alert_name": "WAF-10k-in-10min_0", "body": body} for dest in range(emails)])
+
+
+def sequential(notifications):
+    failed = []
+    for notification in notifications:
+        try:
+            notify.send_notification(notification)
+        except Exception:
+            failed.append(notification)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del arranque y la latencia de notify.py")
+    parser.add_argument("--alerts", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=2, help="chats de telegram por alerta")
+    parser.add_argument("--emails", type=int, default=3, help="destinatarios de mail por alerta")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--smtp-latency", type=float, default=0.05, help="segundos que tarda el SMTP falso en aceptar cada mail")
+    parser.add_argument("--handshake-latency", type=float, default=0.05, help="segundos del saludo y del login (por cada uno)")
+    parser.add_argument("--startup-runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"arranque de un proceso nuevo (mediana de {args.startup_runs})")
+    baseline = startup("pass", args.startup_runs)
+    for name, code in STARTUP_CASES:
+        print(f"  {name:<34}{(startup(code, args.startup_runs) - baseline) * 1000:>8.1f}ms")
+
+    telegram = start_fake_telegram(args.telegram_latency)
+    smtp = FakeSmtpServer(args.smtp_latency, args.handshake_latency)
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+        file.write(f"soc_mail_address={SENDER}\nsoc_mail_app_password={PASSWORD}\nsoc_mail_smtp_srv=127.0.0.1\nsoc_mail_smtp_port={smtp.port}\n")
+    credentials.register("vault", StandInVault())
+    credentials.register("email_file", credentials.FileProvider(file.name))
+    send_telegram = notify.senders.plugin("telegram")
+    send_email = notify.senders.plugin("email")
+    send_email.get_mail_footer = lambda: "<p>footer</p>"
+
+    # Sin conexiones abiertas, como un proceso nuevo; el Telegram falso no aplica los limites por chat
+    def fresh_connections():
+        send_telegram.client = send_telegram.TelegramClient(f"http://127.0.0.1:{telegram.server_port}", chat_rate=1000, chat_burst=1000)
+        if send_email.smtp_pool is not None:
+            send_email.smtp_pool.close()
+        send_email.smtp_pool = send_email.SmtpPool("127.0.0.1", smtp.port, SENDER, PASSWORD, starttls=False)
+
+    print(f"{args.alerts} alertas a {args.chats} chats y {args.emails} mails, latencia telegram {args.telegram_latency * 1000:.0f}ms, "
+          f"smtp {args.smtp_latency * 1000:.0f}ms por mail y {args.handshake_latency * 1000:.0f}ms por saludo y login")
+    print(f"  {'modo':<20}{'p50':>10}{'max':>10}{'fallidas':>10}")
+    for name, send in (("uno atras del otro", sequential), ("todos a la vez", notify.send_direct)):
+        latencies = []
+        failed = 0
+        for number in range(args.alerts):
+            notifications = alert_notifications(number, args.chats, args.emails)
+            fresh_connections()
+            # Los plugins imprimen cada envio (por stderr)
+            with contextlib.redirect_stderr(io.StringIO()):
+                start = time.perf_counter()
+                failed += len(send(notifications))
+                latencies.append(time.perf_counter() - start)
+        print(f"  {name:<20}{statistics.median(latencies) * 1000:>8.1f}ms{max(latencies) * 1000:>8.1f}ms{failed:>10}")
+    send_email.smtp_pool.close()
+    os.remove(file.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+import os, sys, time, argparse, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from harness import RunningDispatcher, wait_for
+import dispatcher
+from dispatcher import Dispatcher
+from dispatcher_client import enqueue
+from outbox import Outbox
+
+# Benchmark del outbox del dispatcher
+# - rafaga: varios procesos (threads aca) encolando a la vez, sin outbox vs con outbox (group commit)
+# - reinicio: un dispatcher con los canales caidos recibe alertas y se frena; otro, con los canales
+#   andando y el mismo outbox, las tiene que entregar todas
+# - dead letters: con un canal que siempre falla, todo termina como dead letter tras los reintentos
+#
+# ./bench_outbox.py --alerts 2000 --clients 8
+
+
+def alert_notifications(number):
+    body = f"<b>Alerta: WAF-10k-in-10min_0</b> \nEventos: {number}"
+    return [
+        {"channel": "telegram", "chat_id": "telegram_bot_id", "body": body, "parse_mode": "html"},
+        {"channel": "email", "dest": "sample@example.com", "alert_name": "WAF-10k-in-10min_0", "body": body},
+    ]
+
+
+class Channels:
+    def __init__(self, working=True):
+        self.working = working
+        self.delivered = 0
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        if not self.working:
+            raise ConnectionError("canal caido")
+        with self.lock:
+            self.delivered += 1
+
+    def senders(self):
+        return {"telegram": self.send, "email": self.send}
+
+
+def burst(socket_path, alerts, clients):
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(lambda number: enqueue(alert_notifications(number), socket_path), range(alerts)))
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del outbox del dispatcher de notificaciones")
+    parser.add_argument("--alerts", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=8, help="clientes encolando a la vez")
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+
+    print(f"rafaga de {args.alerts} alertas (telegram + mail) desde {args.clients} clientes")
+    for name, outbox in (("sin outbox", None), ("con outbox", Outbox(os.path.join(directory, "burst.sqlite")))):
+        channels = Channels()
+        instance = Dispatcher(channels.senders(), outbox=outbox)
+        running = RunningDispatcher(instance)
+        elapsed = burst(running.socket_path, args.alerts, args.clients)
+        wait_for(lambda: channels.delivered == args.alerts * 2)
+        running.stop()
+        # Por alerta: guardar las dos notificaciones y borrar cada una al entregarla
+        commits = f", {instance.commits} transacciones ({args.alerts * 3 / max(1, instance.commits):.1f} operaciones c/u)" if outbox else ""
+        print(f"  {name:<12}{args.alerts / elapsed:>8.0f} alertas/s encoladas, {channels.delivered} entregadas{commits}")
+        if outbox:
+            print(f"  quedan en el outbox: {outbox.counts()}")
+
+    path = os.path.join(directory, "restart.sqlite")
+    outbox = Outbox(path)
+    # Se frena antes del reintento, el dispatcher nuevo lo hace cuando vence (RETRY_BASE)
+    dispatcher.RETRY_BASE = 1
+    down = Channels(working=False)
+    instance = Dispatcher(down.senders(), outbox=outbox)
+    running = RunningDispatcher(instance)
+    burst(running.socket_path, args.alerts // 10, args.clients)
+    wait_for(lambda: sum(instance.failed.values()) == args.alerts // 10 * 2)
+    running.stop()
+    outbox.close()
+    print(f"reinicio: con los canales caidos quedaron {Outbox(path).counts().get('pending', 0)} pendientes")
+    outbox = Outbox(path)
+    up = Channels()
+    instance = Dispatcher(up.senders(), outbox=outbox)
+    running = RunningDispatcher(instance)
+    wait_for(lambda: up.delivered == args.alerts // 10 * 2)
+    running.stop()
+    print(f"  el dispatcher nuevo entrego {up.delivered}, quedan en el outbox: {outbox.counts()}")
+
+    outbox = Outbox(os.path.join(directory, "dead.sqlite"))
+    dispatcher.RETRY_BASE = 0.01
+    instance = Dispatcher(Channels(working=False).senders(), outbox=outbox, max_attempts=3)
+    running = RunningDispatcher(instance)
+    burst(running.socket_path, 50, args.clients)
+    wait_for(lambda: sum(instance.dead.values()) == 100)
+    running.stop()
+    print(f"dead letters: {sum(instance.failed.values())} intentos fallidos, en el outbox: {outbox.counts()}")
+
+
+if __name__ == "__main__":
+    main()
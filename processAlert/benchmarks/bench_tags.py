@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+import os, re, sys, json, time, pickle, random, argparse, tempfile, functools, statistics, subprocess, tracemalloc
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+import harness
+import tag_engine
+
+# Benchmark de add_tags / add_tags_regex con alertas y rule_configs sinteticos
+# Por cada tamaño de rule_config y cada engine informa alertas/s, latencia p50/p99 y memoria,
+# y compara lo que devuelve el engine con lo que imprimen los scripts para una muestra de alertas
+# Tambien mide el arranque hasta el primer tag de un proceso por alerta, con y sin el cache de reglas
+#
+# ./bench_tags.py --tags 10 100 1000 10000 --alerts 2000 --depth 4 --list-len 20
+
+SCRIPT_DIR = harness.PROCESS_ALERT_DIR
+
+# engine -> (script, operador por default)
+ENGINES = {
+    "add_tags": ("add_tags.py", "eq"),
+    "add_tags_regex": ("add_tags_regex.py", "regex"),
+}
+
+RULE_NAMES = ["WAF-scan-tool-detected", "Brute-force-login", "Impossible-travel", "Malware-hash-seen", "Admin-panel-access"]
+ACTIONS = ["allow", "block", "challenge", "log"]
+AGENTS = [f"agent-{i:02d}" for i in range(40)]
+USERS = [f"user{i}" for i in range(500)]
+COUNTRIES = ["AR", "BR", "CL", "CO", "MX", "PE", "US", "UY"]
+
+
+def random_ip(rng):
+    return f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+# Alerta estilo Elastalert: alert con los datos de la regla y alert_data con el evento,
+# anidado depth niveles y con una lista de list_len eventos (objetos)
+def make_alert(rng, depth, list_len):
+    nested = {"agent": {"name": rng.choice(AGENTS)}, "geo": {"country": rng.choice(COUNTRIES)}}
+    for level in range(depth):
+        nested = {f"level{level}": nested, "id": str(rng.getrandbits(32))}
+    return {
+        "alert": {
+            "rule_name": rng.choice(RULE_NAMES),
+            "extra_data": {"ip_client_keyword": random_ip(rng), "num_hits": rng.randint(1, 5000)},
+        },
+        "alert_data": {
+            "nested": nested,
+            "events": [{"src_ip": random_ip(rng), "user": rng.choice(USERS), "action": rng.choice(ACTIONS)} for _ in range(list_len)],
+        },
+    }
+
+
+# Fields de la alerta sintetica con un generador de valores para cada uno (algunos matchean, otros no)
+def rule_fields(depth):
+    nested = ".".join(f"level{level}" for level in reversed(range(depth)))
+    nested = f"alert_data.nested.{nested}." if nested else "alert_data.nested."
+    return [
+        ("alert.rule_name", lambda rng: rng.choice(RULE_NAMES)),
+        ("alert.extra_data.ip_client_keyword", random_ip),
+        (nested + "agent.name", lambda rng: rng.choice(AGENTS)),
+        (nested + "geo.country", lambda rng: rng.choice(COUNTRIES)),
+        ("alert_data.events.user", lambda rng: rng.choice(USERS)),
+        ("alert_data.events.action", lambda rng: rng.choice(ACTIONS)),
+    ]
+
+
+# Condicion para el engine: exacta, lista o (solo add_tags_regex) regex
+def make_condition(rng, engine, field, value):
+    kind = rng.choice(["exact", "list", "regex"] if engine == "add_tags_regex" else ["exact", "list"])
+    if engine == "add_tags_regex" and kind != "regex":
+        value = [f"^{re.escape(v)}$" for v in value]
+    elif kind == "regex":
+        return {"field": field, "value": [f"{re.escape(value[0][:4])}.*{rng.randint(0, 9)}$", f"^{re.escape(value[0][:3])}"]}
+    return {"field": field, "value": value[0] if kind == "exact" else value}
+
+
+def make_rule_config(rng, engine, tags, depth):
+    fields = rule_fields(depth)
+    rule_tags = []
+    for tag_number in range(tags):
+        conditions = []
+        for field, generate in rng.sample(fields, rng.randint(1, 3)):
+            conditions.append(make_condition(rng, engine, field, [generate(rng) for _ in range(rng.randint(1, 8))]))
+        rule_tags.append({"tag_name": f"tag{tag_number}", "conditions": conditions})
+    return {"tags": rule_tags}
+
+
+# Implementacion original (finder sobre todo el doc), referencia de lo que tiene que dar cada engine
+# Los patrones se compilan una vez para que la referencia no tarde minutos con 10k tags
+compile_pattern = functools.lru_cache(maxsize=None)(re.compile)
+
+
+def reference_finder(content, pattern, match_key_list, current_path, regex):
+    if isinstance(content, dict):
+        for key, value in content.items():
+            if key in match_key_list:
+                if current_path + [key] == match_key_list:
+                    if isinstance(value, str) and (compile_pattern(pattern).search(value) if regex else value == pattern):
+                        return True
+                elif reference_finder(value, pattern, match_key_list, current_path + [key], regex):
+                    return True
+    elif isinstance(content, list):
+        return any(reference_finder(item, pattern, match_key_list, current_path, regex) for item in content)
+    return False
+
+
+def reference_tags(doc_data, siem_rule_config, regex):
+    tags = []
+    for tag in siem_rule_config.get("tags", []):
+        if all(any(reference_finder(doc_data, pattern, condition["field"].split('.'), [], regex) for pattern in tag_engine.value_list(condition["value"])) for condition in tag.get("conditions", [])):
+            tags.append(tag["tag_name"])
+    return " ".join(tags)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+# Compila las reglas y taggea todas las alertas, devuelve tiempos, tags y memoria
+def run_engine(engine, siem_rule_config, alerts):
+    _, default_operator = ENGINES[engine]
+    start = time.perf_counter()
+    rules = tag_engine.CompiledRules(siem_rule_config, default_operator)
+    compile_time = time.perf_counter() - start
+    latencies = []
+    results = []
+    for alert in alerts:
+        doc_data = dict(alert)
+        start = time.perf_counter_ns()
+        rules.tag(doc_data)
+        latencies.append(time.perf_counter_ns() - start)
+        results.append(doc_data.get("tags", ""))
+    # La memoria se mide en otra pasada, tracemalloc frena todo lo que mide
+    tracemalloc.start()
+    rules = tag_engine.CompiledRules(siem_rule_config, default_operator)
+    rules_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for alert in alerts:
+        rules.tag(dict(alert))
+    _, tag_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return compile_time, sorted(latencies), results, rules_memory, tag_peak - rules_memory
+
+
+# Pasa una muestra de alertas por el script, en modo servicio porque un rule_config grande
+# no entra como argumento (el kernel limita cada argumento a 128 KiB)
+def script_tags(engine, siem_rule_config, alerts):
+    script, _ = ENGINES[engine]
+    rule_config = json.dumps(siem_rule_config)
+    lines = "".join(f"{json.dumps(alert)} {rule_config}\n" for alert in alerts)
+    # Sin cache de reglas, se compara lo que compila el script en ese momento
+    env = dict(os.environ, TAG_RULE_CACHE_DIR="")
+    completed = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script), "--serve"], input=lines, capture_output=True, text=True, check=True, env=env)
+    return [json.loads(line).get("tags", "") for line in completed.stdout.splitlines()]
+
+
+# Mediana del tiempo que tarda el script en arrancar y taggear una alerta, sin cache de reglas
+# y con el cache ya cargado (la primera corrida con cache es la que lo llena)
+def startup_times(engine, siem_rule_config, alert, runs):
+    script, _ = ENGINES[engine]
+    line = f"{json.dumps(alert)} {json.dumps(siem_rule_config)}\n"
+
+    def median_run(cache_dir):
+        env = dict(os.environ, TAG_RULE_CACHE_DIR=cache_dir)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script), "--serve"], input=line, capture_output=True, text=True, check=True, env=env)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        uncached = median_run("")
+        median_run(cache_dir)
+        cached = median_run(cache_dir)
+    return uncached, cached
+
+
+# Lo que tarda en levantar del cache las reglas ya compiladas, sin contar el arranque de python
+def cache_load_time(engine, siem_rule_config):
+    data = pickle.dumps(tag_engine.CompiledRules(siem_rule_config, ENGINES[engine][1]), protocol=pickle.HIGHEST_PROTOCOL)
+    start = time.perf_counter()
+    pickle.loads(data)
+    return time.perf_counter() - start, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de add_tags / add_tags_regex con datos sinteticos")
+    parser.add_argument("--tags", type=int, nargs="+", default=[10, 100, 1000, 10000], help="tamaños de rule_config (cantidad de tags)")
+    parser.add_argument("--alerts", type=int, default=1000, help="alertas por corrida")
+    parser.add_argument("--depth", type=int, default=3, help="niveles de anidamiento de alert_data")
+    parser.add_argument("--list-len", type=int, default=10, help="eventos en la lista alert_data.events")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--check", type=int, default=20, help="alertas que se comparan contra la salida de los scripts")
+    parser.add_argument("--reference", type=int, default=50, help="alertas que se comparan contra la implementacion original")
+    parser.add_argument("--startup-runs", type=int, default=5, help="procesos por medicion de arranque (0 no mide)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    alerts = [make_alert(rng, args.depth, args.list_len) for _ in range(args.alerts)]
+    print(f"{args.alerts} alertas, depth {args.depth}, {args.list_len} eventos por alerta")
+    print(f"{'engine':<16}{'tags':>7}{'compile':>10}{'alertas/s':>11}{'p50 us':>9}{'p99 us':>9}{'rules KiB':>11}{'tag KiB':>9}{'tagged':>8}  check")
+    failed = False
+    startups = []
+    for engine in args.engines:
+        for tags in args.tags:
+            siem_rule_config = make_rule_config(rng, engine, tags, args.depth)
+            compile_time, latencies, results, rules_memory, tag_memory = run_engine(engine, siem_rule_config, alerts)
+            regex = ENGINES[engine][1] == "regex"
+            mismatches = sum(results[i] != reference_tags(alerts[i], siem_rule_config, regex) for i in range(min(args.reference, len(alerts))))
+            sample = alerts[:args.check]
+            mismatches += sum(expected != result for expected, result in zip(script_tags(engine, siem_rule_config, sample), results))
+            failed = failed or bool(mismatches)
+            print(f"{engine:<16}{tags:>7}{compile_time * 1000:>8.1f}ms{len(alerts) / (sum(latencies) / 1e9):>11.0f}"
+                  f"{percentile(latencies, 0.5) / 1000:>9.1f}{percentile(latencies, 0.99) / 1000:>9.1f}"
+                  f"{rules_memory / 1024:>11.0f}{tag_memory / 1024:>9.0f}{sum(1 for result in results if result):>8}"
+                  f"  {'ok' if not mismatches else f'{mismatches} distintas'}")
+            if args.startup_runs:
+                startups.append((engine, tags, compile_time, *cache_load_time(engine, siem_rule_config), *startup_times(engine, siem_rule_config, alerts[0], args.startup_runs)))
+
+    if startups:
+        print()
+        print("Arranque hasta el primer tag (un proceso por alerta)")
+        print(f"{'engine':<16}{'tags':>7}{'compile':>10}{'cache load':>12}{'cache KiB':>11}{'sin cache':>11}{'con cache':>11}")
+        for engine, tags, compile_time, load_time, cache_size, uncached, cached in startups:
+            print(f"{engine:<16}{tags:>7}{compile_time * 1000:>8.1f}ms{load_time * 1000:>10.1f}ms{cache_size / 1024:>11.0f}{uncached * 1000:>9.1f}ms{cached * 1000:>9.1f}ms")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
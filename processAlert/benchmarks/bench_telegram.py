@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+import os, sys, json, math, time, random, argparse, threading
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+# harness agrega notificationsMod y los plugins al sys.path
+import harness
+import send_telegram
+
+# Benchmark de plugins/send_telegram.py contra un Bot API falso que aplica limites como Telegram:
+# por chat y global, contestando 429 con retry_after al pasarse, y con una fraccion de 5xx al azar
+# Compara el envio de antes (requests.get suelto, sin reintentos) con el TelegramClient:
+# - keep-alive: mensajes seguidos sin limites, cuanto ahorra reusar la conexion
+# - rafaga: varios threads (como los workers del dispatcher) mandando a pocos chats
+# - un mensaje largo tiene que llegar entero (va por POST)
+#
+# ./bench_telegram.py --messages 60 --chats 3 --threads 4
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Los headers y el body salen en writes separados, sin esto cada respuesta espera el ACK demorado del cliente
+    disable_nagle_algorithm = True
+
+    def params(self):
+        if self.command == "POST":
+            return json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        return {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+    def answer(self):
+        params = self.params()
+        server = self.server
+        time.sleep(server.latency)
+        with server.lock:
+            retry_after = server.limit(params["chat_id"])
+            if retry_after:
+                server.rejected += 1
+                status, response = 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                                         "parameters": {"retry_after": retry_after}}
+            elif random.random() < server.error_rate:
+                server.failed += 1
+                status, response = 502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+            else:
+                server.delivered.append((self.command, params["chat_id"], params["text"]))
+                status, response = 200, {"ok": True, "result": {}}
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = answer
+    do_POST = answer
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency, chat_rate, chat_burst, global_rate, error_rate):
+        super().__init__(("127.0.0.1", 0), FakeBotApiHandler)
+        self.latency = latency
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_rate = global_rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.reset()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def reset(self):
+        self.chats = {}
+        self.global_tokens = (self.global_rate, time.monotonic())
+        self.delivered = []
+        self.rejected = 0
+        self.failed = 0
+        self.connections = 0
+
+    def get_request(self):
+        self.connections += 1
+        return super().get_request()
+
+    # Token buckets del lado del server; devuelve los segundos de retry_after o 0 si se acepta
+    def limit(self, chat_id):
+        now = time.monotonic()
+        chat_tokens, chat_updated = self.chats.get(chat_id, (self.chat_burst, now))
+        chat_tokens = min(self.chat_burst, chat_tokens + (now - chat_updated) * self.chat_rate)
+        global_tokens, global_updated = self.global_tokens
+        global_tokens = min(self.global_rate, global_tokens + (now - global_updated) * self.global_rate)
+        if chat_tokens < 1 or global_tokens < 1:
+            self.chats[chat_id] = (chat_tokens, now)
+            self.global_tokens = (global_tokens, now)
+            return max(1, math.ceil((1 - min(chat_tokens, global_tokens)) / self.chat_rate))
+        self.chats[chat_id] = (chat_tokens - 1, now)
+        self.global_tokens = (global_tokens - 1, now)
+        return 0
+
+
+# Como antes: requests.get sin sesion, sin timeout ni reintentos
+def legacy_send(api_url, chat_id, body):
+    response = requests.get(f"{api_url}/botTOKEN/sendMessage", params={"chat_id": chat_id, "text": body, "parse_mode": "html"}).json()
+    return response.get("ok")
+
+
+def client_send(client, chat_id, body):
+    return client.send_message("TOKEN", chat_id, body).get("ok")
+
+
+def run(send, messages, chats, threads):
+    jobs = [(f"chat_{number % chats}", f"Alerta {number}") for number in range(messages)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(lambda job: send(*job), jobs))
+    return time.perf_counter() - start, sum(bool(result) for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cliente de Telegram contra un Bot API falso con limites")
+    parser.add_argument("--messages", type=int, default=60, help="mensajes de la rafaga")
+    parser.add_argument("--chats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--keepalive-messages", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.005, help="segundos que tarda el Bot API falso en responder")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraccion de respuestas 502 en la rafaga")
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.latency, send_telegram.CHAT_RATE, send_telegram.CHAT_BURST, send_telegram.GLOBAL_RATE, 0)
+    api_url = f"http://127.0.0.1:{api.server_address[1]}"
+    print(f"{'escenario':<22}{'modo':<10}{'segundos':>10}{'entregados':>12}{'429':>6}{'5xx':>6}{'conexiones':>12}")
+
+    def report(scenario, mode, elapsed, total):
+        print(f"{scenario:<22}{mode:<10}{elapsed:>10.2f}{f'{len(api.delivered)}/{total}':>12}{api.rejected:>6}{api.failed:>6}{api.connections:>12}")
+
+    # Sin limites para medir solo la conexion
+    api.chat_rate = api.chat_burst = api.global_rate = 1e9
+    for mode, send in (("antes", lambda chat_id, body: legacy_send(api_url, chat_id, body)),
+                       ("cliente", lambda chat_id, body: client_send(unlimited, chat_id, body))):
+        unlimited = send_telegram.TelegramClient(api_url, chat_rate=1e9, chat_burst=1e9, global_rate=1e9, global_burst=1e9)
+        api.reset()
+        elapsed, _ = run(send, args.keepalive_messages, 1, 1)
+        report("keep-alive", mode, elapsed, args.keepalive_messages)
+
+    api.chat_rate, api.chat_burst, api.global_rate = send_telegram.CHAT_RATE, send_telegram.CHAT_BURST, send_telegram.GLOBAL_RATE
+    api.error_rate = args.error_rate
+    client = send_telegram.TelegramClient(api_url)
+    for mode, send in (("antes", lambda chat_id, body: legacy_send(api_url, chat_id, body)),
+                       ("cliente", lambda chat_id, body: client_send(client, chat_id, body))):
+        api.reset()
+        time.sleep(send_telegram.CHAT_BURST / send_telegram.CHAT_RATE)
+        elapsed, _ = run(send, args.messages, args.chats, args.threads)
+        report("rafaga", mode, elapsed, args.messages)
+
+    api.reset()
+    api.error_rate = 0
+    body = "x" * 4000
+    client.send_message("TOKEN", "chat_long", body)
+    method, _, text = api.delivered[0]
+    print(f"mensaje de {len(body)} caracteres: llego por {method} con {len(text)} caracteres")
+
+
+if __name__ == "__main__":
+    main()
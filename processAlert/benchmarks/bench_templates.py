@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import os, sys, time, random, argparse, tempfile, subprocess
+import yaml
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+import harness
+import templates
+
+# Benchmark de templates.py contra como armaba los bodies notify.py antes (yaml.safe_load en cada
+# corrida, get_json_values recursivo y body.format por alerta)
+# - alertas renderizadas por segundo (telegram + mail) con los templates ya cargados
+# - lo que tarda un proceso nuevo en tener los templates: parsear el yaml vs el pickle al dia
+#
+# ./bench_templates.py --alerts 100000 --startup-runs 20
+
+NOTIFICATIONS_FILE = os.path.join(harness.NOTIFY_DIR, "notifications.yaml")
+
+
+# Lo que hacia notify.py
+def get_json_values(dictionary, field_dot_notation):
+    if "." in field_dot_notation:
+        key, rest = field_dot_notation.split(".", 1)
+        return get_json_values(dictionary.get(key, {}), rest)
+    else:
+        return dictionary.get(field_dot_notation)
+
+
+def legacy_render(template_yaml, doc_data):
+    alert_name = get_json_values(doc_data, "alert.rule_name")
+    bodies = []
+    for channel in templates.CHANNELS:
+        dot_notation_list = get_json_values(template_yaml, channel+"."+alert_name+".vars")
+        body = get_json_values(template_yaml, channel+"."+alert_name+".body")
+        bodies.append(body.format(*[get_json_values(doc_data, dot_notation) for dot_notation in dot_notation_list]))
+    return bodies
+
+
+def compiled_render(template_set, doc_data):
+    alert_name = doc_data["alert"]["rule_name"]
+    return [template_set.get(channel, alert_name).render(doc_data) for channel in templates.CHANNELS]
+
+
+def make_docs(template_yaml, count):
+    rule_names = sorted(set(template_yaml["telegram"]) & set(template_yaml["email"]))
+    return [{"alert": {"rule_name": random.choice(rule_names),
+                       "extra_data": {"num_hits": random.randint(10000, 99999), "ip_client": f"10.0.{number % 256}.{number % 97}",
+                                      "ip_client_keyword": f"10.0.{number % 256}.{number % 97}"}},
+             "cti": "<i>sin datos de CTI</i>"}
+            for number in range(count)]
+
+
+def startup(code, runs, env):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=env, cwd=harness.NOTIFY_DIR)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los templates compilados de notificaciones")
+    parser.add_argument("--alerts", type=int, default=100000)
+    parser.add_argument("--startup-runs", type=int, default=20)
+    parser.add_argument("--path", default=NOTIFICATIONS_FILE)
+    args = parser.parse_args()
+
+    with open(args.path) as file:
+        template_yaml = yaml.safe_load(file)
+    template_set = templates.TemplateSet(template_yaml)
+    docs = make_docs(template_yaml, args.alerts)
+    assert all(legacy_render(template_yaml, doc) == compiled_render(template_set, doc) for doc in docs[:1000])
+
+    print(f"{'render':<28}{'alertas/s':>12}")
+    for name, render, loaded in (("get_json_values + format", legacy_render, template_yaml),
+                                 ("compilados", compiled_render, template_set)):
+        start = time.perf_counter()
+        for doc in docs:
+            render(loaded, doc)
+        print(f"{name:<28}{args.alerts / (time.perf_counter() - start):>12.0f}")
+
+    env = dict(os.environ, NOTIFY_TEMPLATE_CACHE_DIR=tempfile.mkdtemp())
+    subprocess.run([sys.executable, "-c", f"import templates; templates.load({args.path!r})"], check=True, env=env,
+                   cwd=harness.NOTIFY_DIR)
+    print(f"{'proceso nuevo (mediana)':<28}{'ms':>12}")
+    for name, code in (("python sin nada", "pass"),
+                       ("yaml.safe_load", f"import yaml; yaml.safe_load(open({args.path!r}))"),
+                       ("templates.load (pickle)", f"import templates; templates.load({args.path!r})")):
+        print(f"{name:<28}{startup(code, args.startup_runs, env) * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+import os, sys, threading, importlib.util
+from collections.abc import Mapping
+
+# Registro de los plugins de canal: cada send_<canal>.py de los directorios de plugins es un canal
+# Al arrancar solo se listan los archivos; el plugin (y lo que importa: requests, smtplib) se carga
+# la primera vez que se manda algo por ese canal, asi una regla que solo usa telegram no paga el mail
+# y notify.py con el dispatcher corriendo no carga ninguno
+#
+# Un plugin tiene que tener send_notification(notification) que devuelve True si el canal entrego
+#
+# ./channels.py            lista los canales y de donde sale cada uno
+
+PLUGIN_PREFIX = "send_"
+
+# Se buscan en orden y el primero que tiene el canal gana: los plugins del repo y despues los instalados
+PLUGIN_DIRS = os.environ.get("NOTIFY_PLUGIN_DIRS", os.pathsep.join([
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugins"),
+    "/opt/soc-scripts/exec/elastalert/process_alert/notifications_scripts",
+])).split(os.pathsep)
+
+
+# canal -> archivo del plugin, sin importar nada
+def discover(directories=PLUGIN_DIRS):
+    paths = {}
+    for directory in directories:
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for name in names:
+            if name.startswith(PLUGIN_PREFIX) and name.endswith(".py"):
+                paths.setdefault(name[len(PLUGIN_PREFIX):-len(".py")], os.path.join(directory, name))
+    return paths
+
+
+class ChannelRegistry(Mapping):
+    def __init__(self, directories=PLUGIN_DIRS):
+        self.paths = discover(directories)
+        self.modules = {}
+        self.senders = {}
+        # Un lock por canal: importar requests para telegram no frena al primer mail
+        self.locks = {channel: threading.Lock() for channel in self.paths}
+
+    # Importa el plugin la primera vez; si ya estaba importado con su nombre (un benchmark, otro
+    # script) se usa ese para no tener dos copias con su propia pool de conexiones
+    def plugin(self, channel):
+        module = self.modules.get(channel)
+        if module is not None:
+            return module
+        with self.locks[channel]:
+            if channel not in self.modules:
+                path = self.paths[channel]
+                name = os.path.splitext(os.path.basename(path))[0]
+                module = sys.modules.get(name)
+                if module is None:
+                    spec = importlib.util.spec_from_file_location(name, path)
+                    module = importlib.util.module_from_spec(spec)
+                    sys.modules[name] = module
+                    try:
+                        spec.loader.exec_module(module)
+                    except BaseException:
+                        del sys.modules[name]
+                        raise
+                if not hasattr(module, "send_notification"):
+                    raise ImportError(f"el plugin {path} no tiene send_notification")
+                self.modules[channel] = module
+            return self.modules[channel]
+
+    def loaded(self):
+        return sorted(self.modules)
+
+    # Funcion que entrega una notificacion del canal o tira excepcion (lo que espera el dispatcher)
+    # El plugin se importa recien cuando se llama
+    def __getitem__(self, channel):
+        if channel not in self.paths:
+            raise KeyError(channel)
+        sender = self.senders.get(channel)
+        if sender is None:
+            def sender(notification):
+                if not self.plugin(channel).send_notification(notification):
+                    raise RuntimeError(f"{channel} no entrego la notificacion")
+            self.senders[channel] = sender
+        return sender
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def main():
+    for channel, path in discover().items():
+        print(f"{channel:<12}{path}")
+
+
+if __name__ == "__main__":
+    main()
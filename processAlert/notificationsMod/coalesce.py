@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+import json, html, time, asyncio
+
+# Agrupa las rafagas de alertas en el dispatcher: la primera alerta de un grupo sale en el momento
+# y abre una ventana; las que llegan mientras la ventana esta abierta no se mandan, se cuentan y se
+# juntan sus valores distintos. Al cerrar la ventana sale un resumen por canal y se abre otra; si no
+# llego nada la ventana se cierra y la proxima alerta vuelve a salir en el momento
+#
+# Se configura por regla en la seccion coalesce de notifications.yaml:
+#
+# coalesce:
+#   WAF-10k-in-10min_0:
+#     window: 600                                 # segundos
+#     key:                                        # campos que separan grupos, ademas de la regla
+#       - "alert.extra_data.ip_client_keyword"
+#     fields:                                     # campos cuyos valores distintos van en el resumen
+#       - "alert.extra_data.num_hits"
+
+DEFAULT_WINDOW = 300
+
+# Valores distintos que se listan por campo, el resto solo se cuenta
+MAX_DISTINCT = 20
+
+# Como se separan los renglones del resumen en cada canal (el mail es html)
+LINE_SEPARATOR = {"telegram": "\n", "email": "<br>\n"}
+
+
+class Window:
+    def __init__(self, notification, info):
+        # La notificacion que salio primero, el resumen sale al mismo destino
+        self.notification = notification
+        self.rule = info["rule"]
+        self.window = info.get("window") or DEFAULT_WINDOW
+        self.fields = list(info["values"])
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        # ids del outbox de las alertas agrupadas, se borran cuando se guarda el resumen
+        self.held = []
+        self.started = time.time()
+        # Campo -> valores distintos (un dict como set ordenado) y cuantos quedaron afuera
+        self.values = {field: {} for field in self.fields}
+        self.overflow = {field: 0 for field in self.fields}
+
+    def add(self, values, outbox_id=None):
+        self.count += 1
+        self.held.append(outbox_id)
+        for field, value in values.items():
+            distinct = self.values.setdefault(field, {})
+            self.overflow.setdefault(field, 0)
+            value = str(value)
+            if value in distinct:
+                distinct[value] += 1
+            elif len(distinct) < MAX_DISTINCT:
+                distinct[value] = 1
+            else:
+                self.overflow[field] += 1
+
+    def digest(self):
+        channel = self.notification["channel"]
+        seconds = round(time.time() - self.started)
+        elapsed = f"{seconds} s" if seconds < 120 else f"{round(seconds / 60)} min"
+        lines = [f"<b>Resumen: {html.escape(self.rule)}</b>", f"{self.count} alertas mas en los ultimos {elapsed}", ""]
+        for field, distinct in self.values.items():
+            listed = ", ".join(f"{html.escape(value)} ({count})" if count > 1 else html.escape(value) for value, count in distinct.items())
+            if self.overflow[field]:
+                listed += f" y {self.overflow[field]} mas"
+            lines.append(f"{html.escape(field)}: {listed}")
+        digest = dict(self.notification)
+        digest["body"] = LINE_SEPARATOR.get(channel, "\n").join(lines)
+        return digest
+
+
+class Coalescer:
+    # emit: corrutina que encola un resumen (con los ids de outbox de lo que agrupa) sin volver a pasar por el coalescer
+    def __init__(self, emit):
+        self.emit = emit
+        self.windows = {}
+        self.timers = {}
+        self.pending = set()
+        # Alertas que se guardaron para un resumen en vez de mandarse, y resumenes mandados
+        self.coalesced = 0
+        self.digests = 0
+
+    # True si la notificacion tiene que salir ahora; la info de coalesce se saca siempre
+    def offer(self, notification, outbox_id=None):
+        info = notification.pop("coalesce", None)
+        if info is None:
+            return True
+        key = json.dumps([notification["channel"]] + info["key"], default=str)
+        window = self.windows.get(key)
+        if window is None:
+            self.windows[key] = Window(notification, info)
+            self.schedule(key)
+            return True
+        window.add(info["values"], outbox_id)
+        self.coalesced += 1
+        return False
+
+    def schedule(self, key):
+        loop = asyncio.get_running_loop()
+        self.timers[key] = loop.call_later(self.windows[key].window, self.close, key)
+
+    # Fin de la ventana: si se guardo algo sale el resumen y sigue otra ventana, sino se cierra
+    def close(self, key):
+        window = self.windows[key]
+        if not window.count:
+            del self.windows[key]
+            del self.timers[key]
+            return
+        self.send_digest(window)
+        window.reset()
+        self.schedule(key)
+
+    def send_digest(self, window):
+        self.digests += 1
+        task = asyncio.get_running_loop().create_task(self.emit(window.digest(), window.held))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    # Al frenar el dispatcher salen los resumenes que quedaron a medias
+    async def flush(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        for window in self.windows.values():
+            if window.count:
+                self.send_digest(window)
+        self.windows.clear()
+        self.timers.clear()
+        await asyncio.gather(*self.pending)
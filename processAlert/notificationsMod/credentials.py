@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+import sys, time, threading
+from concurrent.futures import Future
+
+# Credenciales de los canales de notificacion con cache en memoria
+# Cada credencial se pide al proveedor (vault, archivo) una vez y vale CREDENTIAL_TTL segundos;
+# cuando falta REFRESH_BEFORE para que venza se renueva en un thread aparte y mientras tanto se
+# sigue usando la que hay, asi ningun envio espera al vault. Si varios threads piden la misma
+# credencial que no esta, uno solo va al proveedor y los demas esperan su resultado (single-flight)
+# Sirve sobre todo en el dispatcher, que manda muchas alertas desde el mismo proceso
+#
+# credentials.get("soc_updates_bot")                       -> vault
+# credentials.get("soc_mail_app_password", "email_file")   -> archivo de creds del mail
+
+CREDENTIAL_TTL = 300
+REFRESH_BEFORE = 60
+
+EMAIL_CREDS_FILE = "/home/despegar/notify_email_creds.yaml"
+
+# Donde esta vault_manager, se agrega al path recien cuando se pide algo al vault
+VAULT_MANAGER_PATH = "/opt/soc-scripts/include"
+
+
+class VaultProvider:
+    def fetch(self, name):
+        if VAULT_MANAGER_PATH not in sys.path:
+            sys.path.insert(1, VAULT_MANAGER_PATH)
+        import vault_manager
+        return vault_manager.get_credentials(name)['value']
+
+
+# Archivo con lineas clave=valor, como notify_email_creds.yaml
+class FileProvider:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, name):
+        with open(self.path, "r") as file:
+            for line in file:
+                key, separator, value = line.partition("=")
+                if separator and key.strip() == name:
+                    return value.strip("\n")
+        raise KeyError(f"{name} no esta en {self.path}")
+
+
+class Credential:
+    def __init__(self, value, ttl, refresh_before):
+        now = time.monotonic()
+        self.value = value
+        self.expires = now + ttl
+        self.refresh_at = now + max(0, ttl - refresh_before)
+
+
+class CredentialCache:
+    def __init__(self, provider, ttl=CREDENTIAL_TTL, refresh_before=REFRESH_BEFORE):
+        self.provider = provider
+        self.ttl = ttl
+        self.refresh_before = refresh_before
+        self.credentials = {}
+        # name -> Future del pedido al proveedor que esta en curso
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        now = time.monotonic()
+        with self.lock:
+            credential = self.credentials.get(name)
+            if credential is not None and now < credential.expires:
+                if now >= credential.refresh_at and name not in self.inflight:
+                    future = self.inflight[name] = Future()
+                    threading.Thread(target=self.fetch, args=(name, future, True), daemon=True).start()
+                return credential.value
+            future = self.inflight.get(name)
+            leader = future is None
+            if leader:
+                future = self.inflight[name] = Future()
+        if leader:
+            self.fetch(name, future)
+        return future.result()
+
+    def fetch(self, name, future, background=False):
+        try:
+            value = self.provider.fetch(name)
+        except Exception as e:
+            with self.lock:
+                del self.inflight[name]
+            # Si fallo la renovacion se sigue usando la que hay hasta que venza
+            if background:
+                print(f"No se pudo renovar la credencial {name}: {e}", file=sys.stderr)
+            future.set_exception(e)
+            return
+        with self.lock:
+            self.credentials[name] = Credential(value, self.ttl, self.refresh_before)
+            del self.inflight[name]
+        future.set_result(value)
+
+    def invalidate(self, name):
+        with self.lock:
+            self.credentials.pop(name, None)
+
+
+# Proveedor -> cache; se pueden registrar otros (ver register)
+caches = {}
+
+
+def register(provider_name, provider, ttl=CREDENTIAL_TTL, refresh_before=REFRESH_BEFORE):
+    caches[provider_name] = CredentialCache(provider, ttl, refresh_before)
+
+
+def get(name, provider_name="vault"):
+    return caches[provider_name].get(name)
+
+
+register("vault", VaultProvider())
+register("email_file", FileProvider(EMAIL_CREDS_FILE))
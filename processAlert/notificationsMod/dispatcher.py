@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+import os, sys, json, time, signal, socket, asyncio, argparse
+from concurrent.futures import ThreadPoolExecutor
+from coalesce import Coalescer
+from outbox import Outbox, OUTBOX_PATH
+from dispatcher_client import DISPATCHER_SOCKET
+
+# Dispatcher de notificaciones: notify.py encola las notificaciones ya armadas en un unix socket
+# y este proceso las entrega en segundo plano, asi la alerta no espera a Telegram ni al SMTP
+# Cada canal tiene su cola acotada y una cantidad fija de envios en paralelo. Sin outbox, con la
+# cola llena el "ok" se demora y el que encola espera (back-pressure) en vez de perder avisos; con
+# outbox el "ok" sale apenas quedan en disco y la espera la absorbe el outbox
+# Las reglas con seccion coalesce en notifications.yaml pasan por el Coalescer (ver coalesce.py)
+# Con outbox cada notificacion se guarda en disco antes de contestar "ok" y se borra al entregarse;
+# las que fallan se reintentan con backoff y al agotar los intentos quedan como dead letter (ver outbox.py)
+#
+# ./dispatcher.py --socket /tmp/notify_dispatcher.sock --telegram-workers 4 --email-workers 2
+
+# Envios en paralelo por canal y notificaciones que pueden esperar en la cola de cada canal
+CHANNEL_CONCURRENCY = {"telegram": 4, "email": 2}
+QUEUE_SIZE = 1000
+
+# Largo maximo de una linea (una notificacion en json) que acepta el socket
+MAX_LINE = 1024 * 1024
+
+# Intentos por notificacion antes de dejarla como dead letter, y segundos entre intentos
+# (se duplican en cada intento hasta RETRY_MAX)
+MAX_ATTEMPTS = 8
+RETRY_BASE = 5
+RETRY_MAX = 600
+
+# Cada cuanto se buscan en el outbox pendientes que dejo otro proceso (notify.py sin dispatcher)
+OUTBOX_SCAN_INTERVAL = 30
+
+
+class Dispatcher:
+    # senders: canal -> funcion bloqueante que entrega una notificacion o tira excepcion (ver notify.senders)
+    def __init__(self, senders, concurrency=None, queue_size=QUEUE_SIZE, outbox=None, max_attempts=MAX_ATTEMPTS):
+        self.senders = senders
+        concurrency = concurrency or CHANNEL_CONCURRENCY
+        self.concurrency = {channel: concurrency.get(channel, 1) for channel in senders}
+        self.queue_size = queue_size
+        self.queues = {}
+        self.workers = []
+        self.sent = {channel: 0 for channel in senders}
+        self.failed = {channel: 0 for channel in senders}
+        self.dead = {channel: 0 for channel in senders}
+        self.executor = None
+        self.coalescer = Coalescer(self.put_digest)
+        self.max_attempts = max_attempts
+        # Reintentos esperando su turno
+        self.retries = set()
+        self.outbox = outbox
+        self.outbox_tasks = []
+        self.outbox_operations = []
+        # ids del outbox que ya estan en memoria (en cola, esperando reintento o agrupados)
+        self.tracked = set()
+        self.commits = 0
+
+    # Las colas se crean dentro del loop que las va a usar
+    async def start(self):
+        self.executor = ThreadPoolExecutor(sum(self.concurrency.values()), thread_name_prefix="notify")
+        for channel, workers in self.concurrency.items():
+            self.queues[channel] = asyncio.Queue(self.queue_size)
+            self.workers.extend(asyncio.create_task(self.worker(channel)) for _ in range(workers))
+        if self.outbox is not None:
+            # SQLite es bloqueante: la base se usa desde un solo thread aparte
+            self.database = ThreadPoolExecutor(1, thread_name_prefix="outbox")
+            self.outbox_wake = asyncio.Event()
+            self.outbox_tasks = [asyncio.create_task(self.write_outbox()), asyncio.create_task(self.scan_outbox())]
+
+    # Lo que piden los clientes y los workers mientras se escribe una transaccion se junta
+    # y va todo en la siguiente (group commit): una rafaga no paga un fsync por notificacion
+    async def outbox_operation(self, name, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.outbox_operations.append((name, args, future))
+        self.outbox_wake.set()
+        return await future
+
+    async def write_outbox(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.outbox_wake.wait()
+            self.outbox_wake.clear()
+            operations, self.outbox_operations = self.outbox_operations, []
+            try:
+                results = await loop.run_in_executor(self.database, self.outbox.apply, [(name, args) for name, args, _ in operations])
+            except Exception as e:
+                for _, _, future in operations:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.commits += 1
+            for (name, args, future), result in zip(operations, results):
+                if name == "add":
+                    self.tracked.update(result)
+                    self.tracked.difference_update(args[1])
+                elif name == "done":
+                    self.tracked.difference_update(args[0])
+                elif name == "dead":
+                    self.tracked.discard(args[0])
+                if not future.done():
+                    future.set_result(result)
+
+    # Al arrancar retoma lo que quedo pendiente; despues, cada tanto, lo que agregaron otros procesos
+    async def scan_outbox(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await loop.run_in_executor(self.database, self.outbox.pending)
+            now = time.time()
+            for outbox_id, attempts, next_attempt, notification in pending:
+                if outbox_id in self.tracked or notification.get("channel") not in self.queues:
+                    continue
+                self.tracked.add(outbox_id)
+                if attempts:
+                    # Ya salio al menos una vez (no se vuelve a agrupar), espera su reintento
+                    notification.pop("coalesce", None)
+                    self.put_later(max(0, next_attempt - now), (outbox_id, attempts, notification))
+                else:
+                    await self.put(notification, outbox_id)
+            await asyncio.sleep(OUTBOX_SCAN_INTERVAL)
+
+    # Espera lugar en la cola del canal, es lo que frena a los clientes si la cola esta llena
+    async def put_now(self, notification, outbox_id=None, attempts=0):
+        await self.queues[notification["channel"]].put((outbox_id, attempts, notification))
+
+    async def put(self, notification, outbox_id=None):
+        if self.coalescer.offer(notification, outbox_id):
+            await self.put_now(notification, outbox_id)
+
+    # El resumen se guarda en la misma transaccion que borra las alertas que agrupa
+    async def put_digest(self, digest, held_ids):
+        outbox_id = None
+        if self.outbox is not None:
+            [outbox_id] = await self.outbox_operation("add", [digest], [held_id for held_id in held_ids if held_id is not None])
+        await self.put_now(digest, outbox_id)
+
+    def put_later(self, delay, item):
+        async def wait_and_put():
+            await asyncio.sleep(delay)
+            await self.queues[item[2]["channel"]].put(item)
+        task = asyncio.get_running_loop().create_task(wait_and_put())
+        self.retries.add(task)
+        task.add_done_callback(self.retries.discard)
+
+    # Los senders son bloqueantes (requests / smtplib), corren en threads sin frenar el loop
+    async def worker(self, channel):
+        loop = asyncio.get_running_loop()
+        queue = self.queues[channel]
+        send = self.senders[channel]
+        while True:
+            outbox_id, attempts, notification = await queue.get()
+            try:
+                await loop.run_in_executor(self.executor, send, notification)
+                self.sent[channel] += 1
+                if outbox_id is not None:
+                    await self.outbox_operation("done", [outbox_id])
+            except Exception as e:
+                self.failed[channel] += 1
+                await self.failed_delivery(channel, outbox_id, attempts + 1, notification, e)
+            finally:
+                queue.task_done()
+
+    async def failed_delivery(self, channel, outbox_id, attempts, notification, error):
+        if attempts >= self.max_attempts:
+            self.dead[channel] += 1
+            print(f"Error mandando por {channel}, queda como dead letter tras {attempts} intentos: {error}", file=sys.stderr, flush=True)
+            if outbox_id is not None:
+                await self.outbox_operation("dead", outbox_id, attempts, str(error))
+            return
+        delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+        print(f"Error mandando por {channel} (intento {attempts}), se reintenta en {delay}s: {error}", file=sys.stderr, flush=True)
+        if outbox_id is not None:
+            await self.outbox_operation("retry", outbox_id, attempts, time.time() + delay, str(error))
+        self.put_later(delay, (outbox_id, attempts, notification))
+
+    # Entrega lo que quedo en las colas (y los resumenes a medias) y frena los workers
+    # Los reintentos que siguen esperando quedan en el outbox para el proximo arranque
+    async def drain(self):
+        for task in self.outbox_tasks[1:]:
+            task.cancel()
+        await self.coalescer.flush()
+        for queue in self.queues.values():
+            await queue.join()
+        if self.retries and self.outbox is None:
+            print(f"Se descartan {len(self.retries)} notificaciones esperando reintento (sin outbox)", file=sys.stderr)
+        for task in list(self.retries) + self.workers:
+            task.cancel()
+        await asyncio.gather(*self.retries, *self.workers, return_exceptions=True)
+        if self.outbox is not None:
+            # Barrera: cuando vuelve, todo lo anterior ya esta commiteado
+            await self.outbox_operation("done", [])
+            for task in self.outbox_tasks:
+                task.cancel()
+            await asyncio.gather(*self.outbox_tasks, return_exceptions=True)
+            self.database.shutdown()
+        self.executor.shutdown()
+
+    # Se valida todo lo que mando el cliente antes de encolar, asi un error no deja
+    # la mitad encolada y la otra mitad mandada directo (duplicada) por notify.py
+    # Con outbox el "ok" sale apenas quedan en disco, antes de esperar lugar en la cola: si la cola
+    # esta llena el cliente no llega a su timeout (y no las manda directo otra vez)
+    async def handle_client(self, reader, writer):
+        replied = False
+        try:
+            notifications = []
+            async for line in reader:
+                if line.strip():
+                    notification = json.loads(line)
+                    if notification.get("channel") not in self.queues:
+                        raise ValueError(f"canal desconocido: {notification.get('channel')}")
+                    notifications.append(notification)
+            outbox_ids = [None] * len(notifications)
+            if self.outbox is not None and notifications:
+                outbox_ids = await self.outbox_operation("add", notifications, [])
+                await self.reply(writer, b"ok\n")
+                replied = True
+            for notification, outbox_id in zip(notifications, outbox_ids):
+                await self.put(notification, outbox_id)
+            if not replied:
+                await self.reply(writer, b"ok\n")
+                replied = True
+        except Exception as e:
+            if not replied:
+                await self.reply(writer, f"error {e}\n".encode("utf-8"))
+            else:
+                # Ya estan en el outbox, las retoma el proximo arranque
+                print(f"Error encolando notificaciones ya guardadas: {e}", file=sys.stderr, flush=True)
+
+    # Si el cliente ya se fue no hay a quien avisarle
+    async def reply(self, writer, message):
+        try:
+            writer.write(message)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=DISPATCHER_SOCKET):
+        await self.start()
+        server = await asyncio.start_unix_server(self.handle_client, socket_path, limit=MAX_LINE)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            os.remove(socket_path)
+        await self.drain()
+        print(f"Dispatcher detenido, enviadas: {self.sent}, con error: {self.failed}, dead letters: {self.dead}, "
+              f"agrupadas: {self.coalescer.coalesced} en {self.coalescer.digests} resumenes", file=sys.stderr)
+
+
+# Un socket que existe pero no atiende quedo de un dispatcher que murio, se puede borrar
+def claim_socket(socket_path):
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    sys.exit(f"Ya hay un dispatcher escuchando en {socket_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrega en segundo plano las notificaciones que encola notify.py")
+    parser.add_argument("--socket", default=DISPATCHER_SOCKET, help=f"unix socket donde se encolan las notificaciones (default: {DISPATCHER_SOCKET})")
+    parser.add_argument("--telegram-workers", type=int, default=CHANNEL_CONCURRENCY["telegram"], help="mensajes de telegram en paralelo")
+    parser.add_argument("--email-workers", type=int, default=CHANNEL_CONCURRENCY["email"], help="mails en paralelo")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="notificaciones en espera por canal antes de frenar a los clientes")
+    parser.add_argument("--outbox", default=OUTBOX_PATH, help=f"base SQLite donde se guardan las notificaciones hasta entregarlas, vacio para no usarla (default: {OUTBOX_PATH})")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="intentos antes de dejar una notificacion como dead letter")
+    args = parser.parse_args()
+
+    # notify.senders tiene un canal por plugin encontrado; cada plugin se importa con su primer envio
+    import notify
+    claim_socket(args.socket)
+    outbox = Outbox(args.outbox) if args.outbox else None
+    dispatcher = Dispatcher(notify.senders, {"telegram": args.telegram_workers, "email": args.email_workers}, args.queue_size,
+                            outbox, args.max_attempts)
+    asyncio.run(dispatcher.serve(args.socket))
+    if outbox is not None:
+        outbox.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+import os, json, socket
+
+# Lado cliente del dispatcher (ver dispatcher.py), aparte para que notify.py pueda encolar sin
+# cargar asyncio, sqlite ni el resto del daemon
+
+DISPATCHER_SOCKET = os.environ.get("NOTIFY_DISPATCHER_SOCKET", "/tmp/notify_dispatcher.sock")
+
+# Cuanto espera el que encola antes de rendirse y mandar directo
+ENQUEUE_TIMEOUT = 5
+
+
+# Ya conectado, el dispatcher no confirmo: puede que las tenga (en su outbox o esperando lugar
+# en la cola) y mandarlas directo las duplicaria. timed_out: no contesto a tiempo (sigue vivo)
+class EnqueueUnconfirmed(Exception):
+    def __init__(self, message, timed_out=False):
+        super().__init__(message)
+        self.timed_out = timed_out
+
+
+# Manda las notificaciones (una por linea) y espera el "ok" de que quedaron encoladas
+# Tira OSError si no hay dispatcher o si respondio un error (no encolo nada): se puede mandar directo
+# Tira EnqueueUnconfirmed si se corto o no contesto despues de conectar
+def enqueue(notifications, socket_path=DISPATCHER_SOCKET, timeout=ENQUEUE_TIMEOUT):
+    payload = "".join(json.dumps(notification) + "\n" for notification in notifications).encode("utf-8")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        try:
+            client.sendall(payload)
+            client.shutdown(socket.SHUT_WR)
+            response = client.makefile("rb").readline().strip()
+        except TimeoutError as e:
+            raise EnqueueUnconfirmed(f"el dispatcher no contesto en {timeout}s", timed_out=True) from e
+        except OSError as e:
+            raise EnqueueUnconfirmed(f"se corto la conexion con el dispatcher: {e}") from e
+    if not response:
+        raise EnqueueUnconfirmed("el dispatcher cerro la conexion sin contestar")
+    if response != b"ok":
+        raise ConnectionError(f"el dispatcher respondio {response.decode('utf-8', 'replace')}")
@@ -1,12 +1,15 @@
 #!/usr/bin/python3
 import sys
 import json
-import yaml
-sys.path.insert(1, '/opt/soc-scripts/include')
-sys.path.insert(1,"/opt/soc-scripts/exec/elastalert/process_alert/notifications_scripts")
-import vault_manager
-import send_telegram
-import send_email
+import dispatcher_client
+import templates
+from channels import ChannelRegistry
+
+
+notifications_file = "/home/despegar/notifications.yaml"
+
+# Envios en paralelo cuando se manda directo (sin dispatcher)
+DIRECT_WORKERS = 8
 
 
 def get_json_values(dictionary, field_dot_notation):
@@ -16,39 +19,134 @@ def get_json_values(dictionary, field_dot_notation):
     else:
         return dictionary.get(field_dot_notation)
 
-def build_body(body, dot_notation_list):
-    values = []
-    for dot_notation in dot_notation_list:
-        values.append(get_json_values(doc_data, dot_notation))
-    return body.format(*values)
 
+# Templates compilados, se recompilan solo si cambia el yaml (ver templates.py)
+def load_templates(path=notifications_file):
+    return templates.load(path)
 
-telegram_bot_name = "soc_updates_bot"
-notifications_file = "/home/despegar/notifications.yaml"
-doc_data = json.loads(str(sys.argv[1]).replace("'", '"'))
-rule_config = json.loads(str(sys.argv[3]).replace("'", '"'))
-alert_name = get_json_values(doc_data, "alert.rule_name")
-telegram_module_flagged = bool(get_json_values(rule_config, "telegram_enabled"))
-email_module_flagged = bool(get_json_values(rule_config, "email_enabled"))
-
-with open(notifications_file, "r") as file:
-    template_yaml = yaml.safe_load(file)
-
-if telegram_module_flagged:
-    bot_token = vault_manager.get_credentials(telegram_bot_name)['value']
-    dot_notation_list = get_json_values(template_yaml, "telegram."+alert_name+".vars")
-    body = get_json_values(template_yaml, "telegram."+alert_name+".body")
-    body = build_body(body, dot_notation_list)
-    chat_id = get_json_values(template_yaml, "telegram."+alert_name+".dest")
-    parse_mode = "html"
-    send_telegram.send_message(bot_token, chat_id, body, parse_mode)
-
-if email_module_flagged:
-    #sender_email = vault_manager.get_credentials(soc_email_address)['value']
-    #sender_passw = vault_manager.get_credentials(soc_email_token)['value']
-    dot_notation_list = get_json_values(template_yaml, "email."+alert_name+".vars")
-    body = get_json_values(template_yaml, "email."+alert_name+".body")
-    body = build_body(body, dot_notation_list)
-    dest_email = get_json_values(template_yaml, "email."+alert_name+".dest")
-    #send_email.send_email(sender_email, sender_passw, dest_email, alert_name, body)
-    send_email.send_email(dest_email, alert_name, body)
+
+# Lo que necesita el dispatcher para agrupar la alerta (seccion coalesce de notifications.yaml)
+def coalesce_info(doc_data, alert_name, coalesce_config):
+    return {
+        "rule": alert_name,
+        "key": [alert_name] + [get_json_values(doc_data, field) for field in coalesce_config.get("key", [])],
+        "window": coalesce_config.get("window"),
+        "values": {field: get_json_values(doc_data, field) for field in coalesce_config.get("fields", [])},
+    }
+
+
+# Un canal sin template para la regla (o con uno invalido) no frena a los demas: se avisa y se sigue
+def channel_template(template_set, channel, alert_name):
+    try:
+        return template_set.get(channel, alert_name)
+    except templates.TemplateError as e:
+        print(f"No se manda por {channel}: {e}", file=sys.stderr)
+        return None
+
+
+# Arma las notificaciones de la alerta segun el rule_config (telegram_enabled / email_enabled)
+# Cada una es un dict con "channel" y lo que necesita su sender, se puede mandar por json al dispatcher
+def build_notifications(doc_data, rule_config, template_set):
+    alert_name = get_json_values(doc_data, "alert.rule_name")
+    telegram_module_flagged = bool(get_json_values(rule_config, "telegram_enabled"))
+    email_module_flagged = bool(get_json_values(rule_config, "email_enabled"))
+    notifications = []
+
+    template = channel_template(template_set, "telegram", alert_name) if telegram_module_flagged else None
+    if template is not None:
+        body = template.render(doc_data)
+        for chat_id in template.destinations:
+            notifications.append({"channel": "telegram", "chat_id": chat_id, "body": body, "parse_mode": "html"})
+
+    template = channel_template(template_set, "email", alert_name) if email_module_flagged else None
+    if template is not None:
+        body = template.render(doc_data)
+        for dest in template.destinations:
+            notifications.append({"channel": "email", "dest": dest, "alert_name": alert_name, "body": body})
+
+    coalesce_config = template_set.coalesce.get(alert_name)
+    if coalesce_config:
+        for notification in notifications:
+            notification["coalesce"] = coalesce_info(doc_data, alert_name, coalesce_config)
+
+    return notifications
+
+
+# Canal -> funcion que entrega una notificacion o tira excepcion, la usan este script y el dispatcher
+# Los plugins (send_<canal>.py) se importan recien con el primer envio del canal (ver channels.py)
+senders = ChannelRegistry()
+
+
+def send_notification(notification):
+    senders[notification["channel"]](notification)
+
+
+# Todas a la vez (canales y destinos), devuelve las que fallaron
+def send_direct(notifications):
+    def send(notification):
+        try:
+            send_notification(notification)
+        except Exception as e:
+            print(f"Error mandando por {notification['channel']}, queda en el outbox: {e}", file=sys.stderr)
+            return notification
+
+    if len(notifications) == 1:
+        results = [send(notifications[0])]
+    else:
+        # concurrent.futures trae logging, solo se carga si se manda directo
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(DIRECT_WORKERS, len(notifications))) as executor:
+            results = list(executor.map(send, notifications))
+    return [notification for notification in results if notification is not None]
+
+
+# Las guarda en el outbox para que las entregue el dispatcher; sqlite solo se carga si hace falta
+def store_in_outbox(notifications):
+    import outbox
+    store = outbox.Outbox()
+    try:
+        store.add(notifications)
+    finally:
+        store.close()
+
+
+# Manda las notificaciones de la alerta. Si el dispatcher esta corriendo solo se encolan y
+# la alerta sigue de largo, si no se mandan directo desde este proceso como siempre
+# (sin dispatcher no hay agrupado de rafagas: cada proceso ve una sola alerta)
+# Las que fallan al mandar directo quedan en el outbox y las entrega el dispatcher cuando corra
+# Si el dispatcher las recibio pero no confirmo nunca se mandan directo (saldrian dos veces)
+# Se puede llamar desde otro script (ver process_alert.py) con el doc ya parseado
+def notify(doc_data, rule_config, template_set=None):
+    if template_set is None:
+        template_set = load_templates()
+    notifications = build_notifications(doc_data, rule_config, template_set)
+    if not notifications:
+        return
+    try:
+        dispatcher_client.enqueue(notifications)
+        return
+    except dispatcher_client.EnqueueUnconfirmed as e:
+        if e.timed_out:
+            # Sigue vivo y con las notificaciones en mano (cola llena): las entrega el dispatcher cuando se libere la cola
+            print(f"{e}, quedan en el dispatcher", file=sys.stderr)
+        else:
+            print(f"{e}, quedan en el outbox", file=sys.stderr)
+            store_in_outbox(notifications)
+        return
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"No se pudo encolar en el dispatcher, se manda directo: {e}", file=sys.stderr)
+    failed = send_direct(notifications)
+    if failed:
+        store_in_outbox(failed)
+
+
+def main():
+    doc_data = json.loads(str(sys.argv[1]).replace("'", '"'))
+    rule_config = json.loads(str(sys.argv[3]).replace("'", '"'))
+    notify(doc_data, rule_config)
+
+
+if __name__ == "__main__":
+    main()
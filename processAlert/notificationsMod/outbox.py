@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+import os, sys, json, time, sqlite3, argparse
+
+# Outbox en disco (SQLite en modo WAL) para no perder notificaciones: el dispatcher guarda cada
+# notificacion antes de contestar "ok" y la borra recien cuando el canal la entrego. Las que fallan
+# quedan con su proximo intento y, pasados los reintentos, como dead letter para revisarlas a mano
+# Al arrancar, el dispatcher retoma lo que habia quedado pendiente (entrega al menos una vez)
+#
+# ./outbox.py                      pendientes y dead letters
+# ./outbox.py --dead               lista las dead letters con su ultimo error
+# ./outbox.py --requeue-dead       las vuelve a pendientes (el dispatcher las toma en el proximo escaneo)
+
+OUTBOX_PATH = os.environ.get("NOTIFY_OUTBOX", os.path.join(os.path.expanduser("~"), ".local", "state", "notify", "outbox.sqlite"))
+
+# Segundos que espera una escritura si otro proceso tiene la base bloqueada
+BUSY_TIMEOUT = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notifications_pending ON notifications (status, next_attempt);
+"""
+
+
+class Outbox:
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # El dispatcher usa la conexion desde un solo thread a la vez (su executor de la base)
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Con WAL, NORMAL no pierde nada si se cae el proceso (solo si se corta la luz)
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def transaction(self, operations):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            results = [operation() for operation in operations]
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return results
+
+    # Aplica varias operaciones [(nombre, args)] en una sola transaccion (group commit)
+    # y devuelve el resultado de cada una
+    def apply(self, operations):
+        return self.transaction([lambda name=name, args=args: getattr(self, "op_" + name)(*args) for name, args in operations])
+
+    def add(self, notifications, done_ids=()):
+        return self.apply([("add", (notifications, done_ids))])[0]
+
+    # Guarda notificaciones y devuelve sus ids; done_ids se borran en la misma transaccion
+    # (un resumen reemplaza a las alertas que agrupo)
+    def op_add(self, notifications, done_ids=()):
+        now = time.time()
+        ids = [self.connection.execute("INSERT INTO notifications (channel, payload, created) VALUES (?, ?, ?)",
+                                       (notification["channel"], json.dumps(notification), now)).lastrowid
+               for notification in notifications]
+        self.op_done(done_ids)
+        return ids
+
+    def op_done(self, ids):
+        self.connection.executemany("DELETE FROM notifications WHERE id = ?", [(outbox_id,) for outbox_id in ids])
+
+    def op_retry(self, outbox_id, attempts, next_attempt, error):
+        self.connection.execute("UPDATE notifications SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                                (attempts, next_attempt, error, outbox_id))
+
+    def op_dead(self, outbox_id, attempts, error):
+        self.connection.execute("UPDATE notifications SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                                (attempts, error, outbox_id))
+
+    # [(id, intentos, proximo intento, notificacion)] de las pendientes, en el orden en que llegaron
+    def pending(self):
+        rows = self.connection.execute("SELECT id, attempts, next_attempt, payload FROM notifications "
+                                       "WHERE status = 'pending' ORDER BY id").fetchall()
+        return [(outbox_id, attempts, next_attempt, json.loads(payload)) for outbox_id, attempts, next_attempt, payload in rows]
+
+    def dead_letters(self):
+        return self.connection.execute("SELECT id, channel, attempts, last_error, created, payload FROM notifications "
+                                       "WHERE status = 'dead' ORDER BY id").fetchall()
+
+    def requeue_dead(self):
+        return self.connection.execute("UPDATE notifications SET status = 'pending', attempts = 0, next_attempt = 0 "
+                                       "WHERE status = 'dead'").rowcount
+
+    def counts(self):
+        return dict(self.connection.execute("SELECT status, count(*) FROM notifications GROUP BY status").fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estado del outbox de notificaciones")
+    parser.add_argument("--path", default=OUTBOX_PATH, help=f"base del outbox (default: {OUTBOX_PATH})")
+    parser.add_argument("--dead", action="store_true", help="lista las dead letters")
+    parser.add_argument("--requeue-dead", action="store_true", help="vuelve las dead letters a pendientes")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit(f"No existe el outbox {args.path}")
+    outbox = Outbox(args.path)
+    if args.requeue_dead:
+        print(f"{outbox.requeue_dead()} dead letters vueltas a pendientes")
+    elif args.dead:
+        for outbox_id, channel, attempts, last_error, created, payload in outbox.dead_letters():
+            print(f"{outbox_id} {channel} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))} "
+                  f"intentos={attempts} error={last_error}\n    {payload}")
+    else:
+        counts = outbox.counts()
+        print(f"pendientes: {counts.get('pending', 0)}, dead letters: {counts.get('dead', 0)}")
+    outbox.close()
+
+
+if __name__ == "__main__":
+    main()
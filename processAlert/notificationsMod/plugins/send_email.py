@@ -1,61 +1,225 @@
+# Plugin del canal email: notify.py (o el dispatcher) llama a send_notification con la notificacion
+# armada ({"dest", "alert_name", "body"})
+import sys
+import time
 import smtplib
-import requests
+import threading
+import functools
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import credentials
+
+# Las conexiones SMTP quedan abiertas y autenticadas entre mails: el starttls y el login se pagan
+# una vez por sesion y no por alerta. Con el dispatcher corriendo la misma sesion sirve a todas las alertas
+#
+# Conexiones abiertas a la vez (una por worker de mail del dispatcher), segundos que una puede quedar
+# sin uso antes de descartarla (el server las corta solo) y mails por sesion antes de reconectar
+SMTP_POOL_SIZE = 2
+SMTP_IDLE_TIMEOUT = 60
+SMTP_MESSAGES_PER_SESSION = 100
+SMTP_TIMEOUT = 30
 
 
 #--TEST ONLY-----------------------------------------------------
+# Del archivo de creds a traves del cache de credentials.py, se relee solo cuando vence
 def get_sender_creds():
-    notify_email_creds = "/home/despegar/notify_email_creds.yaml"
-    with open(notify_email_creds, "r") as file:
-        sensitive = file.readlines()
-        email = password = ""
-        port = 0
-    for line in sensitive:
-        if "soc_mail_address" in line:
-            email = line.split("=")[1].strip("\n")
-        if "soc_mail_app_password" in line:
-            password = line.split("=")[1].strip("\n")
-        if "soc_mail_smtp_srv" in line:
-            srv = line.split("=")[1].strip("\n")
-        if "soc_mail_smtp_port" in line:
-            port = int(line.split("=")[1].strip("\n"))
+    email = credentials.get("soc_mail_address", "email_file")
+    password = credentials.get("soc_mail_app_password", "email_file")
+    srv = credentials.get("soc_mail_smtp_srv", "email_file")
+    port = int(credentials.get("soc_mail_smtp_port", "email_file"))
     return email, password, srv, port
 #----------------------------------------------------------------
 
+
+@functools.lru_cache(maxsize=None)
+def get_mail_footer(path='mail-footer.html'):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+class SmtpConnection:
+    def __init__(self, server):
+        self.server = server
+        self.sent = 0
+        # Vuelve a la pool al menos una vez: puede haberse cortado mientras esperaba
+        self.reused = False
+        self.last_used = time.monotonic()
+
+
+class SmtpPool:
+    def __init__(self, host, port, user, password, starttls=True, size=SMTP_POOL_SIZE,
+                 idle_timeout=SMTP_IDLE_TIMEOUT, messages_per_session=SMTP_MESSAGES_PER_SESSION, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.idle_timeout = idle_timeout
+        self.messages_per_session = messages_per_session
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        # Sesiones abiertas desde que arranco el proceso
+        self.connections = 0
+
+    def open_server(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        with self.lock:
+            self.connections += 1
+        return server
+
+    def quit(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def reconnect(self, connection, broken=False):
+        if broken:
+            connection.server.close()
+        else:
+            self.quit(connection.server)
+        connection.server = self.open_server()
+        connection.sent = 0
+        connection.reused = False
+
+    # Espera una conexion libre; las que pasaron idle_timeout sin uso se cierran y se abre otra
+    def checkout(self):
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return SmtpConnection(self.open_server())
+                if time.monotonic() - connection.last_used < self.idle_timeout:
+                    return connection
+                self.quit(connection.server)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def checkin(self, connection, broken=False):
+        if broken:
+            connection.server.close()
+        else:
+            connection.reused = True
+            connection.last_used = time.monotonic()
+            with self.lock:
+                self.idle.append(connection)
+        self.slots.release()
+
+    # Si una conexion reusada se corto (timeout del server, reinicio) se reconecta y se reintenta
+    # una vez; si la conexion era nueva el error sube
+    def deliver(self, connection, sender, dest, message):
+        if connection.sent >= self.messages_per_session:
+            self.reconnect(connection)
+        try:
+            connection.server.sendmail(sender, dest, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            if not connection.reused:
+                raise
+            self.reconnect(connection, broken=True)
+            connection.server.sendmail(sender, dest, message)
+        connection.sent += 1
+
+    # Manda varios mails [(from, to, mensaje)] por la misma sesion
+    # Devuelve un error (o None) por mail: un destinatario rechazado no frena al resto
+    def send(self, messages):
+        errors = []
+        connection = self.checkout()
+        try:
+            for sender, dest, message in messages:
+                try:
+                    self.deliver(connection, sender, dest, message)
+                    errors.append(None)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                    errors.append(e)
+        except BaseException:
+            self.checkin(connection, broken=True)
+            raise
+        self.checkin(connection)
+        return errors
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            self.quit(connection.server)
+
+
+smtp_pool = None
+smtp_pool_lock = threading.Lock()
+
+
+# Si cambiaron las credenciales (rotacion del password) se arma una pool nueva
+def get_smtp_pool():
+    global smtp_pool
+    #--TEST ONLY-----------------------------------------------------
+    sender_email, sender_password, smtp_server, smtp_port = get_sender_creds()
+    #----------------------------------------------------------------
+    with smtp_pool_lock:
+        if smtp_pool is None or (smtp_pool.host, smtp_pool.port, smtp_pool.user, smtp_pool.password) != (smtp_server, smtp_port, sender_email, sender_password):
+            if smtp_pool is not None:
+                smtp_pool.close()
+            smtp_pool = SmtpPool(smtp_server, smtp_port, sender_email, sender_password)
+        return smtp_pool
+
+
+def build_message(sender_email, dest_email, alert_name, body):
+    mail_footer = get_mail_footer()
+    subject = "Alerta SOC: " + alert_name.rstrip("_0")
+
+    html_body = f"""
+    <html>
+    <head></head>
+    <body>
+    <h1>{subject}</h1>
+    <p>{body}</p>
+    <!-- Add an image for your signature -->
+    {mail_footer}
+    </body>
+    </html>
+    """
+
+    message = MIMEMultipart()
+    message["From"] = sender_email
+    message["To"] = dest_email
+    message["Subject"] = subject
+    message.attach(MIMEText(html_body, "html"))
+    return message.as_string()
+
+
+# Varios mails [(dest_email, alert_name, body)] en una sola sesion
+# Devuelve True si se mandaron todos
+def send_emails(emails):
+    try:
+        pool = get_smtp_pool()
+        messages = [(pool.user, dest_email, build_message(pool.user, dest_email, alert_name, body))
+                    for dest_email, alert_name, body in emails]
+        errors = pool.send(messages)
+    except Exception as e:
+        print(f"An error occurred: {str(e)}", file=sys.stderr)
+        return False
+    for error in errors:
+        if error is None:
+            print("Email sent successfully", file=sys.stderr)
+        else:
+            print(f"An error occurred: {str(error)}", file=sys.stderr)
+    return not any(errors)
+
+
 def send_email(dest_email, alert_name, body):
-  with open('mail-footer.html', 'r') as file:
-      mail_footer = file.read()
-  subject = "Alerta SOC: " + alert_name.rstrip("_0")
-  
-  html_body = f"""
-  <html>
-  <head></head>
-  <body>
-  <h1>{subject}</h1>
-  <p>{body}</p>
-  <!-- Add an image for your signature -->
-  {mail_footer}
-  </body>
-  </html>
-  """
-  
-  #--TEST ONLY-----------------------------------------------------
-  sender_email, sender_password, smtp_server, smtp_port = get_sender_creds()
-  #----------------------------------------------------------------
-  
-  message = MIMEMultipart()
-  message["From"] = sender_email
-  message["To"] = dest_email
-  message["Subject"] = subject
-  message.attach(MIMEText(html_body, "html"))
-
-  try:
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()
-    server.login(sender_email, sender_passw)
-    server.sendmail(sender_email, dest_email, message.as_string())
-    server.quit()
-    print("Email sent successfully")
-  except Exception as e:
-    print(f"An error occurred: {str(e)}")
+    return send_emails([(dest_email, alert_name, body)])
+
+
+def send_notification(notification):
+    return send_email(notification["dest"], notification["alert_name"], notification["body"])
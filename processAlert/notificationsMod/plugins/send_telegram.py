@@ -1,27 +1,164 @@
 #!/usr/bin/python3
-# Llamado desde notify.py con los parametros (bot_token, chat_id, subject, body, parse_mode='html')
+# Plugin del canal telegram: notify.py (o el dispatcher) llama a send_notification con la notificacion
+# armada ({"chat_id", "body", "parse_mode"}); send_message(bot_token, chat_id, body, parse_mode='html') sigue andando
+import os
 import sys
+import time
+import random
+import threading
 import requests
+import credentials
 
+# La sesion HTTP queda abierta entre mensajes (keep-alive) y los envios se programan con token
+# buckets por chat y global para no pasar los limites de Telegram. Si igual llega un 429 se espera
+# el retry_after que manda Telegram; los errores de red y los 5xx se reintentan con backoff exponencial
+
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Nombre en el vault del token del bot
+TELEGRAM_BOT_NAME = "soc_updates_bot"
+
+# Limites de Telegram: ~1 mensaje por segundo por chat (con rafagas cortas) y 30 por segundo en total
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+
+# Reintentos ante errores de red / 5xx / 429, y espera base y maxima del backoff
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Segundos para conectar y para esperar la respuesta
+REQUEST_TIMEOUT = (5, 30)
+
+# Un mensaje mas largo que esto va por POST en vez de en la url
+GET_MAX_TEXT = 1024
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # Hasta cuando no se puede mandar nada (retry_after de un 429)
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    # Reserva un token y devuelve cuanto hay que esperar para usarlo; la espera se hace afuera
+    # del lock, los que llegan despues reservan los tokens siguientes
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class TelegramClient:
+    def __init__(self, api_url=TELEGRAM_API_URL, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, max_retries=MAX_RETRIES):
+        self.api_url = api_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets = {}
+        self.lock = threading.Lock()
+        self.max_retries = max_retries
+
+    def chat_bucket(self, chat_id):
+        with self.lock:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return bucket
+
+    def wait_turn(self, chat_bucket):
+        time.sleep(max(chat_bucket.reserve(), self.global_bucket.reserve()))
+
+    def request(self, bot_token, params):
+        url = f"{self.api_url}/bot{bot_token}/sendMessage"
+        if len(params["text"]) > GET_MAX_TEXT:
+            response = self.session.post(url, json=params, timeout=REQUEST_TIMEOUT)
+        else:
+            response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {"ok": False, "description": f"HTTP {response.status_code}"}
+
+    # Devuelve la respuesta de Telegram; tira la excepcion de red si se acabaron los reintentos
+    def send_message(self, bot_token, chat_id, body, parse_mode='html'):
+        params = {
+            'chat_id': chat_id,
+            'text': body,
+            'parse_mode': parse_mode,
+        }
+        chat_bucket = self.chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            self.wait_turn(chat_bucket)
+            try:
+                status, response = self.request(bot_token, params)
+            except requests.RequestException:
+                if attempt == self.max_retries:
+                    raise
+                status, response = None, None
+            if status == 429:
+                retry_after = response.get('parameters', {}).get('retry_after', 1)
+                # Frena a todos los que mandan a este chat, no solo a este intento
+                chat_bucket.pause(retry_after)
+            elif status is not None and status < 500:
+                return response
+            elif attempt < self.max_retries:
+                time.sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1))
+        return response
+
+
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    with client_lock:
+        if client is None:
+            client = TelegramClient()
+        return client
+
+
+# Devuelve True si Telegram acepto el mensaje
 def send_message(bot_token, chat_id, body, parse_mode='html'):
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    params = {
-        'chat_id': chat_id,
-        'text': body,
-        'parse_mode': parse_mode,
-    }
     error_message = None
     try:
-        response = requests.get(url, params=params).json()
+        response = get_client().send_message(bot_token, chat_id, body, parse_mode)
     except Exception as e:
-        print(f"Error: {e}")
-        error_message = "Request failed, error: {e}"
+        print(f"Error: {e}", file=sys.stderr)
+        error_message = f"Request failed, error: {e}"
 
     if error_message is not None:
-        print (error_message)
+        print (error_message, file=sys.stderr)
+        return False
     else:
         if response.get('ok'):
-            print ("Message sent successfully")
+            print ("Message sent successfully", file=sys.stderr)
+            return True
         else:
-            print (f"Failed to send message. Error: {response['description']}")
+            print (f"Failed to send message. Error: {response.get('description', response)}", file=sys.stderr)
+            return False
+
+
+def send_notification(notification):
+    bot_token = credentials.get(TELEGRAM_BOT_NAME)
+    return send_message(bot_token, notification["chat_id"], notification["body"], notification["parse_mode"])
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+import os, sys, pickle, string, hashlib, argparse
+
+# Templates de notifications.yaml compilados: cada template queda como una lista de accesos a
+# campos del doc (ya partidos por punto) y el body listo para format. Los errores que antes
+# saltaban al mandar (un {3} sin su var, un {ip} con nombre, vars que no son lista) se
+# detectan al compilar
+#
+# Lo compilado se guarda en memoria y en disco (pickle) junto con el mtime y el tamaño del yaml,
+# y se vuelve a compilar solo cuando el yaml cambia. Con el pickle al dia ni se importa PyYAML
+# NOTIFY_TEMPLATE_CACHE_DIR vacio desactiva el cache en disco
+#
+# ./templates.py /home/despegar/notifications.yaml    (valida y muestra los errores)
+
+# Cambiar TEMPLATES_VERSION si cambian las clases compiladas, asi no se cargan pickles viejos
+TEMPLATES_VERSION = 2
+TEMPLATE_CACHE_DIR = os.environ.get("NOTIFY_TEMPLATE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "notify"))
+
+CHANNELS = ("telegram", "email")
+
+
+class TemplateError(Exception):
+    pass
+
+
+class CompiledTemplate:
+    def __init__(self, channel, alert_name, config):
+        if not isinstance(config, dict):
+            raise TemplateError(f"{channel}.{alert_name}: el template tiene que tener dest, body y vars")
+        self.dest = config.get("dest")
+        self.body = config.get("body")
+        variables = config.get("vars") or []
+        if self.dest is None:
+            raise TemplateError(f"{channel}.{alert_name}: falta dest")
+        # dest puede ser uno o una lista, sale una notificacion por destino
+        self.destinations = self.dest if isinstance(self.dest, list) else [self.dest]
+        if not self.destinations:
+            raise TemplateError(f"{channel}.{alert_name}: dest es una lista vacia")
+        if not isinstance(self.body, str):
+            raise TemplateError(f"{channel}.{alert_name}: falta body o no es texto")
+        if not isinstance(variables, list) or not all(isinstance(variable, str) for variable in variables):
+            raise TemplateError(f"{channel}.{alert_name}: vars tiene que ser una lista de campos")
+        used = placeholders(self.body, f"{channel}.{alert_name}")
+        missing = [position for position in used if position >= len(variables)]
+        if missing:
+            raise TemplateError(f"{channel}.{alert_name}: el body usa {{{missing[0]}}} pero vars tiene {len(variables)} campos")
+        self.accessors = [tuple(variable.split(".")) for variable in variables]
+
+    def render(self, doc_data):
+        return self.body.format(*[field_value(doc_data, accessor) for accessor in self.accessors])
+
+
+# Posiciones que usa el body ({0}, {1}... o {} numerados en orden); los nombres no se pueden llenar desde vars
+def placeholders(body, name):
+    used = set()
+    automatic = 0
+    try:
+        parsed = list(string.Formatter().parse(body))
+    except ValueError as e:
+        raise TemplateError(f"{name}: body invalido: {e}")
+    for _, field_name, _, _ in parsed:
+        if field_name is None:
+            continue
+        first = field_name.split(".", 1)[0].split("[", 1)[0]
+        if first == "":
+            used.add(automatic)
+            automatic += 1
+        elif first.isdigit():
+            used.add(int(first))
+        else:
+            raise TemplateError(f"{name}: el body usa {{{field_name}}}, solo se pueden usar posiciones de vars")
+    return sorted(used)
+
+
+# Mismo resultado que get_json_values de notify.py, sin recursion; si un campo del medio no es
+# un diccionario (null, texto) el valor es None en vez de cortar el envio
+def field_value(doc_data, accessor):
+    value = doc_data
+    for key in accessor:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+class TemplateSet:
+    def __init__(self, template_yaml):
+        template_yaml = template_yaml or {}
+        # canal -> alert_name -> CompiledTemplate, y los que no compilaron con su error
+        self.templates = {}
+        self.errors = {}
+        for channel in CHANNELS:
+            self.templates[channel] = {}
+            for alert_name, config in (template_yaml.get(channel) or {}).items():
+                try:
+                    self.templates[channel][alert_name] = CompiledTemplate(channel, alert_name, config)
+                except TemplateError as e:
+                    self.errors[(channel, alert_name)] = str(e)
+        self.coalesce = template_yaml.get("coalesce") or {}
+
+    def get(self, channel, alert_name):
+        template = self.templates[channel].get(alert_name)
+        if template is None:
+            raise TemplateError(self.errors.get((channel, alert_name), f"no hay template de {channel} para {alert_name}"))
+        return template
+
+
+def cache_path(path):
+    return os.path.join(TEMPLATE_CACHE_DIR, hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest() + ".pickle")
+
+
+def compile_file(path):
+    # PyYAML solo hace falta cuando el yaml cambio
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "r") as file:
+        templates = TemplateSet(yaml.load(file, Loader=loader))
+    for error in templates.errors.values():
+        print(f"Template invalido en {path}: {error}", file=sys.stderr)
+    return templates
+
+
+# path -> (marca del yaml, TemplateSet) para los procesos que mandan muchas alertas
+loaded = {}
+
+
+def load(path):
+    stat = os.stat(path)
+    stamp = (TEMPLATES_VERSION, stat.st_mtime_ns, stat.st_size)
+    cached = loaded.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    templates = load_cached(path, stamp)
+    loaded[path] = (stamp, templates)
+    return templates
+
+
+# Un pickle ajeno podria ejecutar codigo al cargarse: el cache solo se usa si el directorio es
+# del usuario y nadie mas puede escribir en el (makedirs no arregla uno que ya existia abierto)
+def private_cache_dir(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return True
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o077
+
+
+# El directorio se crea solo para el usuario (ver private_cache_dir)
+def load_cached(path, stamp):
+    if not TEMPLATE_CACHE_DIR:
+        return compile_file(path)
+    if not private_cache_dir(TEMPLATE_CACHE_DIR):
+        print(f"El cache de templates {TEMPLATE_CACHE_DIR} no es privado del usuario, no se usa", file=sys.stderr)
+        return compile_file(path)
+    pickle_path = cache_path(path)
+    try:
+        with open(pickle_path, "rb") as f:
+            cached_stamp, templates = pickle.load(f)
+        if cached_stamp == stamp:
+            return templates
+    except Exception:
+        # No esta, o quedo cortado / de otra version: se compila de nuevo
+        pass
+    templates = compile_file(path)
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, mode=0o700, exist_ok=True)
+        # Se escribe aparte y se renombra, otro proceso nunca lee un pickle a medias
+        temp_path = f"{pickle_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump((stamp, templates), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, pickle_path)
+    except OSError as e:
+        print(f"No se pudo guardar el cache de templates: {e}", file=sys.stderr)
+    return templates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Valida los templates de notifications.yaml")
+    parser.add_argument("path", help="notifications.yaml a validar")
+    args = parser.parse_args()
+    templates = compile_file(args.path)
+    compiled = sum(len(channel_templates) for channel_templates in templates.templates.values())
+    print(f"{compiled} templates compilados, {len(templates.errors)} con errores")
+    sys.exit(1 if templates.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
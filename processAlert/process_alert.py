@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+import os, sys, json, argparse, contextlib
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "notificationsMod"))
+import tag_engine
+
+# Procesa una alerta de punta a punta en un solo proceso: el doc_data y el rule_config se
+# parsean una vez y cada etapa trabaja sobre el mismo diccionario, sin volver a json entre medio
+# Reemplaza a correr add_tags.py y despues notify.py con la salida del primero
+#
+# ./process_alert.py '<doc_data>' '<rule_config>' --stages tag,notify
+
+# Etapas disponibles, se corren en el orden de --stages y cada una recibe (doc_data, rule_config, args)
+def tag_stage(doc_data, rule_config, args):
+    tag_engine.cached_rules(args.rule_config, args.operator, tag_engine.load_json_arg, rule_config).tag(doc_data)
+
+
+def notify_stage(doc_data, rule_config, args):
+    # notify solo se carga si la etapa se usa (y cada plugin recien cuando manda por su canal)
+    import notify
+    notify.notify(doc_data, rule_config)
+
+
+STAGES = {
+    "tag": tag_stage,
+    "notify": notify_stage,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Taggea y notifica una alerta en un solo proceso")
+    parser.add_argument("doc_data", help="json del evento que genero la alerta")
+    parser.add_argument("rule_config", help="rule_config del modulo akinator, en json")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"etapas a correr, separadas por coma (default: {','.join(STAGES)})")
+    parser.add_argument("--operator", default="eq", choices=sorted(tag_engine.OPERATORS), help="operador por default de las condiciones de los tags (eq como add_tags, regex como add_tags_regex)")
+    # Elastalert puede pasar argumentos de mas, se ignoran como antes
+    args, _ = parser.parse_known_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"etapas desconocidas: {', '.join(unknown)} (hay: {', '.join(STAGES)})")
+
+    doc_data = tag_engine.load_json_arg(args.doc_data)
+    rule_config = tag_engine.load_json_arg(args.rule_config)
+
+    # Si una etapa falla se sigue con las demas, como cuando eran scripts separados
+    # stdout es solo el doc_data final (lo parsea el que llama, como con add_tags.py): lo que
+    # impriman las etapas o los plugins de notificacion va a stderr
+    failed = False
+    for stage in stages:
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                STAGES[stage](doc_data, rule_config, args)
+        except Exception as e:
+            print(f"Error en la etapa {stage}: {e}", file=sys.stderr)
+            failed = True
+
+    # Misma salida que add_tags.py, el doc_data con los tags
+    print(str(json.dumps(doc_data)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,754 @@
+#!/usr/bin/python3
+import gc, os, sys, io, re, gzip, json, time, bisect, pickle, hashlib, argparse, functools, itertools, contextlib, ipaddress, socketserver
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tag_metrics import TagStats, write_periodically
+
+# Motor de tags compartido por add_tags.py (value exacto) y add_tags_regex.py (value regex)
+# Cada condicion puede indicar su "operator", si no se usa el default del script:
+# {"field": "alert.src_ip", "operator": "cidr", "value": ["10.0.0.0/8", "192.168.1.1"]}
+# Operadores: eq, in, regex, prefix, suffix, cidr, range ([min, max] o lista de [min, max])
+
+# Cantidad de rule_configs distintos que se mantienen compilados en modo servicio
+RULE_CACHE_SIZE = 256
+
+# Cache en disco de rule_configs compilados, para cuando se corre un proceso por alerta
+# Cambiar ENGINE_VERSION si cambian las clases compiladas, asi no se cargan reglas viejas
+# TAG_RULE_CACHE_DIR vacio desactiva el cache
+ENGINE_VERSION = 1
+RULE_CACHE_DIR = os.environ.get("TAG_RULE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tag_engine"))
+RULE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Por debajo de este tamaño (texto del rule_config) compilar cuesta lo mismo que levantar el pickle
+RULE_CACHE_MIN_BYTES = 16 * 1024
+
+# Cada cuantos segundos se reescribe el archivo de --metrics en modo servicio
+METRICS_INTERVAL = 15
+
+# Modo batch: alertas por tarea que se manda a un proceso, y cada cuanto se informa el avance
+BATCH_CHUNK_SIZE = 1000
+PROGRESS_INTERVAL = 1.0
+
+# Caracteres con significado en una regex, un patron sin ninguno (sin escapar) es un texto literal
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+# Patrones que no se pueden meter en una alternancia sin cambiar lo que matchean:
+# backreferences / condicionales por grupo, y flags globales como "(?i)abc"
+SEPARATE_PATTERN = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|^\(\?[aiLmsux]+\)")
+
+
+# Camino de un field en dot notation, partido una sola vez al compilar la regla, ejemplo:
+# FieldPath("alert_data.agent.name").values(doc_data)
+# Recorre solo ese camino: el trabajo depende del largo del camino y no del tamaño del doc.
+# Las listas que aparecen en el camino se abren y se sigue por cada elemento
+class FieldPath:
+    def __init__(self, field):
+        self.keys = field.split('.')
+
+    def values(self, content):
+        last = len(self.keys) - 1
+        pending = [(content, 0)]
+        while pending:
+            node, depth = pending.pop()
+            if isinstance(node, list):
+                pending.extend((item, depth) for item in node)
+            elif isinstance(node, dict) and self.keys[depth] in node:
+                value = node[self.keys[depth]]
+                if depth == last:
+                    yield value
+                else:
+                    pending.append((value, depth + 1))
+
+
+# Todos los operadores reciben el value tal cual viene en la condicion
+def value_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+# eq / in: el valor del field es igual a alguno de la lista (o al value si no es lista)
+class ValueSet:
+    def __init__(self, value):
+        self.values = {element for element in value_list(value) if isinstance(element, str)}
+
+    def matches(self, value):
+        return isinstance(value, str) and value in self.values
+
+    # Valores exactos que tiene que tener el field para que se cumpla, None si no se puede saber
+    def index_values(self):
+        return self.values
+
+
+# Devuelve el texto que busca el patron si es literal ("evil\.com" -> "evil.com"), sino None
+# Solo se aceptan escapes de signos, "\d", "\w", etc. siguen siendo regex
+def literal_text(pattern):
+    text = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum():
+                return None
+            text.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in REGEX_METACHARACTERS:
+            return None
+        else:
+            text.append(char)
+    return None if escaped else "".join(text)
+
+
+# Aho-Corasick: busca todos los literales en una sola pasada sobre el valor,
+# el costo depende del largo del valor y no de cuantos literales haya en la lista
+class LiteralMatcher:
+    def __init__(self, literals):
+        self.goto = [{}]
+        self.output = [False]
+        for literal in literals:
+            node = 0
+            for char in literal:
+                if char not in self.goto[node]:
+                    self.goto[node][char] = len(self.goto)
+                    self.goto.append({})
+                    self.output.append(False)
+                node = self.goto[node][char]
+            self.output[node] = True
+        # Links de falla por niveles (BFS), cada nodo hereda si termina algun literal
+        self.fail = [0] * len(self.goto)
+        pending = list(self.goto[0].values())
+        while pending:
+            next_level = []
+            for node in pending:
+                for char, child in self.goto[node].items():
+                    fallback = self.fail[node]
+                    while fallback and char not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(char, 0) if self.goto[fallback].get(char) != child else 0
+                    self.output[child] = self.output[child] or self.output[self.fail[child]]
+                    next_level.append(child)
+            pending = next_level
+
+    def search(self, text):
+        if self.output[0]:
+            return True
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                return True
+        return False
+
+
+# regex: lista de patrones compilada una sola vez en el matcher mas barato para cada uno:
+# - "^literal$" -> set de valores exactos
+# - literal sin anclas -> Aho-Corasick
+# - el resto -> una sola regex "(?:p1)|(?:p2)|...", o de a uno si no se pueden combinar
+# Matchea si algun patron hace re.search sobre el valor
+class PatternSet:
+    def __init__(self, value):
+        exact = set()
+        literals = []
+        regexes = []
+        for pattern in value_list(value):
+            # Un patron roto falla al cargar la regla
+            compiled = re.compile(pattern)
+            anchored = pattern.startswith("^") and pattern.endswith("$") and not pattern.endswith("\\$")
+            text = literal_text(pattern[1:-1] if anchored else pattern)
+            if text is None:
+                regexes.append(compiled)
+            elif anchored:
+                exact.add(text)
+            else:
+                literals.append(text)
+        self.exact = exact
+        self.literals = LiteralMatcher(literals) if literals else None
+        self.regexes = self.combine(regexes)
+
+    @staticmethod
+    def combine(regexes):
+        if len(regexes) < 2:
+            return regexes
+        combinable = [regex.pattern for regex in regexes if not SEPARATE_PATTERN.search(regex.pattern)]
+        separate = [regex for regex in regexes if regex.pattern not in combinable]
+        if len(combinable) < 2:
+            return regexes
+        try:
+            return [re.compile("|".join(f"(?:{pattern})" for pattern in combinable))] + separate
+        except re.error:
+            return regexes
+
+    def matches(self, value):
+        if not isinstance(value, str):
+            return False
+        # "$" tambien matchea antes de un salto de linea final
+        if value in self.exact or (value.endswith("\n") and value[:-1] in self.exact):
+            return True
+        if self.literals is not None and self.literals.search(value):
+            return True
+        return any(regex.search(value) for regex in self.regexes)
+
+    # Solo se puede indexar si todos los patrones son "^literal$"
+    def index_values(self):
+        if self.literals is not None or self.regexes:
+            return None
+        return self.exact | {value + "\n" for value in self.exact}
+
+
+# prefix: trie de caracteres, se recorre el valor hasta que termina algun prefijo
+class PrefixSet:
+    def __init__(self, value):
+        self.root = {}
+        for prefix in value_list(value):
+            if not isinstance(prefix, str):
+                raise ValueError(f"{self.operator_name()} espera strings, no {prefix!r}")
+            node = self.root
+            for char in self.key(prefix):
+                node = node.setdefault(char, {})
+            node[None] = True
+
+    @staticmethod
+    def operator_name():
+        return "prefix"
+
+    @staticmethod
+    def key(text):
+        return text
+
+    def matches(self, value):
+        if not isinstance(value, str):
+            return False
+        node = self.root
+        for char in self.key(value):
+            if None in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return None in node
+
+    def index_values(self):
+        return None
+
+
+# suffix: el mismo trie, armado y recorrido con los strings dados vuelta
+class SuffixSet(PrefixSet):
+    @staticmethod
+    def operator_name():
+        return "suffix"
+
+    @staticmethod
+    def key(text):
+        return reversed(text)
+
+
+# cidr: un arbol binario por version de IP, cada red es un camino de prefixlen bits
+# Una IP se busca bit a bit desde el mas significativo hasta encontrar una red que la contenga
+class NetworkSet:
+    def __init__(self, value):
+        # nodo = [hijo bit 0, hijo bit 1, termina una red]
+        self.roots = {}
+        for network in value_list(value):
+            if not isinstance(network, str):
+                raise ValueError(f"cidr espera strings, no {network!r}")
+            network = ipaddress.ip_network(network, strict=False)
+            address = int(network.network_address)
+            node = self.roots.setdefault(network.version, [None, None, False])
+            for shift in range(network.max_prefixlen - 1, network.max_prefixlen - 1 - network.prefixlen, -1):
+                bit = (address >> shift) & 1
+                if node[bit] is None:
+                    node[bit] = [None, None, False]
+                node = node[bit]
+            node[2] = True
+
+    def matches(self, value):
+        if not isinstance(value, str):
+            return False
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return False
+        node = self.roots.get(address.version)
+        number = int(address)
+        for shift in range(address.max_prefixlen - 1, -1, -1):
+            if node is None or node[2]:
+                break
+            node = node[(number >> shift) & 1]
+        return node is not None and node[2]
+
+    def index_values(self):
+        return None
+
+
+# Numero del field o del rule_config: int, float o string numerico (no bool)
+def as_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+# range: intervalos cerrados [min, max] (null = sin limite), unidos y ordenados para buscar con bisect
+class RangeSet:
+    def __init__(self, value):
+        ranges = [value] if isinstance(value, list) and len(value) == 2 and not any(isinstance(bound, list) for bound in value) else value_list(value)
+        intervals = []
+        for interval in ranges:
+            if not isinstance(interval, list) or len(interval) != 2:
+                raise ValueError(f"range espera [min, max], no {interval!r}")
+            low = float("-inf") if interval[0] is None else as_number(interval[0])
+            high = float("inf") if interval[1] is None else as_number(interval[1])
+            if low is None or high is None:
+                raise ValueError(f"range espera numeros, no {interval!r}")
+            if low <= high:
+                intervals.append((low, high))
+        self.lows = []
+        self.highs = []
+        for low, high in sorted(intervals):
+            if self.highs and low <= self.highs[-1]:
+                self.highs[-1] = max(self.highs[-1], high)
+            else:
+                self.lows.append(low)
+                self.highs.append(high)
+
+    def matches(self, value):
+        number = as_number(value)
+        if number is None:
+            return False
+        position = bisect.bisect_right(self.lows, number) - 1
+        return position >= 0 and number <= self.highs[position]
+
+    def index_values(self):
+        return None
+
+
+OPERATORS = {
+    "eq": ValueSet,
+    "in": ValueSet,
+    "regex": PatternSet,
+    "prefix": PrefixSet,
+    "suffix": SuffixSet,
+    "cidr": NetworkSet,
+    "range": RangeSet,
+}
+
+
+# Condicion compilada: el field ya resuelto y el value armado en la estructura de su operador
+class Condition:
+    def __init__(self, condition, default_operator):
+        self.path = FieldPath(condition.get("field"))
+        operator = condition.get("operator", default_operator)
+        if operator not in OPERATORS:
+            raise ValueError(f"Operador desconocido: {operator}")
+        self.matcher = OPERATORS[operator](condition.get("value"))
+
+    def index_values(self):
+        return self.matcher.index_values()
+
+    def matches(self, doc_data):
+        return any(self.matcher.matches(value) for value in self.path.values(doc_data))
+
+
+class CompiledTag:
+    def __init__(self, tag, default_operator):
+        self.tag_name = "{}".format(tag["tag_name"])
+        # Si no se agregaron condiciones, el tag va de una
+        self.conditions = [Condition(condition, default_operator) for condition in tag["conditions"]] if "conditions" in tag else []
+
+    def matches(self, doc_data):
+        # Corta en la primera condicion que no se cumple
+        return all(condition.matches(doc_data) for condition in self.conditions)
+
+
+# rule_config compilado una sola vez, despues se aplica a cada alerta
+# Los tags se indexan por field y valor exacto: cada alerta solo evalua los tags que
+# podrian cumplirse con los valores que trae, mas los que no se pueden indexar
+class CompiledRules:
+    def __init__(self, siem_rule_config, default_operator="eq"):
+        self.tags = [CompiledTag(tag, default_operator) for tag in siem_rule_config.get("tags")] if "tags" in siem_rule_config else None
+        # field -> (FieldPath, {valor: posiciones de los tags})
+        self.index = {}
+        self.unindexed = []
+        for position, tag in enumerate(self.tags or []):
+            self.index_tag(position, tag)
+
+    # Se indexa por la condicion con menos valores, la mas selectiva
+    def index_tag(self, position, tag):
+        indexable = [(condition, condition.index_values()) for condition in tag.conditions]
+        indexable = [(condition, values) for condition, values in indexable if values is not None]
+        if not indexable:
+            self.unindexed.append(position)
+            return
+        condition, values = min(indexable, key=lambda indexed: len(indexed[1]))
+        path, postings = self.index.setdefault(".".join(condition.path.keys), (condition.path, {}))
+        # Sin valores la condicion nunca se cumple, el tag no queda en ningun lado
+        for value in values:
+            postings.setdefault(value, []).append(position)
+
+    # Posiciones de los tags a evaluar, en el orden del rule_config
+    # Cada field indexado se recorre una sola vez por alerta
+    def candidates(self, doc_data):
+        positions = set(self.unindexed)
+        for path, postings in self.index.values():
+            for value in path.values(doc_data):
+                if isinstance(value, str) and value in postings:
+                    positions.update(postings[value])
+        return sorted(positions)
+
+    # Con stats (ver tag_metrics.py) se mide cada tag evaluado, sin stats no se mide nada
+    def tag(self, doc_data, stats=None):
+        if stats is not None:
+            return self.tag_measured(doc_data, stats)
+        if self.tags is not None:
+            json_data_tags = [self.tags[position].tag_name for position in self.candidates(doc_data) if self.tags[position].matches(doc_data)]
+            if json_data_tags:
+                doc_data["tags"] = " ".join(json_data_tags)
+        return doc_data
+
+    def tag_measured(self, doc_data, stats):
+        start = time.perf_counter_ns()
+        if self.tags and id(self) not in stats.registered:
+            stats.register(id(self), [tag.tag_name for tag in self.tags])
+        evaluations = []
+        if self.tags is not None:
+            json_data_tags = []
+            for position in self.candidates(doc_data):
+                tag = self.tags[position]
+                tag_start = time.perf_counter_ns()
+                matched = tag.matches(doc_data)
+                evaluations.append((tag.tag_name, matched, time.perf_counter_ns() - tag_start))
+                if matched:
+                    json_data_tags.append(tag.tag_name)
+            if json_data_tags:
+                doc_data["tags"] = " ".join(json_data_tags)
+        stats.record(evaluations, time.perf_counter_ns() - start)
+        return doc_data
+
+
+# Arma el tag de doc_data segun los tags de siem_rule_config, devuelve el mismo doc_data
+def tag_document(doc_data, siem_rule_config, default_operator="eq"):
+    return CompiledRules(siem_rule_config, default_operator).tag(doc_data)
+
+
+# Elastalert pasa los json con comillas simples, por eso el replace
+def load_json_arg(raw):
+    return json.loads(str(raw).replace("'", '"'))
+
+
+# En modo servicio el rule_config puede venir como json valido o con comillas simples
+def parse_rule_config(raw):
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return load_json_arg(raw)
+
+
+# Archivo del cache para un rule_config: hash del texto tal cual llega, mas la version del
+# engine, el operador por default y como se parsea (todo lo que cambia el resultado)
+def rule_cache_path(raw, default_operator, parse):
+    key = "\0".join([str(ENGINE_VERSION), default_operator, parse.__name__, raw])
+    return os.path.join(RULE_CACHE_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".pickle")
+
+
+# Un pickle ajeno podria ejecutar codigo al cargarse: el cache solo se usa si el directorio es
+# del usuario y nadie mas puede escribir en el (makedirs no arregla uno que ya existia abierto)
+def private_cache_dir(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return True
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o077
+
+
+# El cache solo conviene con regex (re.compile y las alternancias combinadas) y un rule_config
+# grande: eq / prefix / cidr / etc. se compilan tan rapido como se levanta su pickle, a cualquier tamaño
+# Si hay "regex" en el texto puede haber condiciones regex, de mas solo se usa el cache sin ganar nada
+def worth_caching(raw, default_operator):
+    return len(raw) >= RULE_CACHE_MIN_BYTES and (default_operator == "regex" or "regex" in raw)
+
+
+# Compila el rule_config o lo levanta ya compilado del cache en disco
+# El directorio se crea solo para el usuario (ver private_cache_dir)
+# Si el rule_config ya esta parseado se pasa en siem_rule_config, asi no se parsea de nuevo
+def cached_rules(raw, default_operator, parse, siem_rule_config=None):
+    def compile_rules():
+        return CompiledRules(parse(raw) if siem_rule_config is None else siem_rule_config, default_operator)
+
+    if not RULE_CACHE_DIR or not worth_caching(raw, default_operator):
+        return compile_rules()
+    if not private_cache_dir(RULE_CACHE_DIR):
+        print(f"El cache de reglas {RULE_CACHE_DIR} no es privado del usuario, no se usa", file=sys.stderr)
+        return compile_rules()
+    cache_path = rule_cache_path(raw, default_operator, parse)
+    try:
+        with open(cache_path, "rb") as f:
+            # Son miles de objetos chicos, el garbage collector no tiene nada que juntar mientras se cargan
+            gc.disable()
+            try:
+                rules = pickle.load(f)
+            finally:
+                gc.enable()
+        # El mtime marca el ultimo uso, se desalojan primero los que hace mas que no se usan
+        os.utime(cache_path)
+        return rules
+    except Exception:
+        # No esta, o quedo cortado / de otra version: se compila de nuevo
+        pass
+    rules = compile_rules()
+    try:
+        store_rules(cache_path, rules)
+    except OSError as e:
+        print(f"No se pudo guardar el cache de reglas: {e}", file=sys.stderr)
+    return rules
+
+
+def store_rules(cache_path, rules):
+    os.makedirs(RULE_CACHE_DIR, mode=0o700, exist_ok=True)
+    # Se escribe aparte y se renombra, otro proceso nunca lee un pickle a medias
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(rules, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, cache_path)
+    evict_rules()
+
+
+# Mantiene el cache por debajo de RULE_CACHE_MAX_BYTES borrando los menos usados
+def evict_rules():
+    entries = []
+    with os.scandir(RULE_CACHE_DIR) as scan:
+        for entry in scan:
+            if entry.name.endswith(".pickle"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RULE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# El rule_config llega igual en cada alerta de la misma regla, asi que se parsea y compila una sola vez
+@functools.lru_cache(maxsize=RULE_CACHE_SIZE)
+def load_rules(raw, default_operator="eq"):
+    return cached_rules(raw, default_operator, parse_rule_config)
+
+
+# Cada linea trae los mismos dos json que recibe el script por argv, separados por espacio:
+# <doc_data> <rule_config>
+def tag_line(line, default_operator="eq", stats=None, decoder=json.JSONDecoder()):
+    line = line.strip()
+    try:
+        doc_data, end = decoder.raw_decode(line)
+    except ValueError:
+        line = line.replace("'", '"')
+        doc_data, end = decoder.raw_decode(line)
+    return load_rules(line[end:].strip(), default_operator).tag(doc_data, stats)
+
+
+# Procesa alertas de a una linea y responde en el mismo orden, una linea por alerta
+# Si una linea no se puede procesar se responde {"error": ...} para no correr el orden
+def serve_stream(rfile, wfile, default_operator="eq", stats=None):
+    for line_number, line in enumerate(rfile, 1):
+        if not line.strip():
+            continue
+        try:
+            response = json.dumps(tag_line(line, default_operator, stats))
+        except Exception as e:
+            print(f"Error en linea {line_number}: {e}", file=sys.stderr)
+            response = json.dumps({"error": str(e)})
+        wfile.write(response + "\n")
+        wfile.flush()
+
+
+# Cada conexion al socket es un stream independiente, con su propio orden
+class TagRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        rfile = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        wfile = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+        serve_stream(rfile, wfile, self.server.default_operator, self.server.stats)
+
+
+def serve_socket(socket_path, default_operator="eq", stats=None):
+    with socketserver.ThreadingUnixStreamServer(socket_path, TagRequestHandler) as server:
+        server.daemon_threads = True
+        server.default_operator = default_operator
+        server.stats = stats
+        server.serve_forever()
+
+
+# Archivos de entrada / salida del modo batch, los .gz se leen y escriben comprimidos, "-" es stdin / stdout
+# Se usan con with: stdin / stdout vienen envueltos para que el with no los cierre, son del proceso
+def open_text(path, mode="r"):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+# Rules del proceso de batch, se compilan una vez por proceso con el mismo load_rules del modo servicio
+batch_rules = None
+batch_operator = "eq"
+batch_measure = False
+
+
+def init_batch_worker(rules_raw, default_operator, measure=False):
+    global batch_rules, batch_operator, batch_measure
+    batch_operator = default_operator
+    batch_measure = measure
+    batch_rules = load_rules(rules_raw, default_operator) if rules_raw is not None else None
+
+
+# Con --rules cada linea es solo el doc_data, sino es "<doc_data> <rule_config>" como en modo servicio
+# Devuelve las lineas de salida, cuantas fueron error y las metricas del chunk (None si no se miden)
+def tag_chunk(lines):
+    output = []
+    errors = 0
+    stats = TagStats() if batch_measure else None
+    for line in lines:
+        try:
+            if batch_rules is None:
+                doc_data = tag_line(line, batch_operator, stats)
+            else:
+                doc_data = batch_rules.tag(json.loads(line), stats)
+            output.append(json.dumps(doc_data))
+        except Exception as e:
+            errors += 1
+            output.append(json.dumps({"error": str(e)}))
+    return output, errors, stats
+
+
+# Lineas no vacias de todos los archivos, en orden, agrupadas de a chunk_size
+def read_chunks(paths, chunk_size):
+    for path in paths:
+        with open_text(path) as f:
+            lines = (line for line in f if line.strip())
+            while True:
+                chunk = list(itertools.islice(lines, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+
+
+# Re-taggea alertas historicas repartiendo chunks en un pool de procesos
+# La salida queda en el orden de entrada: se mantienen a lo sumo 2 chunks por proceso en vuelo
+# y se escriben a medida que termina el mas viejo, sin cargar los archivos enteros en memoria
+def run_batch(paths, output_path="-", rules_path=None, default_operator="eq", workers=None, chunk_size=BATCH_CHUNK_SIZE, metrics_path=None):
+    rules_raw = None
+    if rules_path is not None:
+        with open_text(rules_path) as f:
+            rules_raw = f.read().strip()
+        # Que una regla rota falle antes de arrancar el pool
+        load_rules(rules_raw, default_operator)
+    workers = workers or os.cpu_count() or 1
+    chunks = read_chunks(paths, chunk_size)
+    total = errors = 0
+    stats = TagStats() if metrics_path else None
+    start = last_report = time.monotonic()
+
+    def report(final=False):
+        elapsed = time.monotonic() - start
+        rate = total / elapsed if elapsed else 0
+        end = "\n" if final else "\r"
+        print(f"{total} alertas, {errors} errores, {elapsed:.1f}s, {rate:.0f} alertas/s", end=end, file=sys.stderr, flush=True)
+        if stats is not None:
+            stats.write(metrics_path)
+
+    pool = None
+    with open_text(output_path, "w") as output:
+        try:
+            if workers == 1:
+                init_batch_worker(rules_raw, default_operator, stats is not None)
+                results = map(tag_chunk, chunks)
+            else:
+                pool = ProcessPoolExecutor(workers, initializer=init_batch_worker, initargs=(rules_raw, default_operator, stats is not None))
+                results = ordered_results(pool, chunks, workers * 2)
+            for lines, chunk_errors, chunk_stats in results:
+                output.write("\n".join(lines) + "\n")
+                total += len(lines)
+                errors += chunk_errors
+                if chunk_stats is not None:
+                    stats.add(chunk_stats)
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    report()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        output.flush()
+    report(final=True)
+    return total, errors
+
+
+def ordered_results(pool, chunks, in_flight):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(tag_chunk, chunk))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Entry point de add_tags.py y add_tags_regex.py, cambia solo el operador por default
+def main(default_operator="eq", description="Agrega tags a una alerta segun el rule_config"):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("doc_data", nargs="?", help="json del evento que genero la alerta")
+    parser.add_argument("rule_config", nargs="?", help="rule_config del modulo akinator, en json")
+    parser.add_argument("--serve", action="store_true", help="modo servicio: lee '<doc_data> <rule_config>' por linea desde stdin")
+    parser.add_argument("--socket", help="en modo servicio, escucha en este unix socket en vez de stdin")
+    parser.add_argument("--batch", nargs="+", metavar="NDJSON", help="modo batch: re-taggea archivos ndjson (o .gz, '-' es stdin)")
+    parser.add_argument("--rules", help="en modo batch, rule_config a aplicar a todas las lineas (cada linea es solo el doc_data)")
+    parser.add_argument("--output", default="-", help="en modo batch, archivo de salida (.gz para comprimir), por default stdout")
+    parser.add_argument("--workers", type=int, help="en modo batch, cantidad de procesos (default: uno por CPU)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help=f"en modo batch, alertas por tarea (default: {BATCH_CHUNK_SIZE})")
+    parser.add_argument("--metrics", metavar="PATH", help="mide evaluaciones, matches y tiempo por tag y exporta a PATH (Prometheus, o snapshot si termina en .json)")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL, help=f"en modo servicio, segundos entre escrituras de --metrics (default: {METRICS_INTERVAL})")
+    # Elastalert puede pasar argumentos de mas, se ignoran como antes
+    args, _ = parser.parse_known_args()
+
+    if args.batch:
+        _, errors = run_batch(args.batch, args.output, args.rules, default_operator, args.workers, args.chunk_size, args.metrics)
+        sys.exit(1 if errors else 0)
+
+    stats = TagStats() if args.metrics else None
+
+    if args.serve:
+        if stats is not None:
+            write_periodically(stats, args.metrics, args.metrics_interval)
+        try:
+            if args.socket:
+                serve_socket(args.socket, default_operator, stats)
+            else:
+                serve_stream(sys.stdin, sys.stdout, default_operator, stats)
+        finally:
+            if stats is not None:
+                stats.write(args.metrics)
+        return
+
+    if args.doc_data is None or args.rule_config is None:
+        parser.error("faltan doc_data y rule_config (o --serve / --batch)")
+
+    # Input:
+    # Arg 1 -> doc_data (contiene el json del evento que generó la alerta)
+    # Arg 2 -> rule_config del módulo akinator, en json
+    doc_data = load_json_arg(args.doc_data)
+    rules = cached_rules(args.rule_config, default_operator, load_json_arg)
+    print(str(json.dumps(rules.tag(doc_data, stats))))
+    if stats is not None:
+        stats.merge_write(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+import os, sys, json, time, fcntl, threading
+
+# Metricas opcionales de tag_engine: por tag cuantas veces se evaluo, cuantas matcheo y cuanto
+# tiempo llevo evaluarlo, mas un histograma de cuanto tarda cada alerta entera
+# Se exportan como texto de Prometheus (textfile collector) o como snapshot json si el path termina en .json
+
+# Limites (en segundos) de los buckets del histograma de latencia por alerta
+LATENCY_BUCKETS = [0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0]
+
+METRIC_PREFIX = "tag_engine"
+
+
+class TagStats:
+    def __init__(self):
+        # tag_name -> [evaluaciones, matches, nanosegundos]
+        self.tags = {}
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.documents = 0
+        self.document_ns = 0
+        # Reglas cuyos tags ya figuran (con 0 si nunca se evaluaron), por id del CompiledRules
+        self.registered = set()
+        self.lock = threading.Lock()
+
+    # El lock no viaja entre procesos (modo batch), cada proceso arma el suyo
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # Agrega los tags de un rule_config, asi los que nunca se evaluan tambien aparecen
+    def register(self, rules_id, tag_names):
+        with self.lock:
+            self.registered.add(rules_id)
+            for tag_name in tag_names:
+                self.tags.setdefault(tag_name, [0, 0, 0])
+
+    # Resultado de una alerta: [(tag_name, matcheo, nanosegundos)] y el total de la alerta
+    # Se junta todo afuera y se suma con un solo lock, los threads del socket comparten las metricas
+    def record(self, evaluations, document_ns):
+        bucket = len(LATENCY_BUCKETS)
+        seconds = document_ns / 1e9
+        for position, limit in enumerate(LATENCY_BUCKETS):
+            if seconds <= limit:
+                bucket = position
+                break
+        with self.lock:
+            for tag_name, matched, elapsed_ns in evaluations:
+                counters = self.tags.setdefault(tag_name, [0, 0, 0])
+                counters[0] += 1
+                counters[1] += matched
+                counters[2] += elapsed_ns
+            self.bucket_counts[bucket] += 1
+            self.documents += 1
+            self.document_ns += document_ns
+
+    def add(self, other):
+        with self.lock:
+            for tag_name, (evaluations, matches, elapsed_ns) in other.tags.items():
+                counters = self.tags.setdefault(tag_name, [0, 0, 0])
+                counters[0] += evaluations
+                counters[1] += matches
+                counters[2] += elapsed_ns
+            self.bucket_counts = [mine + theirs for mine, theirs in zip(self.bucket_counts, other.bucket_counts)]
+            self.documents += other.documents
+            self.document_ns += other.document_ns
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "updated": time.time(),
+                "tags": {tag_name: {"evaluations": evaluations, "matches": matches, "seconds": elapsed_ns / 1e9}
+                         for tag_name, (evaluations, matches, elapsed_ns) in sorted(self.tags.items())},
+                "documents": {
+                    "count": self.documents,
+                    "seconds": self.document_ns / 1e9,
+                    "buckets": {str(limit): count for limit, count in zip(LATENCY_BUCKETS + ["+Inf"], self.bucket_counts)},
+                },
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        stats = cls()
+        for tag_name, counters in snapshot["tags"].items():
+            stats.tags[tag_name] = [counters["evaluations"], counters["matches"], round(counters["seconds"] * 1e9)]
+        stats.documents = snapshot["documents"]["count"]
+        stats.document_ns = round(snapshot["documents"]["seconds"] * 1e9)
+        buckets = snapshot["documents"]["buckets"]
+        stats.bucket_counts = [buckets.get(str(limit), 0) for limit in LATENCY_BUCKETS + ["+Inf"]]
+        return stats
+
+    def prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            lines.extend(f"{METRIC_PREFIX}_{name}{labels} {value}" for labels, value in samples)
+
+        tags = snapshot["tags"]
+        metric("tag_evaluations_total", "counter", "Veces que se evaluaron las condiciones del tag",
+               [(tag_label(tag_name), counters["evaluations"]) for tag_name, counters in tags.items()])
+        metric("tag_matches_total", "counter", "Veces que el tag se agrego a una alerta",
+               [(tag_label(tag_name), counters["matches"]) for tag_name, counters in tags.items()])
+        metric("tag_evaluation_seconds_total", "counter", "Tiempo total evaluando las condiciones del tag",
+               [(tag_label(tag_name), repr(counters["seconds"])) for tag_name, counters in tags.items()])
+        histogram = f"{METRIC_PREFIX}_document_seconds"
+        lines.append(f"# HELP {histogram} Tiempo de taggeo por alerta")
+        lines.append(f"# TYPE {histogram} histogram")
+        cumulative = 0
+        for limit, count in snapshot["documents"]["buckets"].items():
+            cumulative += count
+            lines.append(f'{histogram}_bucket{{le="{limit}"}} {cumulative}')
+        lines.append(f"{histogram}_sum {snapshot['documents']['seconds']!r}")
+        lines.append(f"{histogram}_count {snapshot['documents']['count']}")
+        return "\n".join(lines) + "\n"
+
+    # Escribe el archivo entero y lo renombra, el collector nunca lee uno a medias
+    def write(self, path):
+        content = json.dumps(self.snapshot(), indent=2) if path.endswith(".json") else self.prometheus()
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    # Un proceso por alerta: se suma a lo que ya juntaron los procesos anteriores
+    # El acumulado vive en un snapshot json (el mismo path si es .json, sino path + ".state.json")
+    def merge_write(self, path):
+        state_path = path if path.endswith(".json") else path + ".state.json"
+        with open(state_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(state_path) as f:
+                    self.add(TagStats.from_snapshot(json.load(f)))
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+            if state_path != path:
+                self.write(state_path)
+            self.write(path)
+
+
+# Los valores de los labels escapan \, " y saltos de linea
+def tag_label(tag_name):
+    escaped = tag_name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{{tag="{escaped}"}}'
+
+
+# Modo servicio: el archivo se reescribe cada interval segundos desde un thread aparte,
+# asi el camino de cada alerta no paga nada por exportar
+def write_periodically(stats, path, interval):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                stats.write(path)
+            except OSError as e:
+                print(f"No se pudieron escribir las metricas en {path}: {e}", file=sys.stderr)
+    threading.Thread(target=loop, daemon=True).start()
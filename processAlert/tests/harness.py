@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+import os, sys, json, time, asyncio, tempfile, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lo que comparten los tests y los benchmarks, fuera de los directorios que se despliegan:
+# el dispatcher corriendo en un thread con su loop y un unix socket temporal, y un Telegram y un
+# SMTP falsos para apuntar los plugins
+
+PROCESS_ALERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOTIFY_DIR = os.path.join(PROCESS_ALERT_DIR, "notificationsMod")
+PLUGINS_DIR = os.path.join(NOTIFY_DIR, "plugins")
+
+for path in (PLUGINS_DIR, NOTIFY_DIR, PROCESS_ALERT_DIR):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+from dispatcher import MAX_LINE
+
+
+# El dispatcher en un thread con su loop, se encola por el socket como notify.py
+# stop() entrega lo que quedo en las colas (drain) y frena el loop
+class RunningDispatcher:
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.socket_path = os.path.join(tempfile.mkdtemp(), "dispatcher.sock")
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.dispatcher.start())
+        self.server = self.loop.run_until_complete(asyncio.start_unix_server(self.dispatcher.handle_client, self.socket_path, limit=MAX_LINE))
+        ready.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        async def shutdown():
+            self.server.close()
+            await self.dispatcher.drain()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+# Bot API falso: responde ok a sendMessage despues de la latencia configurada
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    def answer(self):
+        if self.headers.get("Content-Length"):
+            self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.latency)
+        self.server.received += 1
+        body = json.dumps({"ok": True, "result": {}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = answer
+    do_POST = answer
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_telegram(latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegramHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# SMTP falso: lo minimo para que smtplib mande un mensaje, con la latencia al aceptar cada DATA
+# handshake_latency simula lo que tarda un server real en el saludo y el login (TLS + auth)
+class FakeSmtpServer:
+    def __init__(self, latency, handshake_latency=0):
+        self.latency = latency
+        self.handshake_latency = handshake_latency
+        self.received = 0
+        self.connections = 0
+        self.writers = set()
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        threading.Thread(target=self.run, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.session, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+    # Corta todas las sesiones abiertas, como un server que reinicia o vence sesiones inactivas
+    def drop_sessions(self):
+        def close():
+            for writer in self.writers:
+                writer.close()
+        self.loop.call_soon_threadsafe(close)
+        time.sleep(0.1)
+
+    async def session(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        await asyncio.sleep(self.handshake_latency)
+        writer.write(b"220 fake smtp\r\n")
+        in_data = False
+        async for line in reader:
+            if in_data:
+                if line == b".\r\n":
+                    in_data = False
+                    await asyncio.sleep(self.latency)
+                    self.received += 1
+                    writer.write(b"250 queued\r\n")
+                continue
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250-fake\r\n250-AUTH PLAIN LOGIN\r\n250 OK\r\n")
+            elif command == b"AUTH":
+                await asyncio.sleep(self.handshake_latency)
+                writer.write(b"235 ok\r\n")
+            elif command == b"DATA":
+                in_data = True
+                writer.write(b"354 go ahead\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        self.writers.discard(writer)
+        writer.close()
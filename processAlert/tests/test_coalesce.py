@@ -0,0 +1,128 @@
+import os, asyncio, threading
+from harness import RunningDispatcher, wait_for, NOTIFY_DIR
+from dispatcher import Dispatcher
+from dispatcher_client import enqueue
+from outbox import Outbox
+from coalesce import Coalescer
+import notify
+import templates
+
+WINDOW = 0.5
+
+
+def alert(number, ip="10.0.0.1", window=WINDOW):
+    info = {"rule": "WAF-scan-tool-detected_0", "key": ["WAF-scan-tool-detected_0", ip], "window": window,
+            "values": {"alert.extra_data.num_hits": 100 + number % 3}}
+    return {"channel": "telegram", "chat_id": "telegram_bot_id", "body": f"Alerta {number} desde {ip}", "parse_mode": "html",
+            "coalesce": info}
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        with self.lock:
+            self.sent.append(notification)
+
+    def bodies(self):
+        with self.lock:
+            return [notification["body"] for notification in self.sent]
+
+    def senders(self):
+        return {"telegram": self.send}
+
+
+def digests(bodies):
+    return [body for body in bodies if body.startswith("<b>Resumen")]
+
+
+def test_first_alert_goes_out_and_the_rest_become_one_digest():
+    recorder = Recorder()
+    with RunningDispatcher(Dispatcher(recorder.senders())) as running:
+        for number in range(7):
+            enqueue([alert(number)], running.socket_path)
+        assert wait_for(lambda: recorder.bodies(), timeout=5)
+        assert recorder.bodies() == ["Alerta 0 desde 10.0.0.1"]
+        assert wait_for(lambda: digests(recorder.bodies()), timeout=5)
+    [digest] = digests(recorder.bodies())
+    assert len(recorder.bodies()) == 2
+    assert "6 alertas mas" in digest
+    # 1..6: cada num_hits dos veces
+    assert "alert.extra_data.num_hits: 101 (2), 102 (2), 100 (2)" in digest
+    # El coalesce no llega a los senders
+    assert all("coalesce" not in notification for notification in recorder.sent)
+
+
+def test_different_keys_are_not_held():
+    recorder = Recorder()
+    with RunningDispatcher(Dispatcher(recorder.senders())) as running:
+        for number, ip in enumerate(("10.0.0.1", "10.0.0.2", "10.0.0.3")):
+            enqueue([alert(number, ip, window=60)], running.socket_path)
+        assert wait_for(lambda: len(recorder.bodies()) == 3, timeout=5)
+    assert digests(recorder.bodies()) == []
+
+
+def test_quiet_window_closes_and_next_alert_goes_out():
+    recorder = Recorder()
+    with RunningDispatcher(Dispatcher(recorder.senders())) as running:
+        enqueue([alert(0, window=0.2)], running.socket_path)
+        assert wait_for(lambda: recorder.bodies() == ["Alerta 0 desde 10.0.0.1"], timeout=5)
+        # Sin nada agrupado la ventana se cierra sin resumen
+        assert wait_for(lambda: not running.dispatcher.coalescer.windows, timeout=5)
+        enqueue([alert(1, window=0.2)], running.socket_path)
+        assert wait_for(lambda: len(recorder.bodies()) == 2, timeout=5)
+    assert recorder.bodies() == ["Alerta 0 desde 10.0.0.1", "Alerta 1 desde 10.0.0.1"]
+
+
+def test_stopping_flushes_open_windows():
+    recorder = Recorder()
+    with RunningDispatcher(Dispatcher(recorder.senders())) as running:
+        for number in range(3):
+            enqueue([alert(number, window=60)], running.socket_path)
+        assert wait_for(lambda: running.dispatcher.coalescer.coalesced == 2, timeout=5)
+    [digest] = digests(recorder.bodies())
+    assert "2 alertas mas" in digest
+
+
+# Las alertas agrupadas esperan en el outbox hasta que se guarda el resumen, que las reemplaza
+def test_digest_replaces_held_alerts_in_outbox(tmp_path):
+    path = str(tmp_path / "outbox.sqlite")
+    outbox = Outbox(path)
+    # Se mira la base desde otra conexion, la del dispatcher se usa desde su thread
+    watcher = Outbox(path)
+    recorder = Recorder()
+    with RunningDispatcher(Dispatcher(recorder.senders(), outbox=outbox)) as running:
+        for number in range(4):
+            enqueue([alert(number, window=1)], running.socket_path)
+        assert wait_for(lambda: running.dispatcher.coalescer.coalesced == 3, timeout=5)
+        assert wait_for(lambda: watcher.counts() == {"pending": 3}, timeout=5)
+        assert wait_for(lambda: digests(recorder.bodies()), timeout=5)
+        assert wait_for(lambda: watcher.counts() == {}, timeout=5)
+    assert len(recorder.bodies()) == 2
+    watcher.close()
+    outbox.close()
+
+
+def scan_tool_doc(ip):
+    return {"alert": {"rule_name": "WAF-scan-tool-detected_0", "extra_data": {"ip_client": ip}}, "cti": "<i>sin datos de CTI</i>"}
+
+
+# Con el notifications.yaml del repo cada IP que escanea abre su propia ventana
+def test_scan_tool_alerts_are_grouped_per_client_ip():
+    template_set = templates.compile_file(os.path.join(NOTIFY_DIR, "notifications.yaml"))
+    docs = [scan_tool_doc("203.0.113.7"), scan_tool_doc("198.51.100.23"), scan_tool_doc("203.0.113.7")]
+    batches = [notify.build_notifications(doc, {"telegram_enabled": True}, template_set) for doc in docs]
+    assert [notification["coalesce"]["key"] for [notification] in batches] == [
+        ["WAF-scan-tool-detected_0", "203.0.113.7"], ["WAF-scan-tool-detected_0", "198.51.100.23"], ["WAF-scan-tool-detected_0", "203.0.113.7"]]
+
+    async def offer_all():
+        async def emit(digest, held_ids):
+            pass
+        coalescer = Coalescer(emit)
+        offered = [coalescer.offer(notification) for [notification] in batches]
+        await coalescer.flush()
+        return offered
+
+    assert asyncio.run(offer_all()) == [True, True, False]
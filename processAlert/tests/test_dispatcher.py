@@ -0,0 +1,124 @@
+import time, socket, threading
+import pytest
+from harness import RunningDispatcher, wait_for
+from dispatcher import Dispatcher
+from dispatcher_client import enqueue, EnqueueUnconfirmed
+from outbox import Outbox
+import notify
+
+
+def notification(number):
+    return {"channel": "telegram", "chat_id": "telegram_bot_id", "body": f"Alerta {number}", "parse_mode": "html"}
+
+
+# Sender lento: con cola de 1 y un solo worker, encolar varias alertas llena la cola
+class SlowChannel:
+    def __init__(self, latency):
+        self.latency = latency
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        time.sleep(self.latency)
+        with self.lock:
+            self.delivered.append(notification["body"])
+
+    def senders(self):
+        return {"telegram": self.send}
+
+
+# Con outbox el "ok" sale cuando quedaron en disco, sin esperar lugar en la cola
+def test_outbox_acks_before_the_queue_has_room(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    channel = SlowChannel(0.2)
+    with RunningDispatcher(Dispatcher(channel.senders(), {"telegram": 1}, queue_size=1, outbox=outbox)) as running:
+        start = time.perf_counter()
+        enqueue([notification(number) for number in range(6)], running.socket_path, timeout=0.5)
+        assert time.perf_counter() - start < 0.5
+        assert wait_for(lambda: len(channel.delivered) == 6, timeout=10)
+    assert sorted(channel.delivered) == [f"Alerta {number}" for number in range(6)]
+    assert outbox.counts() == {}
+    outbox.close()
+
+
+# Sin outbox el "ok" espera lugar en la cola: el cliente no recibe confirmacion pero el dispatcher
+# sigue con las notificaciones y las entrega una sola vez
+def test_timeout_without_outbox_is_unconfirmed_and_delivered_once():
+    channel = SlowChannel(0.2)
+    with RunningDispatcher(Dispatcher(channel.senders(), {"telegram": 1}, queue_size=1)) as running:
+        with pytest.raises(EnqueueUnconfirmed) as raised:
+            enqueue([notification(number) for number in range(6)], running.socket_path, timeout=0.3)
+        assert raised.value.timed_out
+        assert wait_for(lambda: len(channel.delivered) == 6, timeout=10)
+    assert sorted(channel.delivered) == [f"Alerta {number}" for number in range(6)]
+
+
+# Un canal desconocido rechaza todo lo que mando el cliente, no encola la mitad
+def test_unknown_channel_is_rejected_whole():
+    channel = SlowChannel(0)
+    with RunningDispatcher(Dispatcher(channel.senders())) as running:
+        with pytest.raises(ConnectionError) as raised:
+            enqueue([notification(1), {"channel": "fax", "body": "Alerta 2"}], running.socket_path)
+        assert not isinstance(raised.value, EnqueueUnconfirmed)
+        assert "canal desconocido" in str(raised.value)
+        enqueue([notification(3)], running.socket_path)
+        assert wait_for(lambda: channel.delivered, timeout=5)
+    assert channel.delivered == ["Alerta 3"]
+
+
+# Un cliente que se va sin leer la respuesta no rompe al dispatcher
+def test_client_gone_before_reply(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    channel = SlowChannel(0)
+    with RunningDispatcher(Dispatcher(channel.senders(), outbox=outbox)) as running:
+        for number in range(5):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(running.socket_path)
+                client.sendall(f'{{"channel": "telegram", "body": "Alerta {number}"}}\n'.encode("utf-8"))
+                client.shutdown(socket.SHUT_WR)
+        enqueue([notification(5)], running.socket_path)
+        assert wait_for(lambda: len(channel.delivered) == 6, timeout=5)
+    assert sorted(channel.delivered) == [f"Alerta {number}" for number in range(6)]
+    outbox.close()
+
+
+class NotifySpy:
+    def __init__(self, monkeypatch, error):
+        self.direct = []
+        self.stored = []
+
+        def enqueue(notifications):
+            raise error
+
+        def send_direct(notifications):
+            self.direct.append(notifications)
+            return []
+
+        monkeypatch.setattr(notify, "build_notifications", lambda doc_data, rule_config, template_set: [notification(1)])
+        monkeypatch.setattr(notify.dispatcher_client, "enqueue", enqueue)
+        monkeypatch.setattr(notify, "send_direct", send_direct)
+        monkeypatch.setattr(notify, "store_in_outbox", self.stored.append)
+        notify.notify({}, {}, template_set=object())
+
+
+# Si el dispatcher las recibio pero no confirmo, notify.py nunca las manda directo
+def test_notify_leaves_timed_out_notifications_to_the_dispatcher(monkeypatch):
+    spy = NotifySpy(monkeypatch, EnqueueUnconfirmed("sin respuesta", timed_out=True))
+    assert spy.direct == [] and spy.stored == []
+
+
+def test_notify_stores_cut_off_notifications_in_outbox(monkeypatch):
+    spy = NotifySpy(monkeypatch, EnqueueUnconfirmed("se corto la conexion"))
+    assert spy.direct == []
+    assert spy.stored == [[notification(1)]]
+
+
+def test_notify_sends_directly_without_dispatcher(monkeypatch):
+    spy = NotifySpy(monkeypatch, FileNotFoundError())
+    assert spy.direct == [[notification(1)]]
+    assert spy.stored == []
+
+
+def test_notify_sends_directly_when_dispatcher_rejects(monkeypatch):
+    spy = NotifySpy(monkeypatch, ConnectionError("el dispatcher respondio error"))
+    assert spy.direct == [[notification(1)]]
@@ -0,0 +1,51 @@
+from harness import NOTIFY_DIR
+import notify
+import templates
+
+TEMPLATE_YAML = {
+    "telegram": {
+        "Solo-telegram_0": {"dest": ["chat_1", "chat_2"], "body": "<b>Alerta: {0}</b> IP: {1}", "vars": ["alert.rule_name", "alert.extra_data.ip_client"]},
+        "Mail-roto_0": {"dest": "chat_1", "body": "Alerta: {0}", "vars": ["alert.rule_name"]},
+    },
+    "email": {
+        "Mail-roto_0": {"dest": "soc@example.com", "body": "Alerta: {0} {1}", "vars": ["alert.rule_name"]},
+    },
+}
+
+BOTH = {"telegram_enabled": True, "email_enabled": True}
+
+
+def doc(rule_name):
+    return {"alert": {"rule_name": rule_name, "extra_data": {"ip_client": "203.0.113.7"}}}
+
+
+# Sin template de mail para la regla el telegram sale igual
+def test_rule_with_template_for_one_channel_only(capsys):
+    template_set = templates.TemplateSet(TEMPLATE_YAML)
+    notifications = notify.build_notifications(doc("Solo-telegram_0"), BOTH, template_set)
+    assert notifications == [
+        {"channel": "telegram", "chat_id": chat_id, "body": "<b>Alerta: Solo-telegram_0</b> IP: 203.0.113.7", "parse_mode": "html"}
+        for chat_id in ("chat_1", "chat_2")]
+    assert "No se manda por email: no hay template de email para Solo-telegram_0" in capsys.readouterr().err
+
+
+# Un template que no compila solo deja afuera su canal
+def test_invalid_template_only_drops_its_channel(capsys):
+    template_set = templates.TemplateSet(TEMPLATE_YAML)
+    notifications = notify.build_notifications(doc("Mail-roto_0"), BOTH, template_set)
+    assert [notification["channel"] for notification in notifications] == ["telegram"]
+    assert "No se manda por email: email.Mail-roto_0: el body usa {1}" in capsys.readouterr().err
+
+
+def test_disabled_channel_is_not_built(capsys):
+    template_set = templates.TemplateSet(TEMPLATE_YAML)
+    assert notify.build_notifications(doc("Solo-telegram_0"), {"email_enabled": True}, template_set) == []
+    assert notify.build_notifications(doc("Solo-telegram_0"), {}, template_set) == []
+
+
+# La regla de scan-tool del notifications.yaml del repo no tiene template de mail
+def test_scan_tool_rule_still_sends_telegram(capsys):
+    template_set = templates.compile_file(f"{NOTIFY_DIR}/notifications.yaml")
+    notifications = notify.build_notifications(doc("WAF-scan-tool-detected_0"), BOTH, template_set)
+    assert [(notification["channel"], notification["chat_id"]) for notification in notifications] == [("telegram", "telegram_bot_id")]
+    assert "IP: 203.0.113.7" in notifications[0]["body"]
@@ -0,0 +1,139 @@
+import threading
+from harness import RunningDispatcher, wait_for
+import dispatcher
+from dispatcher import Dispatcher
+from dispatcher_client import enqueue
+from outbox import Outbox
+
+
+def notification(number, channel="telegram"):
+    return {"channel": channel, "chat_id": "telegram_bot_id", "body": f"Alerta {number}", "parse_mode": "html"}
+
+
+# Entrega o falla segun working, y anota cada body entregado
+class Channels:
+    def __init__(self, working=True):
+        self.working = working
+        self.delivered = []
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        with self.lock:
+            self.attempts += 1
+            if not self.working:
+                raise ConnectionError("canal caido")
+            self.delivered.append(notification["body"])
+
+    def senders(self):
+        return {"telegram": self.send, "email": self.send}
+
+
+def test_add_done_and_pending(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    first, second = outbox.add([notification(1), notification(2)])
+    assert [(outbox_id, body["body"]) for outbox_id, _, _, body in outbox.pending()] == [(first, "Alerta 1"), (second, "Alerta 2")]
+    outbox.apply([("done", ([first],))])
+    assert [outbox_id for outbox_id, _, _, _ in outbox.pending()] == [second]
+    outbox.close()
+
+
+def test_add_replaces_done_ids_in_one_transaction(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    held = outbox.add([notification(1), notification(2)])
+    [digest] = outbox.add([notification("resumen")], held)
+    assert [outbox_id for outbox_id, _, _, _ in outbox.pending()] == [digest]
+    outbox.close()
+
+
+def test_failed_operation_rolls_back_the_transaction(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    try:
+        outbox.apply([("add", ([notification(1)],)), ("add", ([{"body": "sin canal"}],))])
+    except KeyError:
+        pass
+    assert outbox.pending() == []
+    outbox.close()
+
+
+def test_retry_dead_and_requeue(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    first, second = outbox.add([notification(1), notification(2)])
+    outbox.apply([("retry", (first, 1, 123.0, "timeout")), ("dead", (second, 8, "canal caido"))])
+    assert [(outbox_id, attempts, next_attempt) for outbox_id, attempts, next_attempt, _ in outbox.pending()] == [(first, 1, 123.0)]
+    assert outbox.counts() == {"pending": 1, "dead": 1}
+    assert [(outbox_id, attempts, error) for outbox_id, _, attempts, error, _, _ in outbox.dead_letters()] == [(second, 8, "canal caido")]
+    assert outbox.requeue_dead() == 1
+    assert [(outbox_id, attempts) for outbox_id, attempts, _, _ in outbox.pending()] == [(first, 1), (second, 0)]
+    outbox.close()
+
+
+def test_pending_survives_reopening(tmp_path):
+    path = str(tmp_path / "outbox.sqlite")
+    outbox = Outbox(path)
+    outbox.add([notification(1)])
+    outbox.close()
+    outbox = Outbox(path)
+    assert [body["body"] for _, _, _, body in outbox.pending()] == ["Alerta 1"]
+    outbox.close()
+
+
+def test_delivered_notifications_leave_the_outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    channels = Channels()
+    with RunningDispatcher(Dispatcher(channels.senders(), outbox=outbox)) as running:
+        for number in range(10):
+            enqueue([notification(number), notification(number, "email")], running.socket_path)
+        assert wait_for(lambda: len(channels.delivered) == 20)
+    assert sorted(channels.delivered) == sorted(f"Alerta {number}" for number in range(10) for _ in range(2))
+    assert outbox.counts() == {}
+    outbox.close()
+
+
+# Un dispatcher con el canal caido se frena con todo pendiente; otro con el mismo outbox lo entrega
+def test_restart_redelivers_pending(tmp_path, monkeypatch):
+    monkeypatch.setattr(dispatcher, "RETRY_BASE", 0.3)
+    path = str(tmp_path / "outbox.sqlite")
+    outbox = Outbox(path)
+    down = Channels(working=False)
+    with RunningDispatcher(Dispatcher(down.senders(), outbox=outbox)) as running:
+        enqueue([notification(number) for number in range(5)], running.socket_path)
+        assert wait_for(lambda: down.attempts >= 5)
+    outbox.close()
+
+    outbox = Outbox(path)
+    assert outbox.counts() == {"pending": 5}
+    up = Channels()
+    with RunningDispatcher(Dispatcher(up.senders(), outbox=outbox)):
+        assert wait_for(lambda: len(up.delivered) == 5, timeout=10)
+    assert sorted(up.delivered) == [f"Alerta {number}" for number in range(5)]
+    assert outbox.counts() == {}
+    outbox.close()
+
+
+# Lo que dejo otro proceso (notify.py sin dispatcher) lo toma el escaneo del arranque
+def test_pending_from_other_process_is_delivered(tmp_path):
+    path = str(tmp_path / "outbox.sqlite")
+    other = Outbox(path)
+    other.add([notification(1), notification(2, "email")])
+    other.close()
+    outbox = Outbox(path)
+    channels = Channels()
+    with RunningDispatcher(Dispatcher(channels.senders(), outbox=outbox)):
+        assert wait_for(lambda: len(channels.delivered) == 2, timeout=10)
+    assert outbox.counts() == {}
+    outbox.close()
+
+
+def test_dead_letter_after_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(dispatcher, "RETRY_BASE", 0.01)
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    channels = Channels(working=False)
+    instance = Dispatcher(channels.senders(), outbox=outbox, max_attempts=3)
+    with RunningDispatcher(instance) as running:
+        enqueue([notification(1), notification(2)], running.socket_path)
+        assert wait_for(lambda: instance.dead["telegram"] == 2, timeout=10)
+    assert channels.attempts == 6
+    assert outbox.counts() == {"dead": 2}
+    assert [attempts for _, _, attempts, _, _, _ in outbox.dead_letters()] == [3, 3]
+    outbox.close()
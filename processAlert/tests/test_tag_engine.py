@@ -0,0 +1,57 @@
+import io, sys, json
+import pytest
+import harness
+import tag_engine
+
+
+@pytest.fixture(autouse=True)
+def no_rule_cache(monkeypatch):
+    monkeypatch.setattr(tag_engine, "RULE_CACHE_DIR", "")
+
+
+RULE_CONFIG = {"tags": [{"tag_name": "waf", "conditions": [{"field": "alert.rule_name", "value": ["WAF-10k-in-10min_0"]}]}]}
+
+
+# "-" lee de stdin y escribe en stdout sin cerrarlos, son del proceso
+def test_batch_from_stdin_leaves_stdin_and_stdout_open(monkeypatch):
+    docs = [{"alert": {"rule_name": name}} for name in ("WAF-10k-in-10min_0", "Otra_0")]
+    stdin = io.StringIO("".join(f"{json.dumps(doc)} {json.dumps(RULE_CONFIG)}\n" for doc in docs))
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdin", stdin)
+    monkeypatch.setattr(sys, "stdout", stdout)
+    assert tag_engine.run_batch(["-"], "-", workers=1) == (2, 0)
+    assert not stdin.closed and not stdout.closed
+    assert [json.loads(line).get("tags") for line in stdout.getvalue().splitlines()] == ["waf", None]
+
+
+def regex_rule_config(tags):
+    return {"tags": [{"tag_name": f"tag{number}", "conditions": [{"field": "alert.rule_name", "operator": "regex", "value": [f"^WAF-{number}.*"]}]}
+                     for number in range(tags)]}
+
+
+def eq_rule_config(tags):
+    return {"tags": [{"tag_name": f"tag{number}", "conditions": [{"field": "alert.rule_name", "value": [f"WAF-{number}"]}]}
+                     for number in range(tags)]}
+
+
+def cached_files(cache_dir):
+    return sorted(path.name for path in cache_dir.glob("*.pickle")) if cache_dir.exists() else []
+
+
+# Solo se guardan los rule_configs grandes con regex, los otros compilan igual de rapido
+@pytest.mark.parametrize("rule_config, default_operator, cached", [
+    (regex_rule_config(5), "eq", False),
+    (eq_rule_config(500), "eq", False),
+    (regex_rule_config(500), "eq", True),
+    (eq_rule_config(500), "regex", True),
+])
+def test_disk_cache_only_for_large_regex_rule_configs(tmp_path, monkeypatch, rule_config, default_operator, cached):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(tag_engine, "RULE_CACHE_DIR", str(cache_dir))
+    raw = json.dumps(rule_config)
+    rules = tag_engine.cached_rules(raw, default_operator, tag_engine.parse_rule_config)
+    assert len(cached_files(cache_dir)) == (1 if cached else 0)
+    # Lo que sale del cache taggea igual que lo recien compilado
+    again = tag_engine.cached_rules(raw, default_operator, tag_engine.parse_rule_config)
+    doc = {"alert": {"rule_name": "WAF-3"}}
+    assert again.tag(dict(doc)) == rules.tag(dict(doc))
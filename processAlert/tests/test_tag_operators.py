@@ -0,0 +1,247 @@
+import os, re, sys, json, random, ipaddress, subprocess
+import pytest
+from harness import PROCESS_ALERT_DIR
+import tag_engine
+
+# Cada operador de tag_engine contra una version ingenua (un valor por vez, sin indices ni tries),
+# y add_tags.py / add_tags_regex.py contra lo que hacian antes de tag_engine (finder sobre todo el doc)
+
+SEED = 37
+RULE_NAMES = ["WAF-10k-in-10min_0", "WAF-scan-tool-detected_0", "Brute-force-login_0"]
+USERS = ["root", "admin", "Admin", "guest", "svc-backup", "svc-web", "ana", ""]
+HOSTS = ["evil.com", "www.evil.com", "evil.com.ar", "good.org", "mail.good.org", "x.evil.co"]
+IPS = ["10.0.0.1", "10.1.2.3", "10.255.255.255", "11.0.0.1", "192.168.1.1", "192.168.1.200", "172.16.5.4",
+       "8.8.8.8", "::1", "2001:db8::1", "2001:db9::1", "no-es-ip", "010.0.0.1"]
+NUMBERS = [0, 1, 9, 10, 99, 100, 101, 1000, -5, 2.5, "50", "7.5", "abc", True, None]
+FIELDS = ["alert.rule_name", "alert.extra_data.ip_client", "alert.extra_data.num_hits", "alert_data.events.user",
+          "alert_data.events.host", "alert_data.events.src_ip", "alert_data.nested.deep.user", "alert_data.missing"]
+
+
+def random_doc(rng):
+    def odd_value():
+        return rng.choice([None, 5, ["root", "admin"], {"user": "root"}])
+
+    events = [{"user": rng.choice(USERS), "host": rng.choice(HOSTS), "src_ip": rng.choice(IPS), "bytes": rng.choice(NUMBERS)}
+              for _ in range(rng.randint(0, 4))]
+    if events and rng.random() < 0.2:
+        events[0]["user"] = odd_value()
+    return {
+        "alert": {
+            "rule_name": rng.choice(RULE_NAMES),
+            "extra_data": {"ip_client": rng.choice(IPS), "num_hits": rng.choice(NUMBERS)},
+        },
+        "alert_data": {
+            "events": events,
+            # Listas dentro de listas en el medio del camino
+            "nested": [[{"deep": {"user": rng.choice(USERS)}}], {"deep": {"user": rng.choice(USERS)}}],
+        },
+    }
+
+
+# Los valores que hay en el camino del field, recorriendo el doc como el finder original
+def reference_values(content, keys):
+    if isinstance(content, list):
+        return [value for item in content for value in reference_values(item, keys)]
+    if not isinstance(content, dict) or keys[0] not in content:
+        return []
+    if len(keys) == 1:
+        return [content[keys[0]]]
+    return reference_values(content[keys[0]], keys[1:])
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def reference_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def reference_ip(value):
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+
+def reference_ranges(value):
+    if len(value) == 2 and not any(isinstance(bound, list) for bound in value):
+        value = [value]
+    return [(float("-inf") if low is None else float(low), float("inf") if high is None else float(high)) for low, high in value]
+
+
+# operador -> (valor del field, value de la condicion) -> se cumple
+REFERENCE = {
+    "eq": lambda field_value, value: isinstance(field_value, str) and field_value in as_list(value),
+    "in": lambda field_value, value: isinstance(field_value, str) and field_value in as_list(value),
+    "regex": lambda field_value, value: isinstance(field_value, str) and any(re.search(pattern, field_value) for pattern in as_list(value)),
+    "prefix": lambda field_value, value: isinstance(field_value, str) and any(field_value.startswith(prefix) for prefix in as_list(value)),
+    "suffix": lambda field_value, value: isinstance(field_value, str) and any(field_value.endswith(suffix) for suffix in as_list(value)),
+    "cidr": lambda field_value, value: isinstance(field_value, str) and reference_ip(field_value) is not None and any(
+        reference_ip(field_value).version == network.version and reference_ip(field_value) in network
+        for network in (ipaddress.ip_network(network, strict=False) for network in as_list(value))),
+    "range": lambda field_value, value: reference_number(field_value) is not None and any(
+        low <= reference_number(field_value) <= high for low, high in reference_ranges(value)),
+}
+
+# Values de condicion por operador, con los casos que cada matcher resuelve distinto
+PATTERNS = ["^root$", "^admin$", "^evil\\.com$", "evil\\.com", "good", "^svc-", "backup$", "(?i)^admin$", "a+d",
+            "(a)\\1", "^\\d+\\.\\d+\\.", "^$", "^ana$|^guest$", "\\.org$", "[", "ro{2}t"]
+NETWORKS = ["10.0.0.0/8", "10.1.2.3", "192.168.1.0/25", "172.16.0.0/12", "0.0.0.0/0", "2001:db8::/32", "::1/128", "10.0.0.1/16"]
+RANGES = [[0, 10], [10, 100], [None, 0], [100, None], [2.5, 2.5], ["5", "60"], [50, 10]]
+
+
+def random_value(rng, operator):
+    if operator in ("eq", "in"):
+        values = rng.sample(USERS + HOSTS + RULE_NAMES + IPS, rng.randint(0, 4))
+        return values[0] if values and rng.random() < 0.3 else values
+    if operator == "regex":
+        patterns = [pattern for pattern in rng.sample(PATTERNS, rng.randint(1, 4)) if pattern != "["]
+        return patterns[0] if len(patterns) == 1 and rng.random() < 0.5 else patterns
+    if operator == "prefix":
+        return rng.sample(["svc-", "ad", "Ad", "", "10.", "192.168.1.1", "evil", "www."], rng.randint(1, 3))
+    if operator == "suffix":
+        return rng.sample(["evil.com", ".org", "n", "backup", ".1", "", "::1"], rng.randint(1, 3))
+    if operator == "cidr":
+        return rng.sample(NETWORKS, rng.randint(1, 3))
+    ranges = rng.sample(RANGES, rng.randint(1, 3))
+    return ranges[0] if len(ranges) == 1 and rng.random() < 0.5 else ranges
+
+
+@pytest.mark.parametrize("operator", sorted(tag_engine.OPERATORS))
+def test_operator_matches_reference(operator):
+    rng = random.Random(f"{SEED}-{operator}")
+    docs = [random_doc(rng) for _ in range(60)]
+    checked = matched = 0
+    for _ in range(40):
+        value = random_value(rng, operator)
+        field = rng.choice(FIELDS)
+        condition = tag_engine.Condition({"field": field, "operator": operator, "value": value}, "eq")
+        for doc in docs:
+            expected = any(REFERENCE[operator](field_value, value) for field_value in reference_values(doc, field.split(".")))
+            assert condition.matches(doc) == expected, (operator, field, value, doc)
+            checked += 1
+            matched += expected
+    # Que la muestra tenga de los dos casos
+    assert 0 < matched < checked
+
+
+def test_regex_edge_cases_match_re_search():
+    for patterns, values in (
+        (["^root$"], ["root", "root\n", "xroot", "root2"]),
+        (["evil\\.com"], ["www.evil.com", "evilxcom", "EVIL.COM"]),
+        (["(?i)admin", "(a)\\1", "ro{2}t"], ["ADMIN", "aa", "root", "rot", "b"]),
+        (["x", "^y", "z$", "\\$"], ["ax", "yb", "bz", "b", "$"]),
+    ):
+        matcher = tag_engine.PatternSet(patterns)
+        for value in values:
+            assert matcher.matches(value) == any(re.search(pattern, value) for pattern in patterns), (patterns, value)
+
+
+@pytest.mark.parametrize("operator, value", [("regex", ["["]), ("cidr", ["10.0.0.0/33"]), ("range", [[1]]), ("range", [["a", 2]]),
+                                             ("prefix", [1]), ("nope", ["x"])])
+def test_invalid_conditions_fail_when_compiling(operator, value):
+    with pytest.raises((ValueError, re.error)):
+        tag_engine.Condition({"field": "alert.rule_name", "operator": operator, "value": value}, "eq")
+
+
+# Lo que hacian add_tags.py / add_tags_regex.py antes de tag_engine, tal cual
+def baseline_finder(content, pattern, match_key, regex, current_path=None, found_flag=None):
+    if current_path is None:
+        current_path = []
+    if found_flag is None:
+        found_flag = [False]
+    match_key_list = match_key.split('.')
+    if regex:
+        pattern = re.compile(pattern)
+
+    if isinstance(content, dict) and not found_flag[0]:
+        for key, value in content.items():
+            if key in match_key_list:
+                if current_path + [key] == match_key_list:
+                    if isinstance(value, str):
+                        if (pattern.search(value) if regex else value == pattern):
+                            found_flag[0] = True
+                            break
+                else:
+                    baseline_finder(value, pattern, match_key, regex, current_path + [key], found_flag)
+    elif isinstance(content, list) and not found_flag[0]:
+        for item in content:
+            baseline_finder(item, pattern, match_key, regex, current_path, found_flag)
+
+    return found_flag[0]
+
+
+def baseline_tag(doc_data, siem_rule_config, regex):
+    if "tags" in siem_rule_config:
+        json_data_tags = ""
+        for tag in siem_rule_config.get("tags"):
+            if not "conditions" in tag:
+                json_data_tags += "{} ".format(tag["tag_name"])
+            else:
+                true_in_all_conditions = True
+                for condition in tag["conditions"]:
+                    field = condition.get("field")
+                    value = condition.get("value")
+                    if true_in_all_conditions:
+                        list_match_flag = False
+                        if isinstance(value, list):
+                            for element in value:
+                                if baseline_finder(doc_data, element, field, regex):
+                                    list_match_flag = True
+                            if not list_match_flag:
+                                true_in_all_conditions = False
+                        else:
+                            true_in_all_conditions = baseline_finder(doc_data, value, field, regex)
+                if true_in_all_conditions:
+                    json_data_tags += "{} ".format(tag["tag_name"])
+        if json_data_tags != "":
+            doc_data["tags"] = json_data_tags[:-1]
+    return doc_data
+
+
+def random_rule_config(rng, regex, tags):
+    rule_tags = []
+    for number in range(tags):
+        tag = {"tag_name": f"tag{number}"}
+        if rng.random() > 0.1:
+            tag["conditions"] = [{"field": rng.choice(FIELDS), "value": random_value(rng, "regex" if regex else "eq")}
+                                 for _ in range(rng.randint(1, 3))]
+        rule_tags.append(tag)
+    return {"tags": rule_tags}
+
+
+def run_script(script, args=(), stdin=None):
+    env = dict(os.environ, TAG_RULE_CACHE_DIR="")
+    completed = subprocess.run([sys.executable, os.path.join(PROCESS_ALERT_DIR, script), *args], input=stdin,
+                               capture_output=True, text=True, check=True, env=env)
+    return completed.stdout.splitlines()
+
+
+@pytest.mark.parametrize("script, regex", [("add_tags.py", False), ("add_tags_regex.py", True)])
+def test_scripts_match_baseline(script, regex):
+    rng = random.Random(f"{SEED}-{script}")
+    cases = []
+    for _ in range(30):
+        rule_config = random_rule_config(rng, regex, rng.randint(1, 25))
+        cases.extend((random_doc(rng), rule_config) for _ in range(10))
+    expected = [json.dumps(baseline_tag(json.loads(json.dumps(doc)), rule_config, regex)) for doc, rule_config in cases]
+    assert any("tags" in json.loads(line) for line in expected)
+
+    # Como lo llama Elastalert: un proceso por alerta, json por argv
+    for (doc, rule_config), line in list(zip(cases, expected))[::60]:
+        assert run_script(script, [json.dumps(doc), json.dumps(rule_config)]) == [line]
+
+    # Modo servicio, la misma salida por linea
+    lines = "".join(f"{json.dumps(doc)} {json.dumps(rule_config)}\n" for doc, rule_config in cases)
+    assert run_script(script, ["--serve"], lines) == expected
+
+    # El engine en el proceso, con los tags indexados
+    operator = "regex" if regex else "eq"
+    for (doc, rule_config), line in zip(cases, expected):
+        assert json.dumps(tag_engine.CompiledRules(rule_config, operator).tag(json.loads(json.dumps(doc)))) == line